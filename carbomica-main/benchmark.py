@@ -0,0 +1,366 @@
+"""
+Benchmark harness for the engine.
+
+Builds synthetic input workbooks from templates/input_data_template.xlsx at a grid of scales
+(number of interventions x number of facilities, one workbook per facility as the engine runs
+one facility per project) and times the main stages for each scale:
+
+    generate_books, project_load, coverage_scenario, budget_scenario, optimization,
+    optimization_fast, optimization_greedy (optimization methods using the evaluator.py model)
+
+Synthetic data and the optimiser are seeded, so runs on the same machine are comparable.
+Results are written as JSON and can be compared against a baseline file:
+
+    python benchmark.py run --out bench.json
+    python benchmark.py run --interventions 5,20 --facilities 1 --out bench.json --baseline baseline.json
+    python benchmark.py compare bench.json baseline.json --threshold 0.25
+
+compare (and run --baseline) exit with status 1 when any stage is slower than the baseline by
+more than the threshold (a fraction, 0.25 = 25%).
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = Path(__file__).resolve().parent
+TEMPLATE = REPO_ROOT / "templates" / "input_data_template.xlsx"
+
+STAGES = ("generate_books", "project_load", "coverage_scenario", "budget_scenario", "optimization", "optimization_fast", "optimization_greedy")
+DEFAULT_INTERVENTIONS = (5, 20, 100)
+DEFAULT_FACILITIES = (1, 10, 50)
+DEFAULT_SPENDING = 50000
+DEFAULT_BUDGETS = (50000,)
+DEFAULT_SEED = 0
+DEFAULT_THRESHOLD = 0.25
+# differences below this many seconds are treated as noise when comparing
+MIN_SECONDS = 0.05
+START_YEAR = 2024
+
+
+# ---------- synthetic inputs ----------
+
+def _n_sources(n_interventions: int) -> int:
+    # keep roughly four interventions per emission source: each Covout enumerates 2^n program
+    # combinations, so piling every intervention onto one source would dominate the timings
+    return max(2, math.ceil(n_interventions / 4))
+
+
+def make_workbook(path, n_interventions: int, facility_index: int = 1, seed: int = DEFAULT_SEED) -> Path:
+    '''
+    Write a synthetic input workbook with the layout of the input data template.
+    :param path: Workbook to write.
+    :param n_interventions: Number of interventions.
+    :param facility_index: Facility number (facility_<n>), also mixed into the seed.
+    :param seed: Seed for the random emissions, effects and costs.
+    :return: Path of the workbook.
+    '''
+    rng = np.random.default_rng([seed, n_interventions, facility_index])
+    n_sources = _n_sources(n_interventions)
+    facility = f"facility_{facility_index}"
+    sources = [f"emission_{j + 1}" for j in range(n_sources)]
+    interventions = [f"intervention_{i + 1}" for i in range(n_interventions)]
+
+    targets = pd.DataFrame("", index=pd.Index(interventions, name="interventions"), columns=sources)
+    for i, intervention in enumerate(interventions):
+        targets.loc[intervention, sources[i % n_sources]] = "y"
+        if i % 3 == 0:
+            targets.loc[intervention, sources[(i + 1) % n_sources]] = "y"
+
+    def per_facility(suffix, values):
+        return pd.DataFrame([values], index=pd.Index([facility], name="facilities"), columns=[f"{x}{suffix}" for x in interventions])
+
+    sheets = {
+        "facility": pd.DataFrame({"Code Name": [facility], "Display Name": [f"Facility {facility_index}"]}),
+        "emission sources": pd.DataFrame({"Code Name": sources, "Display Name": [f"Emission source {j + 1}" for j in range(n_sources)]}),
+        "emission data": pd.DataFrame([rng.uniform(1e3, 2e5, n_sources).round()], index=pd.Index([facility], name="facilities"), columns=sources).reset_index(),
+        "interventions": pd.DataFrame({"Code Name": interventions, "Display Name": [f"Intervention {i + 1}" for i in range(n_interventions)]}),
+        "emission targets": targets.reset_index(),
+        "effect sizes": per_facility("_effect", rng.uniform(0.05, 0.95, n_interventions).round(3)).reset_index(),
+        "implementation costs": per_facility("_cost", rng.uniform(1e3, 1e5, n_interventions).round()).reset_index(),
+        "maintenance costs": per_facility("_cost", rng.uniform(1e2, 1e4, n_interventions).round()).reset_index(),
+    }
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    contents = pd.read_excel(TEMPLATE, sheet_name="Contents", header=None)
+    with pd.ExcelWriter(path) as writer:
+        contents.to_excel(writer, sheet_name="Contents", header=False, index=False)
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+    return path
+
+
+def make_projects(root, n_interventions: int, n_facilities: int, seed: int = DEFAULT_SEED) -> List[Path]:
+    '''
+    Create one project folder (input workbook + variables.json) per facility under root.
+    :return: List of project folders.
+    '''
+    dirs = []
+    for k in range(1, n_facilities + 1):
+        proj = Path(root) / f"facility_{k}"
+        make_workbook(proj / "input_data.xlsx", n_interventions, k, seed)
+        (proj / "variables.json").write_text(json.dumps({"start_year": START_YEAR, "input_filename": "input_data.xlsx"}), encoding="utf-8")
+        dirs.append(proj)
+    return dirs
+
+
+# ---------- timing ----------
+
+def bench_project(project_dir, stages=STAGES, spending=DEFAULT_SPENDING, budgets=DEFAULT_BUDGETS, seed: int = DEFAULT_SEED) -> Dict[str, Any]:
+    '''
+    Time the requested stages for one project folder.
+    :return: {"timings": {stage: seconds}, "breakdown": {stage: {trace stage: seconds}}}
+    '''
+    from books import generate_books
+    from project import load_project
+    from tracing import trace_run
+    import scenarios
+
+    project_dir = Path(project_dir)
+    os.environ["PROJECT_DIR"] = str(project_dir)
+    vars_data = json.loads((project_dir / "variables.json").read_text(encoding="utf-8"))
+    start_year = int(vars_data["start_year"])
+    books_dir = project_dir / "books"
+    timings: Dict[str, float] = {}
+    breakdown: Dict[str, Dict[str, float]] = {}
+
+    def timed(stage, fn):
+        with trace_run() as trace:
+            t0 = time.perf_counter()
+            out = fn()
+            timings[stage] = time.perf_counter() - t0
+        breakdown[stage] = trace.stage_timings()
+        return out
+
+    # later stages need the books and the project even when only they are being timed
+    input_sheet = str(project_dir / vars_data["input_filename"])
+    books = lambda: generate_books(input_sheet, start_year, start_year + 5, output_dir=str(books_dir))
+    if "generate_books" in stages:
+        timed("generate_books", books)
+    else:
+        books()
+    load = lambda: load_project(project_dir, books_dir=books_dir, regenerate=False)
+    ctx = timed("project_load", load) if "project_load" in stages else load()
+
+    scenarios.ensure_results_for_project(str(project_dir))
+    args = (ctx["P"], ctx["progset"], ctx["start_year"], ctx["facility_code"])
+    if "coverage_scenario" in stages:
+        timed("coverage_scenario", lambda: scenarios.coverage_scenario(*args))
+    if "budget_scenario" in stages:
+        timed("budget_scenario", lambda: scenarios.budget_scenario(*args, spending))
+    if "optimization" in stages:
+        np.random.seed(seed)  # PSO draws its swarm from the global numpy state
+        timed("optimization", lambda: scenarios.optimization(*args, list(budgets)))
+    if "optimization_fast" in stages:
+        timed("optimization_fast", lambda: scenarios.optimization(*args, list(budgets), method="fast"))
+    if "optimization_greedy" in stages:
+        timed("optimization_greedy", lambda: scenarios.optimization(*args, list(budgets), method="greedy", report_gap=False))
+    return {"timings": timings, "breakdown": breakdown}
+
+
+def bench_case(workdir, n_interventions: int, n_facilities: int, stages=STAGES, repeat: int = 1, spending=DEFAULT_SPENDING, budgets=DEFAULT_BUDGETS, seed: int = DEFAULT_SEED) -> Dict[str, Any]:
+    '''
+    Benchmark one scale. Stage times are summed over facilities; the reported value is the
+    median over `repeat` passes.
+    '''
+    dirs = make_projects(Path(workdir) / f"i{n_interventions}_f{n_facilities}", n_interventions, n_facilities, seed)
+    runs: Dict[str, List[float]] = {s: [] for s in stages}
+    breakdown: Dict[str, Dict[str, float]] = {}
+    for _ in range(max(1, repeat)):
+        totals = {s: 0.0 for s in stages}
+        for proj in dirs:
+            res = bench_project(proj, stages, spending, budgets, seed)
+            for stage, secs in res["timings"].items():
+                totals[stage] += secs
+            for stage, sub in res["breakdown"].items():
+                agg = breakdown.setdefault(stage, {})
+                for name, secs in sub.items():
+                    agg[name] = agg.get(name, 0.0) + secs / max(1, repeat)
+        for stage in stages:
+            runs[stage].append(totals[stage])
+
+    timings = {}
+    for stage in stages:
+        median = statistics.median(runs[stage])
+        timings[stage] = {"seconds": median, "per_facility": median / n_facilities, "runs": runs[stage]}
+    return {
+        "key": f"i{n_interventions}_f{n_facilities}",
+        "interventions": n_interventions,
+        "facilities": n_facilities,
+        "emission_sources": _n_sources(n_interventions),
+        "timings": timings,
+        "breakdown": breakdown,
+    }
+
+
+def _meta(args) -> Dict[str, Any]:
+    try:
+        import atomica
+        atomica_version = atomica.__version__
+    except Exception:
+        atomica_version = None
+    return {
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "atomica": atomica_version,
+        "numpy": np.__version__,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "spending": args.spending,
+        "budgets": list(args.budgets),
+        "stages": list(args.stages),
+    }
+
+
+# ---------- comparison ----------
+
+def compare(current: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD, min_seconds: float = MIN_SECONDS) -> List[Dict[str, Any]]:
+    '''
+    Compare two benchmark result files stage by stage.
+    :param threshold: Allowed slowdown as a fraction of the baseline time.
+    :param min_seconds: Absolute slowdowns below this are never flagged.
+    :return: One row per (scale, stage) present in both files, with a "regression" flag.
+    '''
+    base_cases = {c["key"]: c for c in baseline.get("cases", [])}
+    rows = []
+    for case in current.get("cases", []):
+        base = base_cases.get(case["key"])
+        if base is None:
+            continue
+        for stage, cur in case["timings"].items():
+            old = base["timings"].get(stage)
+            if old is None:
+                continue
+            b, c = old["seconds"], cur["seconds"]
+            ratio = c / b if b > 0 else float("inf")
+            rows.append({
+                "key": case["key"], "stage": stage, "baseline": b, "current": c, "ratio": ratio,
+                "regression": ratio > 1 + threshold and (c - b) > min_seconds,
+            })
+    return rows
+
+
+def _print_comparison(rows: List[Dict[str, Any]], threshold: float) -> bool:
+    print(f"{'scale':<12}{'stage':<20}{'baseline s':>12}{'current s':>12}{'ratio':>8}")
+    for r in rows:
+        flag = "  REGRESSION" if r["regression"] else ""
+        print(f"{r['key']:<12}{r['stage']:<20}{r['baseline']:>12.3f}{r['current']:>12.3f}{r['ratio']:>8.2f}{flag}")
+    failed = [r for r in rows if r["regression"]]
+    if failed:
+        print(f"{len(failed)} stage(s) slower than baseline by more than {threshold:.0%}")
+    else:
+        print(f"No regressions (threshold {threshold:.0%}, {len(rows)} stage(s) compared)")
+    return not failed
+
+
+# ---------- CLI ----------
+
+def _int_list(raw: str) -> List[int]:
+    return [int(x) for x in raw.split(",") if x.strip()]
+
+
+def _float_list(raw: str) -> List[float]:
+    return [float(x) for x in raw.split(",") if x.strip()]
+
+
+def _stage_list(raw: str) -> List[str]:
+    stages = [x.strip() for x in raw.split(",") if x.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise ValueError(f"unknown stage(s): {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+    return stages
+
+
+def _cmd_run(args) -> int:
+    import matplotlib
+    matplotlib.use("Agg")
+    # resolve user paths before moving to the repo root
+    out = Path(args.out).resolve()
+    baseline_path = Path(args.baseline).resolve() if args.baseline else None
+    if args.workdir:
+        args.workdir = str(Path(args.workdir).resolve())
+    os.chdir(REPO_ROOT)  # books.py reads templates/ relative to the working directory
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="carbomica_bench_"))
+    prev_project_dir = os.environ.get("PROJECT_DIR")
+    cases = []
+    try:
+        for n_int in args.interventions:
+            for n_fac in args.facilities:
+                print(f"benchmarking {n_int} interventions x {n_fac} facilities ...", flush=True)
+                case = bench_case(workdir, n_int, n_fac, args.stages, args.repeat, args.spending, args.budgets, args.seed)
+                for stage, t in case["timings"].items():
+                    print(f"  {stage:<20}{t['seconds']:>10.3f} s  ({t['per_facility']:.3f} s/facility)", flush=True)
+                cases.append(case)
+    finally:
+        if prev_project_dir is None:
+            os.environ.pop("PROJECT_DIR", None)
+        else:
+            os.environ["PROJECT_DIR"] = prev_project_dir
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {"meta": _meta(args), "cases": cases}
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"Saved results to {out}")
+
+    if baseline_path:
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        return 0 if _print_comparison(compare(result, baseline, args.threshold), args.threshold) else 1
+    return 0
+
+
+def _cmd_compare(args) -> int:
+    current = json.loads(Path(args.current).read_text(encoding="utf-8"))
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    return 0 if _print_comparison(compare(current, baseline, args.threshold), args.threshold) else 1
+
+
+def main(argv=None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark engine stages on synthetic input workbooks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Run the benchmarks and write JSON results")
+    run.add_argument("--interventions", type=_int_list, default=list(DEFAULT_INTERVENTIONS), help="Comma-separated intervention counts (default 5,20,100)")
+    run.add_argument("--facilities", type=_int_list, default=list(DEFAULT_FACILITIES), help="Comma-separated facility counts (default 1,10,50)")
+    run.add_argument("--stages", type=_stage_list, default=list(STAGES), help="Comma-separated stages to time (default all)")
+    run.add_argument("--repeat", type=int, default=1, help="Passes per scale; the median is reported")
+    run.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed for synthetic data and the optimiser")
+    run.add_argument("--spending", type=float, default=DEFAULT_SPENDING, help="Spending for budget_scenario")
+    run.add_argument("--budgets", type=_float_list, default=list(DEFAULT_BUDGETS), help="Comma-separated budgets for optimization")
+    run.add_argument("--out", "-o", default="benchmark_results.json", help="Results file")
+    run.add_argument("--baseline", help="Compare against this results file after running")
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed slowdown as a fraction (default 0.25)")
+    run.add_argument("--workdir", help="Folder for synthetic projects (default: a temporary folder, removed afterwards)")
+    run.add_argument("--keep", action="store_true", help="Keep the temporary folder")
+
+    cmp_ = sub.add_parser("compare", help="Compare a results file against a baseline")
+    cmp_.add_argument("current")
+    cmp_.add_argument("baseline")
+    cmp_.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed slowdown as a fraction (default 0.25)")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return _cmd_run(args)
+    return _cmd_compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
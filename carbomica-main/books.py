@@ -120,7 +120,7 @@ def generate_books(input_data_sheet, start_year, end_year, output_dir: Optional[
     pb_costs_implement = pd.read_excel(input_data_sheet, sheet_name='implementation costs', index_col='facilities') 
     cols_to_drop = [col for col in pb_costs_implement.columns if 'Unnamed' in col]
     pb_costs_implement.drop(columns=cols_to_drop,inplace=True) 
-    P = at.ProgramSet.from_spreadsheet(spreadsheet='books/carbomica_progbook_{}.xlsx'.format(facility_code), framework=F, data=D, _allow_missing_data=True)
+    P = at.ProgramSet.from_spreadsheet(spreadsheet=str(progbook_path), framework=F, data=D, _allow_missing_data=True)
     for intervention in interventions:
         # Write in 'Program targeting' sheet
         P.programs[intervention].target_pops = [facility_code]
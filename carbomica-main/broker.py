@@ -0,0 +1,323 @@
+"""
+Job broker for running the engine on other hosts.
+
+With CARBOMICA_BROKER set (e.g. sqlite:////shared/carbomica/broker.db) the API publishes runs to a
+broker instead of its local worker pool, and `python worker.py --broker <url>` processes on any host
+pull them, run the engine and upload the results. Every broker implements the Broker interface;
+SQLiteBroker keeps jobs, worker heartbeats and file blobs in one SQLite database (on a shared
+filesystem for several hosts, or local as a test stand-in).
+
+Project files travel as content-addressed bundles: each file is stored once as a blob keyed by its
+sha256 and a bundle is the blob of a JSON manifest {relative path: digest}, so unchanged inputs
+are not uploaded or rewritten again. Jobs are leased: a worker that stops heartbeating loses its
+job to another worker after lease_seconds (up to MAX_ATTEMPTS claims). The API cancels a job it has
+waited CARBOMICA_BROKER_WAIT_SECONDS (default 6 hours) for and fails the run.
+
+    broker = open_broker("sqlite:///tmp/broker.db")
+    job_id = broker.submit({"bundle": pack_project(broker, project_dir, input_path), ...})
+    job = broker.wait(job_id)   # {"status": "finished"|"failed", "result", "error", ...}
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Iterable
+
+BROKER_URL = os.environ.get("CARBOMICA_BROKER") or None
+LEASE_SECONDS = 60.0
+MAX_ATTEMPTS = 3
+WORKER_TIMEOUT = 30.0    # a worker counts as live while its last heartbeat is this recent
+WAIT_SECONDS = float(os.environ.get("CARBOMICA_BROKER_WAIT_SECONDS", "21600"))  # the API gives up on a job after this
+GRAPHS_MANIFEST = "graphs/manifest.json"
+
+
+class Broker:
+    """
+    Interface of a job broker. Jobs are dicts {id, status: queued|running|finished|failed, payload,
+    priority, worker, attempts, result, error}; lower priority values are claimed first.
+    """
+
+    def submit(self, payload: Dict[str, Any], priority: int = 0, job_id: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        '''
+        Lease the next queued (or abandoned) job to worker_id, or return None.
+        '''
+        raise NotImplementedError
+
+    def heartbeat(self, worker_id: str, job_id: Optional[str] = None):
+        '''
+        Mark worker_id as live and extend its lease on job_id.
+        '''
+        raise NotImplementedError
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]):
+        raise NotImplementedError
+
+    def fail(self, job_id: str, worker_id: str, error: str):
+        raise NotImplementedError
+
+    def cancel(self, job_id: str, error: str):
+        '''
+        Fail a queued or running job on behalf of its submitter; a worker still running it can no
+        longer complete it.
+        '''
+        raise NotImplementedError
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def live_workers(self) -> int:
+        raise NotImplementedError
+
+    def put_blob(self, data: bytes) -> str:
+        '''
+        Store data under its sha256 hex digest (a no-op if present) and return the digest.
+        '''
+        raise NotImplementedError
+
+    def get_blob(self, digest: str) -> bytes:
+        raise NotImplementedError
+
+    def missing_blobs(self, digests: Iterable[str]) -> set:
+        raise NotImplementedError
+
+    def wait(self, job_id: str, poll: float = 0.5, timeout: Optional[float] = None) -> Dict[str, Any]:
+        '''
+        Block until the job has finished or failed and return it. Raises TimeoutError.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self.job(job_id)
+            if job is None:
+                raise KeyError(f"unknown job: {job_id}")
+            if job["status"] in ("finished", "failed"):
+                return job
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError(f"job {job_id} still {job['status']} after {timeout}s")
+            time.sleep(poll)
+
+
+class SQLiteBroker(Broker):
+    """
+    Broker in a single SQLite database; safe for several processes and, on a filesystem with working
+    locks, several hosts. Claims run in IMMEDIATE transactions so a job goes to exactly one worker.
+    """
+
+    def __init__(self, path, lease_seconds: float = LEASE_SECONDS):
+        self.path = str(path)
+        self.lease_seconds = lease_seconds
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, priority INTEGER NOT NULL,
+                    created REAL NOT NULL, worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT, error TEXT, updated REAL);
+                CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created);
+                CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, data BLOB NOT NULL);
+                CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, last_seen REAL NOT NULL, host TEXT);
+            """)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return _Closing(db)
+
+    def submit(self, payload, priority=0, job_id=None):
+        job_id = job_id or str(uuid.uuid4())
+        with self._connect() as db:
+            db.execute("INSERT INTO jobs (id, status, payload, priority, created, updated) VALUES (?, 'queued', ?, ?, ?, ?)",
+                       (job_id, json.dumps(payload, default=str), int(priority), time.time(), time.time()))
+        return job_id
+
+    def claim(self, worker_id):
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute("UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                           (f"abandoned by its workers after {MAX_ATTEMPTS} attempts", now, now, MAX_ATTEMPTS))
+                row = db.execute("SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                                 "ORDER BY priority, created LIMIT 1", (now,)).fetchone()
+                if row is not None:
+                    db.execute("UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                               (worker_id, now + self.lease_seconds, now, row["id"]))
+                db.execute("INSERT OR REPLACE INTO workers (id, last_seen, host) VALUES (?, ?, ?)", (worker_id, now, os.uname().nodename))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return None if row is None else self.job(row["id"])
+
+    def heartbeat(self, worker_id, job_id=None):
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO workers (id, last_seen, host) VALUES (?, ?, ?)", (worker_id, now, os.uname().nodename))
+            if job_id:
+                db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                           (now + self.lease_seconds, job_id, worker_id))
+
+    def _finish(self, job_id, worker_id, status, result=None, error=None):
+        with self._connect() as db:
+            # a worker that lost its lease must not overwrite the new owner's outcome
+            db.execute("UPDATE jobs SET status = ?, result = ?, error = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                       (status, None if result is None else json.dumps(result, default=str), error, time.time(), job_id, worker_id))
+
+    def complete(self, job_id, worker_id, result):
+        self._finish(job_id, worker_id, "finished", result=result)
+
+    def fail(self, job_id, worker_id, error):
+        self._finish(job_id, worker_id, "failed", error=error)
+
+    def cancel(self, job_id, error):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE id = ? AND status IN ('queued', 'running')",
+                       (error, time.time(), job_id))
+
+    def job(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def live_workers(self):
+        with self._connect() as db:
+            return int(db.execute("SELECT COUNT(*) FROM workers WHERE last_seen > ?", (time.time() - WORKER_TIMEOUT,)).fetchone()[0])
+
+    def put_blob(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        with self._connect() as db:
+            db.execute("INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)", (digest, sqlite3.Binary(data)))
+        return digest
+
+    def get_blob(self, digest):
+        with self._connect() as db:
+            row = db.execute("SELECT data FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(f"missing blob: {digest}")
+        return bytes(row["data"])
+
+    def missing_blobs(self, digests):
+        digests = set(digests)
+        with self._connect() as db:
+            present = {r[0] for r in db.execute(f"SELECT digest FROM blobs WHERE digest IN ({','.join('?' * len(digests))})", tuple(digests))} if digests else set()
+        return digests - present
+
+
+class _Closing:
+    # sqlite3's own context manager commits but does not close
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, *exc):
+        self.db.close()
+
+
+def open_broker(url: Optional[str] = None) -> Optional[Broker]:
+    '''
+    Broker for a URL (sqlite:///relative/path, sqlite:////absolute/path or a plain path);
+    None when no URL is given and CARBOMICA_BROKER is unset.
+    '''
+    url = url or BROKER_URL
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SQLiteBroker(url[len("sqlite:///"):])
+    if "://" in url:
+        raise ValueError(f"unsupported broker url: {url}")
+    return SQLiteBroker(url)
+
+
+# ---------- content-addressed bundles ----------
+
+# (path, mtime_ns, size) -> sha256, so unchanged files are not re-read
+_digests: Dict[tuple, str] = {}
+
+
+def _file_digest(path: Path) -> str:
+    st = path.stat()
+    key = (str(path.resolve()), st.st_mtime_ns, st.st_size)
+    if key not in _digests:
+        _digests[key] = hashlib.sha256(path.read_bytes()).hexdigest()
+    return _digests[key]
+
+
+def pack_files(broker: Broker, root, relpaths: Iterable[str]) -> Dict[str, str]:
+    '''
+    Upload the files (paths relative to root) that the broker does not hold yet.
+    :return: manifest {relative path: digest}.
+    '''
+    root = Path(root)
+    files = {rel: _file_digest(root / rel) for rel in sorted(set(relpaths))}
+    missing = broker.missing_blobs(files.values())
+    for rel, digest in files.items():
+        if digest in missing:
+            broker.put_blob((root / rel).read_bytes())
+            missing.discard(digest)
+    return files
+
+
+def pack_project(broker: Broker, project_dir, input_path) -> str:
+    '''
+    Bundle a project's inputs (input workbook and variables.json) and return the bundle digest.
+    Books are not shipped: load_project regenerates them from the inputs on the worker.
+    '''
+    proj = Path(project_dir).resolve()
+    rels = [Path(input_path).resolve().relative_to(proj).as_posix()]
+    if (proj / "variables.json").exists():
+        rels.append("variables.json")
+    manifest = pack_files(broker, proj, rels)
+    return broker.put_blob(json.dumps(manifest, sort_keys=True).encode("utf-8"))
+
+
+def unpack(broker: Broker, manifest, dest) -> List[str]:
+    '''
+    Write the files of a manifest (or a bundle digest) under dest, skipping files that already match.
+    Files are replaced atomically so a warm project cache sees unchanged mtimes for unchanged inputs.
+    :return: relative paths written.
+    '''
+    if isinstance(manifest, str):
+        manifest = json.loads(broker.get_blob(manifest))
+    dest = Path(dest).resolve()
+    written = []
+    for rel, digest in manifest.items():
+        target = (dest / rel).resolve()
+        if dest not in target.parents:
+            raise ValueError(f"bundle path escapes the project folder: {rel}")
+        if target.exists() and _file_digest(target) == digest:
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(target.name + ".part")
+        tmp.write_bytes(broker.get_blob(digest))
+        tmp.replace(target)
+        written.append(rel)
+    return written
+
+
+def manifest_outputs(project_dir, manifest: Dict[str, Any]) -> List[str]:
+    '''
+    Files a run manifest lists as artifacts (whether this run wrote them or a cached pipeline stage
+    did earlier), plus the graphs manifest the API lists graphs from; paths relative to the project.
+    '''
+    proj = Path(project_dir).resolve()
+    rels = [a["path"] for a in manifest.get("artifacts") or [] if isinstance(a, dict) and a.get("path")]
+    rels.append(GRAPHS_MANIFEST)
+    out = []
+    for rel in rels:
+        target = (proj / rel).resolve()
+        if proj in target.parents and target.is_file():
+            out.append(target.relative_to(proj).as_posix())
+    return out
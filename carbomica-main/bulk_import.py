@@ -0,0 +1,230 @@
+"""
+Bulk import of input workbooks into new projects, e.g. when onboarding a group of facilities.
+
+    for event in import_projects("hospitals.zip"):      # a zip archive or a folder of workbooks
+        print(json.dumps(event))
+
+Every workbook is checked first (readable, required sheets present, a facility code set). The
+valid ones become projects, registered in projects.json in a single write, and their books are
+then generated in parallel worker processes through the pipeline's books stage (see
+run_main.project_pipeline), so their first runs reuse them. Progress is yielded as events:
+
+    {"event": "start", "files": n, "workers": w}
+    {"event": "file", "file", "status": "invalid", "error"}                            per rejected workbook
+    {"event": "file", "file", "status": "created", "project_id", "facility_code"}      per new project
+    {"event": "books", "file", "project_id", "status": "ok"|"failed", "seconds"?, "error"?, "done", "total"}
+    {"event": "done", "created", "invalid", "books_failed", "seconds"}
+
+POST /projects/import streams them as NDJSON for an uploaded zip; locally:
+
+E.g.: python bulk_import.py path/to/workbooks --start-year 2025
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Iterator, Tuple
+
+import pandas as pd
+
+from storage import create_project_folder, project_path, add_projects_to_index
+from variables import save_variables
+
+REPO_ROOT = Path(__file__).resolve().parent
+
+# sheets books.generate_books reads
+REQUIRED_SHEETS = ("facility", "interventions", "emission sources", "emission data", "emission targets",
+                   "effect sizes", "maintenance costs", "implementation costs")
+WORKBOOK_SUFFIXES = (".xlsx", ".xls")
+# total uncompressed size accepted from an archive
+MAX_ARCHIVE_BYTES = int(os.environ.get("CARBOMICA_IMPORT_MAX_BYTES", str(1 << 30)))
+
+
+def check_workbook(path) -> str:
+    """
+    Validate an input workbook before a project is created from it.
+    Raises ValueError describing the problem.
+    :return: The facility code.
+    """
+    try:
+        xlf = pd.ExcelFile(path)
+    except Exception as e:
+        raise ValueError(f"not a readable Excel workbook: {e}")
+    missing = [s for s in REQUIRED_SHEETS if s not in xlf.sheet_names]
+    if missing:
+        raise ValueError(f"missing sheets: {', '.join(missing)}")
+    try:
+        df_fac = pd.read_excel(xlf, sheet_name="facility", index_col="Code Name")
+    except ValueError:
+        raise ValueError("the facility sheet has no 'Code Name' column")
+    if len(df_fac.index) == 0 or pd.isna(df_fac.index[0]):
+        raise ValueError("no facility code in the facility sheet")
+    return str(df_fac.index[0])
+
+
+def _workbooks(source: Path, tmp_dir: Path) -> List[Tuple[str, Path]]:
+    # (name reported in events, local path) of every workbook in a folder or zip archive
+    if source.is_dir():
+        return [(f.relative_to(source).as_posix(), f) for f in sorted(source.rglob("*"))
+                if f.is_file() and f.suffix.lower() in WORKBOOK_SUFFIXES and not f.name.startswith(("~$", "."))]
+    try:
+        zf = zipfile.ZipFile(source)
+    except zipfile.BadZipFile:
+        raise ValueError(f"{source.name} is neither a folder nor a zip archive")
+    with zf:
+        members = [m for m in zf.infolist() if not m.is_dir() and Path(m.filename).suffix.lower() in WORKBOOK_SUFFIXES
+                   and not Path(m.filename).name.startswith(("~$", ".")) and not m.filename.startswith("__MACOSX/")]
+        if sum(m.file_size for m in members) > MAX_ARCHIVE_BYTES:
+            raise ValueError(f"archive expands to more than {MAX_ARCHIVE_BYTES} bytes")
+        out = []
+        for i, m in enumerate(members):
+            # member names are only used as labels; files are written under tmp_dir by base name
+            dest = tmp_dir / str(i) / Path(m.filename).name
+            dest.parent.mkdir(parents=True)
+            with zf.open(m) as src, dest.open("wb") as dst:
+                shutil.copyfileobj(src, dst)
+            out.append((m.filename, dest))
+        return out
+
+
+def _create(path: Path, name: str, facility_code: str, start_year: Optional[int]) -> Dict[str, Any]:
+    # project folder, input workbook and variables.json; the index entry is returned for one write of all of them
+    pid = create_project_folder(project_name=name)
+    proj = project_path(pid)
+    shutil.copy2(path, proj / path.name)
+    vars_ = {"project_name": name, "facility_code": facility_code, "input_filename": path.name}
+    if start_year is not None:
+        vars_["start_year"] = int(start_year)
+    save_variables(pid, vars_)
+    return {
+        "project_id": pid,
+        "project_name": name,
+        "start_year": vars_.get("start_year"),
+        "input_filename": path.name,
+        "books_path": str((proj / "books").resolve()),
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "has_outputs": False,
+        "facility_code": facility_code,
+    }
+
+
+def _init_books_worker():
+    os.chdir(str(REPO_ROOT))  # books.py reads templates/ relative to the working directory
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def _make_books(project_dir: str) -> float:
+    """
+    Generate a project's books through the pipeline's books stage (stamped in outputs/pipeline).
+    """
+    from run_main import project_pipeline
+    t0 = time.perf_counter()
+    project_pipeline(project_dir).output("books")
+    return time.perf_counter() - t0
+
+
+def import_projects(source, start_year: Optional[int] = None, workers: Optional[int] = None,
+                    in_process: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Create a project per valid workbook of a folder or zip archive and generate their books.
+    Raises ValueError (before any event) if the source is neither.
+    :param start_year: Start year recorded for every project (default: the engine default).
+    :param workers: Book generation processes (None: one per project, up to the CPU count).
+    :param in_process: Whether a single project or worker may generate books in this process, which
+        changes its working directory and PROJECT_DIR meanwhile. The API passes False: other
+        requests run in threads of the same process.
+    :return: Iterator of progress events (see the module docstring).
+    """
+    t0 = time.perf_counter()
+    source = Path(source).resolve()
+    tmp_dir = Path(tempfile.mkdtemp(prefix="carbomica-import-"))
+    created: List[Tuple[str, Dict[str, Any]]] = []
+    invalid = 0
+    try:
+        files = _workbooks(source, tmp_dir)
+        workers = max(1, min(workers or os.cpu_count() or 1, len(files) or 1))
+        yield {"event": "start", "files": len(files), "workers": workers}
+        for label, path in files:
+            try:
+                facility_code = check_workbook(path)
+            except ValueError as e:
+                invalid += 1
+                yield {"event": "file", "file": label, "status": "invalid", "error": str(e)}
+                continue
+            entry = _create(path, Path(label).stem, facility_code, start_year)
+            created.append((label, entry))
+            yield {"event": "file", "file": label, "status": "created", "project_id": entry["project_id"], "facility_code": facility_code}
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        # registered together, also when the consumer stops early (e.g. the client disconnects)
+        if created:
+            add_projects_to_index([entry for _, entry in created])
+
+    dirs = {entry["project_id"]: str(project_path(entry["project_id"]).resolve()) for _, entry in created}
+    labels = {entry["project_id"]: label for label, entry in created}
+    failed = 0
+    done = 0
+
+    def books_event(pid, seconds=None, error=None):
+        nonlocal done, failed
+        done += 1
+        ev = {"event": "books", "file": labels[pid], "project_id": pid, "status": "failed" if error else "ok", "done": done, "total": len(created)}
+        if error:
+            failed += 1
+            ev["error"] = error
+        else:
+            ev["seconds"] = seconds
+        return ev
+
+    if created and (not in_process or (workers > 1 and len(created) > 1)) and not mp.current_process().daemon:
+        with ProcessPoolExecutor(max_workers=min(workers, len(created)), mp_context=mp.get_context("spawn"), initializer=_init_books_worker) as pool:
+            futures = {pool.submit(_make_books, d): pid for pid, d in dirs.items()}
+            for fut in as_completed(futures):
+                try:
+                    yield books_event(futures[fut], seconds=fut.result())
+                except Exception as e:
+                    yield books_event(futures[fut], error=str(e))
+    else:
+        prev_cwd = os.getcwd()
+        try:
+            os.chdir(str(REPO_ROOT))
+            for pid, d in dirs.items():
+                try:
+                    yield books_event(pid, seconds=_make_books(d))
+                except Exception as e:
+                    yield books_event(pid, error=str(e))
+        finally:
+            os.chdir(prev_cwd)
+    yield {"event": "done", "created": len(created), "invalid": invalid, "books_failed": failed, "seconds": time.perf_counter() - t0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create a project per input workbook of a folder or zip archive")
+    parser.add_argument("source", help="Folder of workbooks or zip archive")
+    parser.add_argument("--start-year", type=int, default=None, help="Start year of every project")
+    parser.add_argument("--workers", type=int, default=None, help="Book generation processes (default: automatic)")
+    args = parser.parse_args(argv)
+
+    source = Path(args.source).resolve()
+    os.chdir(str(REPO_ROOT))  # projects/ and templates/ are relative to the repository folder
+    try:
+        events = import_projects(source, args.start_year, args.workers)
+        for event in events:
+            print(json.dumps(event), flush=True)
+    except ValueError as e:
+        print(json.dumps({"event": "error", "error": str(e)}), flush=True)
+        return 2
+    return 0 if event["invalid"] == 0 and event["books_failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,404 @@
+"""
+Project bundles: a project folder as one archive, streamed in constant memory, and the matching
+import, e.g. to move projects between a staging and a production instance.
+
+    with open("p.zip", "wb") as f:
+        for chunk in export_bundle(project_id, "zip"):        # or "tar.zst" (needs zstandard)
+            f.write(chunk)
+    import_bundle("p.zip")                                     # verifies every file's sha256
+
+Files are read in chunks and written to the archive as they are read; the sha256, size and
+mtime of every file go into bundle.json, the archive's last member. Imports check each file
+against it, restore the mtimes and rewrite the cached pipeline stages for the new folder, so
+the imported project's first runs reuse the exported work. Run history is included, except
+runs that were still queued or running. Filters:
+
+    results_only   results/, graphs/ and run records only (for download; cannot be imported)
+    latest_run     only the newest finished run's record and artifacts
+
+E.g.: python bundles.py export <project_id> out.tar.zst --latest-run
+      python bundles.py import out.tar.zst
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import argparse
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+from typing import Optional, Dict, Any, List, Iterator, Tuple
+
+from storage import PROJECTS_DIR, project_path, create_project_folder, add_project_to_index, _rebase
+from variables import load_variables, save_variables
+from bulk_import import MAX_ARCHIVE_BYTES
+
+try:
+    import zstandard
+except ImportError:  # optional dependency; only zip bundles then
+    zstandard = None
+
+BUNDLE_MANIFEST = "bundle.json"
+BUNDLE_VERSION = 1
+FORMATS = {"zip": "application/zip", "tar.zst": "application/zstd"}
+CHUNK_BYTES = 1 << 20
+ZSTD_LEVEL = int(os.environ.get("CARBOMICA_BUNDLE_ZSTD_LEVEL", "3"))
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# transient files, never exported
+EXPORT_EXCLUDE = ("outputs/status.json", "outputs/checkpoints")
+RESULT_DIRS = ("results", "graphs", "runs")
+# already compressed; stored as they are in zip bundles
+STORED_SUFFIXES = (".xlsx", ".png", ".zip", ".zst", ".gz")
+UNFINISHED = ("queued", "running")
+# errors of a damaged archive, reported as ValueError by import_bundle
+CORRUPT = (zipfile.BadZipFile, tarfile.TarError, EOFError, json.JSONDecodeError) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+def _run_records(proj: Path) -> Dict[str, dict]:
+    # relative path -> record of the finished (or failed) runs
+    out = {}
+    for f in sorted((proj / "runs").glob("*.json")):
+        try:
+            rec = json.loads(f.read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        if rec.get("status") not in UNFINISHED:
+            out[f"runs/{f.name}"] = rec
+    return out
+
+
+def bundle_files(project_id: str, results_only: bool = False, latest_run: bool = False) -> List[Tuple[str, Path]]:
+    '''
+    (archive path, file) of everything a bundle of the project holds.
+    Raises FileNotFoundError if the project does not exist, also for ids naming anything but a
+    folder directly under projects/ (e.g. '..').
+    :param results_only: Only results/, graphs/ and the run records.
+    :param latest_run: Only the newest finished run's record and artifacts.
+    '''
+    proj = project_path(project_id)
+    if not proj.is_dir() or proj.resolve().parent != PROJECTS_DIR.resolve():
+        raise FileNotFoundError(project_id)
+    records = _run_records(proj)
+    artifacts = None
+    if latest_run:
+        finished = [(rec.get("finished_at") or "", rel) for rel, rec in records.items() if rec.get("status") == "finished"]
+        latest = max(finished)[1] if finished else None
+        records = {latest: records[latest]} if latest else {}
+        artifacts = {a.get("path") for rec in records.values() for a in rec.get("artifacts") or []}
+        artifacts.add("graphs/manifest.json")
+
+    out = []
+    for f in sorted(proj.rglob("*")):
+        rel = f.relative_to(proj).as_posix()
+        top = rel.split("/", 1)[0]
+        if not f.is_file() or f.name.endswith((".tmp", ".lock")) \
+                or any(rel == ex or rel.startswith(ex + "/") for ex in EXPORT_EXCLUDE):
+            continue
+        if results_only and top not in RESULT_DIRS:
+            continue
+        if top == "runs" and rel not in records:
+            continue
+        if artifacts is not None and top in ("results", "graphs") and rel not in artifacts:
+            continue
+        out.append((rel, f))
+    return out
+
+
+class _Sink:
+    # write-only stream the archive writers fill and the export generator drains
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> List[bytes]:
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+class _ZipWriter:
+    # zip over a non-seekable stream: sizes and CRCs follow each member (data descriptors)
+    def __init__(self, sink: _Sink):
+        self._zf = zipfile.ZipFile(sink, "w", allowZip64=True)
+        self._dst = None
+
+    def begin(self, rel: str, st: os.stat_result):
+        info = zipfile.ZipInfo(rel, datetime.fromtimestamp(max(st.st_mtime, 315619200)).timetuple()[:6])
+        info.file_size = st.st_size  # zip64 headers for large members
+        info.compress_type = zipfile.ZIP_STORED if rel.lower().endswith(STORED_SUFFIXES) else zipfile.ZIP_DEFLATED
+        self._dst = self._zf.open(info, "w")
+
+    def write(self, chunk: bytes):
+        self._dst.write(chunk)
+
+    def end(self):
+        self._dst.close()
+
+    def finish(self, manifest: bytes):
+        self._zf.writestr(BUNDLE_MANIFEST, manifest, zipfile.ZIP_DEFLATED)
+        self._zf.close()
+
+
+class _TarZstWriter:
+    # tar headers written by hand so file data is compressed as it is read, not a member at a time
+    def __init__(self, sink: _Sink):
+        self._out = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(sink, closefd=False)
+        self._pad = 0
+
+    def _header(self, rel: str, size: int, mtime: float):
+        info = tarfile.TarInfo(rel)
+        info.size, info.mtime, info.mode = size, int(mtime), 0o644
+        self._out.write(info.tobuf(tarfile.PAX_FORMAT))
+        self._pad = -size % tarfile.BLOCKSIZE
+
+    def begin(self, rel: str, st: os.stat_result):
+        self._header(rel, st.st_size, st.st_mtime)
+
+    def write(self, chunk: bytes):
+        self._out.write(chunk)
+
+    def end(self):
+        self._out.write(b"\0" * self._pad)
+
+    def finish(self, manifest: bytes):
+        self._header(BUNDLE_MANIFEST, len(manifest), time.time())
+        self._out.write(manifest)
+        self.end()
+        self._out.write(b"\0" * (2 * tarfile.BLOCKSIZE))
+        self._out.flush(zstandard.FLUSH_FRAME)
+        self._out.close()
+
+
+def export_bundle(project_id: str, fmt: str = "zip", results_only: bool = False, latest_run: bool = False) -> Iterator[bytes]:
+    '''
+    Stream a bundle of the project as chunks of bytes (see the module docstring).
+    Raises FileNotFoundError for an unknown project and ValueError for an unavailable format,
+    both before the first chunk.
+    :param fmt: 'zip' or 'tar.zst'.
+    '''
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown bundle format: {fmt!r} (expected one of {', '.join(FORMATS)})")
+    if fmt == "tar.zst" and zstandard is None:
+        raise ValueError("tar.zst bundles need the zstandard package")
+    files = bundle_files(project_id, results_only, latest_run)
+    vars_ = load_variables(project_id) or {}
+    return _stream(project_id, vars_, files, fmt, {"results_only": results_only, "latest_run": latest_run})
+
+
+def _stream(project_id: str, vars_: dict, files: List[Tuple[str, Path]], fmt: str, filters: dict) -> Iterator[bytes]:
+    sink = _Sink()
+    writer = _ZipWriter(sink) if fmt == "zip" else _TarZstWriter(sink)
+    entries = []
+    for rel, path in files:
+        h = hashlib.sha256()
+        with path.open("rb") as src:
+            st = os.fstat(src.fileno())
+            writer.begin(rel, st)
+            size = 0
+            # exactly the size in the member header; a file rewritten meanwhile fails the export
+            while size < st.st_size:
+                chunk = src.read(min(CHUNK_BYTES, st.st_size - size))
+                if not chunk:
+                    raise OSError(f"{rel} changed during the export")
+                h.update(chunk)
+                writer.write(chunk)
+                size += len(chunk)
+                yield from sink.drain()
+            writer.end()
+        entries.append({"path": rel, "size": size, "sha256": h.hexdigest(), "mtime_ns": st.st_mtime_ns})
+        yield from sink.drain()
+    manifest = {
+        "version": BUNDLE_VERSION,
+        "project_id": project_id,
+        "project_name": vars_.get("project_name"),
+        "root": str(project_path(project_id).resolve()),
+        "exported_at": datetime.utcnow().isoformat() + "Z",
+        "filters": filters,
+        "files": entries,
+    }
+    writer.finish(json.dumps(manifest, indent=2).encode("utf-8"))
+    yield from sink.drain()
+
+
+def _member_path(name: str) -> str:
+    # archive paths must stay inside the project folder
+    p = PurePosixPath(name)
+    if not name or p.is_absolute() or ".." in p.parts or "\\" in name or name != p.as_posix():
+        raise ValueError(f"unsafe path in bundle: {name!r}")
+    return name
+
+
+def _extract(src, dest: Path, total: List[int]) -> Tuple[int, str]:
+    # copy a member to dest while hashing it; total[0] counts bytes against MAX_ARCHIVE_BYTES
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    with dest.open("wb") as out:
+        for chunk in iter(lambda: src.read(CHUNK_BYTES), b""):
+            size += len(chunk)
+            total[0] += len(chunk)
+            if total[0] > MAX_ARCHIVE_BYTES:
+                raise ValueError(f"bundle expands to more than {MAX_ARCHIVE_BYTES} bytes")
+            h.update(chunk)
+            out.write(chunk)
+    return size, h.hexdigest()
+
+
+def _read_zip(path: Path, dest: Path) -> Tuple[dict, Dict[str, Tuple[int, str]]]:
+    with zipfile.ZipFile(path) as zf:
+        try:
+            manifest = json.loads(zf.read(BUNDLE_MANIFEST))
+        except KeyError:
+            raise ValueError(f"not a project bundle: no {BUNDLE_MANIFEST}")
+        got, total = {}, [0]
+        for m in zf.infolist():
+            if m.is_dir() or m.filename == BUNDLE_MANIFEST:
+                continue
+            rel = _member_path(m.filename)
+            with zf.open(m) as src:
+                got[rel] = _extract(src, dest / rel, total)
+    return manifest, got
+
+
+def _read_tar_zst(path: Path, dest: Path) -> Tuple[Optional[dict], Dict[str, Tuple[int, str]]]:
+    if zstandard is None:
+        raise ValueError("tar.zst bundles need the zstandard package")
+    manifest, got, total = None, {}, [0]
+    with path.open("rb") as f, zstandard.ZstdDecompressor().stream_reader(f) as reader, \
+            tarfile.open(fileobj=reader, mode="r|") as tf:
+        for m in tf:
+            if m.isdir():
+                continue
+            if not m.isfile():
+                raise ValueError(f"unexpected member in bundle: {m.name!r}")
+            src = tf.extractfile(m)
+            if m.name == BUNDLE_MANIFEST:
+                manifest = json.loads(src.read())
+                continue
+            rel = _member_path(m.name)
+            got[rel] = _extract(src, dest / rel, total)
+    return manifest, got
+
+
+def import_bundle(source, project_name: Optional[str] = None) -> Dict[str, Any]:
+    '''
+    Create a project from a bundle written by export_bundle. Every file is checked against the
+    bundle's sha256 and size before the project is added to the index; nothing is kept otherwise.
+    Raises ValueError describing the problem.
+    :param project_name: Name of the new project (default: the exported project's).
+    :return: {"project_id", "source_id", "project_name", "format", "files", "bytes"}.
+    '''
+    source = Path(source)
+    with source.open("rb") as f:
+        magic = f.read(4)
+    # magic number first: workbooks stored in a tar.zst can make it look like a zip to is_zipfile
+    if magic == ZSTD_MAGIC:
+        fmt, read = "tar.zst", _read_tar_zst
+    elif zipfile.is_zipfile(source):
+        fmt, read = "zip", _read_zip
+    else:
+        raise ValueError("not a project bundle: expected a zip or tar.zst archive")
+
+    pid = create_project_folder()
+    dst = project_path(pid)
+    try:
+        try:
+            manifest, got = read(source, dst)
+        except CORRUPT as e:
+            raise ValueError(f"corrupt bundle: {e}")
+        if manifest is None:
+            raise ValueError(f"not a project bundle: no {BUNDLE_MANIFEST}")
+        if manifest.get("version") != BUNDLE_VERSION:
+            raise ValueError(f"unsupported bundle version: {manifest.get('version')!r}")
+        if (manifest.get("filters") or {}).get("results_only"):
+            raise ValueError("a results-only bundle has no inputs to create a project from")
+        files = {e["path"]: e for e in manifest.get("files") or []}
+        missing = sorted(set(files) - set(got))
+        extra = sorted(set(got) - set(files))
+        if missing or extra:
+            raise ValueError(f"bundle contents do not match {BUNDLE_MANIFEST}: missing {missing[:5]}, unlisted {extra[:5]}")
+        bad = [rel for rel, (size, digest) in got.items() if size != files[rel]["size"] or digest != files[rel]["sha256"]]
+        if bad:
+            raise ValueError(f"content hash mismatch: {', '.join(sorted(bad)[:5])}")
+        if "variables.json" not in files:
+            raise ValueError("not a project bundle: no variables.json")
+
+        # paths of the exported folder -> this one (cached stages name files absolutely, run records relatively)
+        old_id, new_root = manifest.get("project_id"), str(dst.resolve())
+        for f in sorted((dst / "outputs" / "pipeline").glob("*.json")):
+            f.write_text(json.dumps(_rebase(json.loads(f.read_text(encoding="utf-8")), manifest.get("root") or "", new_root)), encoding="utf-8")
+        for f in sorted((dst / "runs").glob("*.json")):
+            rec = _rebase(json.loads(f.read_text(encoding="utf-8")), str(PROJECTS_DIR / str(old_id)), str(dst))
+            rec["project_id"] = pid
+            f.write_text(json.dumps(rec, indent=2, default=str), encoding="utf-8")
+        # cached stages and finished runs check file mtimes
+        for rel, e in files.items():
+            if not rel.startswith(("outputs/pipeline/", "runs/")):
+                os.utime(dst / rel, ns=(e["mtime_ns"], e["mtime_ns"]))
+
+        vars_ = load_variables(pid) or {}
+        name = project_name or vars_.get("project_name") or manifest.get("project_name") or pid
+        if vars_.get("project_name") != name:
+            vars_["project_name"] = name
+            save_variables(pid, vars_)
+    except BaseException:
+        shutil.rmtree(dst, ignore_errors=True)
+        raise
+
+    add_project_to_index({
+        "project_id": pid,
+        "project_name": name,
+        "start_year": vars_.get("start_year"),
+        "input_filename": vars_.get("input_filename"),
+        "books_path": str((dst / "books").resolve()),
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "has_outputs": (dst / "outputs").exists(),
+        "facility_code": vars_.get("facility_code"),
+        "source_id": old_id,
+    })
+    return {"project_id": pid, "source_id": old_id, "project_name": name, "format": fmt,
+            "files": len(files), "bytes": sum(e["size"] for e in files.values())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a project as a bundle, or create a project from one")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ex = sub.add_parser("export", help="Write a project bundle")
+    ex.add_argument("project_id")
+    ex.add_argument("output", help="Bundle file (.zip or .tar.zst)")
+    ex.add_argument("--results-only", action="store_true", help="Only results, graphs and run records")
+    ex.add_argument("--latest-run", action="store_true", help="Only the newest finished run")
+    im = sub.add_parser("import", help="Create a project from a bundle")
+    im.add_argument("bundle")
+    im.add_argument("--project-name", default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        out = Path(args.output).resolve()
+        fmt = "tar.zst" if out.name.endswith(".tar.zst") else "zip"
+        os.chdir(str(Path(__file__).resolve().parent))  # projects/ is relative to the repository folder
+        with out.open("wb") as f:
+            for chunk in export_bundle(args.project_id, fmt, args.results_only, args.latest_run):
+                f.write(chunk)
+        print(json.dumps({"output": str(out), "bytes": out.stat().st_size}))
+    else:
+        bundle = Path(args.bundle).resolve()
+        os.chdir(str(Path(__file__).resolve().parent))
+        try:
+            print(json.dumps(import_bundle(bundle, args.project_name)))
+        except ValueError as e:
+            print(json.dumps({"error": str(e)}))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
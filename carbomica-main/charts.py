@@ -0,0 +1,172 @@
+"""
+Chart renderers for the graphs the utils writers produce.
+
+Each renderer draws one chart type from plain JSON data (the chart spec built by the writer in
+utils.py) and saves it as a PNG. Keeping them apart from the writers lets the pipeline's charts
+stage (pipeline.py) re-render graphs from stored specs without re-running the scenario, e.g.
+after a chart title or a change to this module.
+"""
+import matplotlib.pyplot as plt
+import matplotlib as mpl
+import pandas as pd
+
+
+def _frame(data):
+    return pd.DataFrame(data["data"], index=data["index"], columns=data["columns"], dtype=float)
+
+
+def emissions(data, title, path):
+    '''
+    Stacked bar of emissions per source for each result.
+    '''
+    df = _frame(data)
+    font_size = 22
+    fig, ax = plt.subplots(figsize=(max(15, len(df.columns) * 1.5), 10))
+    df.plot(kind='bar', stacked=True, ax=ax, fontsize=font_size)
+    plt.title(title, fontsize=font_size + 2)
+    ax.legend(title='Emission Sources', bbox_to_anchor=(1.0, 1.0), loc='upper left', fontsize=font_size-2, title_fontsize=font_size)
+    ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
+    plt.xticks(rotation=90, ha='center')
+    plt.ylabel('Emissions (CO2e)', fontsize=font_size)
+    plt.tight_layout()
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+
+
+def allocation(data, title, path):
+    '''
+    Stacked bar of spending per intervention for each result.
+    '''
+    df = _frame(data)
+    colormap = plt.cm.tab20
+    colors = [colormap(i) for i in range(len(df.columns))]
+    fig, ax = plt.subplots(figsize=(15,10))
+    df.plot.bar(stacked=True, color=colors, ax=ax, fontsize=22)
+    ax.legend(loc='upper left', bbox_to_anchor=(1.05,1), title='Interventions', fontsize=20, title_fontsize=22)
+    ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('${x:,.0f}'))
+    plt.title(title, fontsize=25)
+    plt.xticks(rotation=0)
+    plt.tight_layout()
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+
+
+def _uncertainty_axes(ax, title):
+    ax.tick_params(axis='y', labelsize=18)
+    ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
+    ax.legend(fontsize=18)
+    plt.title(title, fontsize=24)
+    plt.ylabel('Emissions (CO2e)', fontsize=22)
+    plt.tight_layout()
+
+
+def uncertainty_scenarios(data, title, path):
+    '''
+    Median emissions of the coverage scenarios with percentile and interquartile error bars.
+    '''
+    df = _frame(data)
+    lo, hi = data["lo"], data["hi"]
+    fig, ax = plt.subplots(figsize=(max(15, len(df) * 1.2), 10))
+    x = range(len(df))
+    ax.bar(x, df["p50"], color='tab:blue', alpha=0.6, label='Median')
+    ax.errorbar(x, df["p50"], yerr=[df["p50"] - df[lo], df[hi] - df["p50"]], fmt='none', ecolor='black', capsize=6, label=f'{lo[1:]}-{hi[1:]}th percentile')
+    ax.errorbar(x, df["p50"], yerr=[df["p50"] - df["p25"], df["p75"] - df["p50"]], fmt='none', ecolor='black', elinewidth=4, label='Interquartile range')
+    ax.set_xticks(list(x))
+    ax.set_xticklabels(df.index, rotation=90, fontsize=18)
+    _uncertainty_axes(ax, title)
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+
+
+def uncertainty_budgets(data, title, path):
+    '''
+    Fan chart of emissions over budgets (percentile bands, median, optional re-optimised median).
+    '''
+    df = _frame(data)
+    lo, hi = data["lo"], data["hi"]
+    budgets = data["budgets"]
+    fig, ax = plt.subplots(figsize=(15, 10))
+    ax.fill_between(budgets, df[lo], df[hi], color='tab:blue', alpha=0.2, label=f'{lo[1:]}-{hi[1:]}th percentile')
+    ax.fill_between(budgets, df["p25"], df["p75"], color='tab:blue', alpha=0.4, label='Interquartile range')
+    ax.plot(budgets, df["p50"], 'o-', color='tab:blue', label='Median (point-estimate allocation)')
+    if data.get("reoptimised") is not None:
+        ax.plot(budgets, data["reoptimised"], 's--', color='tab:green', label='Median (re-optimised)')
+    ax.xaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('${x:,.0f}'))
+    ax.tick_params(axis='x', labelsize=18)
+    plt.xlabel('Budget', fontsize=22)
+    _uncertainty_axes(ax, title)
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+
+
+def frontier(data, title, path):
+    '''
+    Emissions-vs-budget frontier curve with the optimised budgets marked.
+    '''
+    budgets, emis = data["budgets"], data["emissions"]
+    fig, ax = plt.subplots(figsize=(15, 10))
+    ax.plot(budgets, emis, '-', color='tab:blue')
+    ax.plot(budgets, emis, 'o', color='tab:blue', label=f'Optimised budgets ({len(budgets)})')
+    ax.xaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('${x:,.0f}'))
+    ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
+    ax.tick_params(labelsize=18)
+    ax.legend(fontsize=18)
+    plt.title(title, fontsize=24)
+    plt.xlabel('Budget', fontsize=22)
+    plt.ylabel('Emissions (CO2e)', fontsize=22)
+    plt.tight_layout()
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+
+
+def dose_response(data, title, path):
+    '''
+    Cost-to-abatement curve of each intervention.
+    '''
+    colormap = plt.cm.tab20
+    fig, ax = plt.subplots(figsize=(15, 10))
+    for i, (label, curve) in enumerate(data["curves"].items()):
+        ax.plot(curve["spend"], curve["abatement"], 'o-', color=colormap(i % 20), label=label)
+    ax.xaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('${x:,.0f}'))
+    ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
+    ax.tick_params(labelsize=18)
+    ax.legend(loc='upper left', bbox_to_anchor=(1.02, 1), title='Interventions', fontsize=16, title_fontsize=18)
+    plt.title(title, fontsize=24)
+    plt.xlabel('Spending', fontsize=22)
+    plt.ylabel('Emissions abated (CO2e)', fontsize=22)
+    plt.tight_layout()
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+
+
+def mac(data, title, path):
+    '''
+    Marginal abatement cost chart: bar widths are the abatement, heights the cost per tonne, cheapest first.
+    '''
+    colormap = plt.cm.tab20
+    fig, ax = plt.subplots(figsize=(15, 10))
+    left = 0.0
+    for i, row in enumerate(data["rows"]):
+        ax.bar(left, row["cost_per_tonne"], width=row["abatement"], align='edge', color=colormap(i % 20), edgecolor='black', label=row["intervention"])
+        left += row["abatement"]
+    ax.xaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
+    ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('${x:,.2f}'))
+    ax.tick_params(labelsize=18)
+    ax.legend(loc='upper left', bbox_to_anchor=(1.02, 1), title='Interventions', fontsize=16, title_fontsize=18)
+    plt.title(title, fontsize=24)
+    plt.xlabel('Cumulative emissions abated (CO2e)', fontsize=22)
+    plt.ylabel('Cost per tCO2e', fontsize=22)
+    plt.tight_layout()
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+
+
+RENDERERS = {
+    "emissions": emissions,
+    "allocation": allocation,
+    "uncertainty_scenarios": uncertainty_scenarios,
+    "uncertainty_budgets": uncertainty_budgets,
+    "frontier": frontier,
+    "dose_response": dose_response,
+    "mac": mac,
+}
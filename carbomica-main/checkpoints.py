@@ -0,0 +1,112 @@
+"""
+Per-budget checkpoints for optimisation runs.
+
+run_main opens a Checkpoint for each run, keyed by what determines its results (input workbook,
+variables.json, scenario and options), and makes it current while the scenario runs.
+scenarios.optimization records every budget as soon as it is optimised (allocation and
+diagnostics) and, while ASD runs, the best allocation so far every CHECKPOINT_SECONDS.
+
+A run with the same key - a run requeued after the API or a worker died, or the same request
+made again - skips the budgets already finished and restarts the interrupted budget from its last
+saved stage: after PSO it goes straight to ASD, and an interrupted ASD restarts from its best
+allocation. PSO itself is rerun if interrupted (pyswarm exposes no swarm state). The checkpoint
+file is removed once the run succeeds.
+"""
+import os
+import json
+import hashlib
+import contextvars
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+CHECKPOINT_SECONDS = float(os.environ.get("CARBOMICA_CHECKPOINT_SECONDS", "30"))
+CHECKPOINT_DIR = "checkpoints"  # under the project's outputs/ folder
+
+# Checkpoint of the running scenario (None outside runs, e.g. scripts calling scenario functions)
+current = contextvars.ContextVar("carbomica_checkpoint", default=None)
+
+
+def checkpoint_key(input_path, project_dir, scenario: Optional[str], options: Optional[dict]) -> str:
+    '''
+    sha256 of the input workbook and variables.json contents, the scenario and the options
+    (profiling and force excluded: neither changes results, and a forced run that was interrupted
+    must find its checkpoint when it is requeued).
+    '''
+    h = hashlib.sha256()
+    for f in (Path(input_path), Path(project_dir) / "variables.json"):
+        h.update(f.read_bytes() if f.exists() else b"")
+        h.update(b"\0")
+    opts = {k: v for k, v in (options or {}).items() if k not in ("profile", "force")}
+    h.update(json.dumps({"scenario": scenario, "options": opts}, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _budget_key(budget) -> str:
+    return repr(float(budget))
+
+
+class Checkpoint:
+    """
+    JSON checkpoint file: {"key", "budgets": {budget: {"allocation", "info"}}, "partial": {budget: {"stage", ...}}}.
+    A file with a different key is ignored (and replaced on the first save).
+    """
+
+    def __init__(self, path, key: str):
+        self.path = Path(path)
+        self.key = key
+        self.resumed = False
+        self.data: Dict[str, Any] = {"key": key, "budgets": {}, "partial": {}}
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("key") == key:
+                    self.data = data
+                    self.resumed = bool(data["budgets"] or data["partial"])
+            except (ValueError, KeyError):
+                pass
+
+    @classmethod
+    def for_run(cls, project_dir, input_path, scenario: Optional[str], options: Optional[dict]) -> "Checkpoint":
+        key = checkpoint_key(input_path, project_dir, scenario, options)
+        return cls(Path(project_dir) / "outputs" / CHECKPOINT_DIR / f"{key[:24]}.json", key)
+
+    def child(self, name: str) -> "Checkpoint":
+        '''
+        Separate checkpoint for one part of a run (a batch entry), removed when that part succeeds.
+        '''
+        key = hashlib.sha256(f"{self.key}:{name}".encode("utf-8")).hexdigest()
+        return Checkpoint(self.path.with_name(f"{self.path.stem}_{key[:8]}.json"), key)
+
+    def budget(self, budget) -> Optional[Dict[str, Any]]:
+        '''
+        {"allocation", "info"} of a finished budget, or None.
+        '''
+        return self.data["budgets"].get(_budget_key(budget))
+
+    def partial(self, budget) -> Optional[Dict[str, Any]]:
+        '''
+        Saved state of an unfinished budget: {"stage": "pso"|"asd", "allocation", ...}, or None.
+        '''
+        return self.data["partial"].get(_budget_key(budget))
+
+    def save_budget(self, budget, allocation: Dict[str, float], info: Dict[str, Any]):
+        key = _budget_key(budget)
+        self.data["budgets"][key] = {"allocation": allocation, "info": info}
+        self.data["partial"].pop(key, None)
+        self._write()
+
+    def save_partial(self, budget, stage: str, allocation: Dict[str, float], **state):
+        self.data["partial"][_budget_key(budget)] = {"stage": stage, "allocation": allocation, **state}
+        self._write()
+
+    def remove(self):
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(self.data, default=float), encoding="utf-8")
+        tmp.replace(self.path)
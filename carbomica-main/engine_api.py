@@ -1,6 +1,6 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pathlib import Path
 from typing import Optional, List, Dict, Any
 import json
@@ -10,20 +10,35 @@ import subprocess
 import os
 import shutil
 import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime
 
 # third-party for Excel handling
 import pandas as pd
 
 from storage import (
+    PROJECTS_DIR,
     create_project_folder,
     save_input_file,
     project_path,
     load_projects_index,
     save_projects_index,
+    projects_index_lock,
     add_project_to_index,
+    clone_project,
+    unshare,
 )
 from variables import load_variables, save_variables
 from books import generate_books
+from worker import get_pool, shutdown_pool, DEFAULT_WORKERS
+from runs import new_run_id, now_iso, load_run, save_run, update_run, list_runs, content_hash, run_key, find_run, artifacts_intact
+from tracing import metrics
+from scheduler import Scheduler, BacklogFull, count_programs
+import broker as brokers
+import bulk_import
+import bundles
 
 APP_ORIGINS = [
     "http://localhost:3000",
@@ -38,6 +53,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("shutdown")
+def _stop_workers():
+    shutdown_pool()
+
+@app.on_event("startup")
+def _resume_runs():
+    """
+    Requeue runs a previous API process left queued or running (oldest first); optimisations among
+    them resume from their per-budget checkpoints (see checkpoints.py). Set CARBOMICA_RESUME_RUNS=0 to skip.
+    """
+    if os.environ.get("CARBOMICA_RESUME_RUNS", "1") == "0":
+        return
+    for runs_folder in sorted(PROJECTS_DIR.glob("*/runs")):
+        project_id = runs_folder.parent.name
+        for summary in reversed(list_runs(project_id)):
+            if summary.get("status") not in ("queued", "running"):
+                continue
+            rec = load_run(project_id, summary["run_id"]) or {}
+            inp = _resolve_input(project_id)
+            estimate = _scheduler.estimate(rec.get("scenario"), rec.get("options"), count_programs(inp) if inp is not None else 0)
+            update_run(project_id, summary["run_id"], status="queued", requeued_at=now_iso())
+            if rec.get("run_key"):
+                _run_index[rec["run_key"]] = summary["run_id"]
+            options = {**(rec.get("options") or {}), "force": True} if rec.get("force") else rec.get("options")
+            _scheduler.submit(summary["run_id"], project_id, estimate, _run_background, project_id, rec.get("scenario"), options, summary["run_id"])
+
 # Simple in-memory job store (also persisted to project folder)
 _jobs = {}
 
@@ -104,10 +145,16 @@ def put_variables(project_id: str, payload: dict):
     save_variables(project_id, payload)
     return {"status": "ok", "variables": load_variables(project_id)}
 
-def _call_engine_direct(input_file: Path, out_dir: Path, scenario: Optional[str], options: Optional[dict]):
+def _call_engine_direct(input_file: Path, out_dir: Path, scenario: Optional[str], options: Optional[dict], run_id: Optional[str] = None):
     """
     Directly call the engine's programmatic entrypoint exposed in run_main.run_project.
+    Returns (ok, info) where info is the run manifest when the entrypoint returns one.
+    The run sets PROJECT_DIR and the working directory of this process, so it holds _project_lock.
     """
+    with _project_lock:
+        return _call_engine_entrypoint(input_file, out_dir, scenario, options, run_id)
+
+def _call_engine_entrypoint(input_file: Path, out_dir: Path, scenario: Optional[str], options: Optional[dict], run_id: Optional[str] = None):
     try:
         import run_main
     except Exception as e:
@@ -126,7 +173,9 @@ def _call_engine_direct(input_file: Path, out_dir: Path, scenario: Optional[str]
     try:
         # Prefer signature (input_path, out_dir, scenario, options)
         try:
-            res = fn(str(input_file), str(out_dir), scenario, options)
+            res = fn(str(input_file), str(out_dir), scenario, options, run_id=run_id)
+            if isinstance(res, dict):
+                return res.get("status") != "error", res
             return True, f"called {fn.__name__} directly, returned: {res}"
         except TypeError:
             # try simpler signatures
@@ -140,8 +189,25 @@ def _call_engine_direct(input_file: Path, out_dir: Path, scenario: Optional[str]
     except Exception as e:
         return False, f"exception calling engine entrypoint: {e}\n{traceback.format_exc()}"
 
-def _call_engine_subprocess(input_file: Path, out_dir: Path, scenario: Optional[str], options: Optional[dict]):
+def _call_engine_worker(input_file: Path, out_dir: Path, scenario: Optional[str], options: Optional[dict], run_id: Optional[str] = None):
+    """
+    Run through the persistent worker pool (atomica stays imported and projects stay warm).
+    Returns (ok, info, infra_failed): infra_failed is True when the worker itself could not serve the request.
+    """
+    try:
+        pool = get_pool()
+        resp = pool.run(input_file, out_dir, scenario, options, run_id=run_id)
+    except Exception as e:
+        return False, f"worker pool unavailable: {e}", True
+    if resp.get("ok"):
+        return True, resp.get("result"), False
+    info = resp.get("result") or {"status": "error", "error": resp.get("error"), "trace": resp.get("trace")}
+    return False, info, bool(resp.get("worker_error"))
+
+def _call_engine_subprocess(input_file: Path, out_dir: Path, scenario: Optional[str], options: Optional[dict], run_id: Optional[str] = None):
     cmd = ["python", str(Path(__file__).parent / "run_main.py"), "--input", str(input_file), "--out", str(out_dir)]
+    if run_id:
+        cmd += ["--run-id", run_id]
     if scenario:
         cmd += ["--scenario", scenario]
     # forward options if provided (spending, budgets)
@@ -158,12 +224,39 @@ def _call_engine_subprocess(input_file: Path, out_dir: Path, scenario: Optional[
             else:
                 bstr = str(b)
             cmd += ["--budgets", bstr]
+        if options.get("method"):
+            cmd += ["--method", str(options.get("method"))]
     proc = subprocess.run(cmd, capture_output=True, text=True)
+    # run_main prints the manifest as "OK: {json}" on its last stdout line
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode == 0 and lines and lines[-1].startswith("OK: "):
+        try:
+            return True, json.loads(lines[-1][4:])
+        except ValueError:
+            pass
     return proc.returncode == 0, proc.stdout + proc.stderr
 
-def _run_background(project_id: str, scenario: Optional[str], options: Optional[dict]):
+def _finish_run(project_id: str, run_id: str, ok: bool, info):
+    """
+    Record the outcome of a run in its run record and in the project status.
+    """
+    status = "finished" if ok else "failed"
+    fields = {"status": status, "finished_at": now_iso()}
+    if isinstance(info, dict):
+        fields.update({k: v for k, v in info.items() if k not in ("status", "run_id")})
+        if not ok:
+            fields.setdefault("error", info.get("error"))
+    else:
+        fields["info" if ok else "error"] = info
+    rec = update_run(project_id, run_id, **fields)
+    metrics.observe_run(rec)
+    _write_status(project_id, {"status": status, "run_id": run_id, "info": info})
+
+def _resolve_input(project_id: str) -> Optional[Path]:
+    """
+    Resolve the project's input workbook from variables / index, falling back to any .xls* in the project.
+    """
     proj = project_path(project_id)
-    # Resolve the actual input file name from variables / index, fallback to any .xls* in project
     inp = None
     try:
         vars_ = load_variables(project_id) or {}
@@ -196,45 +289,286 @@ def _run_background(project_id: str, scenario: Optional[str], options: Optional[
             if f.is_file():
                 inp = f
                 break
+    return inp
+
+def _call_engine_broker(project_id: str, input_file: Path, scenario: Optional[str], options: Optional[dict], run_id: str):
+    """
+    Run on a broker worker (any host): ship the input bundle, wait for the job and unpack the result
+    files into the project folder. Returns (ok, info) like _call_engine_direct.
+    """
+    proj = project_path(project_id).resolve()
+    rec = load_run(project_id, run_id) or {}
+    try:
+        bundle = brokers.pack_project(_broker, proj, input_file)
+        if _broker.job(run_id) is None:  # a requeued run may still be on the broker
+            _broker.submit({"project_id": project_id, "bundle": bundle, "input": input_file.resolve().relative_to(proj).as_posix(),
+                            "scenario": scenario, "options": options}, priority=0 if rec.get("lane") == "fast" else 1, job_id=run_id)
+        try:
+            job = _broker.wait(run_id, timeout=brokers.WAIT_SECONDS)
+        except TimeoutError as e:
+            _broker.cancel(run_id, str(e))
+            return False, {"status": "error", "error": f"broker run timed out: {e}"}
+        if job["status"] != "finished":
+            return False, {"status": "error", "error": job.get("error") or "broker job failed", "worker": job.get("worker")}
+        brokers.unpack(_broker, job["result"]["files"], proj)
+    except Exception as e:
+        return False, {"status": "error", "error": f"broker run failed: {e}", "trace": traceback.format_exc()}
+    info = {**job["result"]["manifest"], "worker": job["worker"]}
+    return info.get("status") != "error", info
 
+def _run_background(project_id: str, scenario: Optional[str], options: Optional[dict], run_id: Optional[str] = None):
+    run_id = run_id or new_run_id()
+    proj = project_path(project_id)
+    inp = _resolve_input(project_id)
     if inp is None:
         # record failure and exit early
-        _write_status(project_id, {"status": "failed", "info": "input workbook not found"})
+        _finish_run(project_id, run_id, False, "input workbook not found")
         return
 
     out = proj / "outputs"
     out.mkdir(exist_ok=True, parents=True)
 
-    # ensure project env is available for called modules (utils.py will pick this up)
-    os.environ["PROJECT_DIR"] = str(proj.resolve())
-
-    _write_status(project_id, {"status": "running", "pid": None, "input": str(inp)})
-    # Try direct call first
-    ok, info = _call_engine_direct(inp, out, scenario, options)
+    update_run(project_id, run_id, status="running", started_at=now_iso(), input=str(inp))
+    _write_status(project_id, {"status": "running", "pid": None, "input": str(inp), "run_id": run_id})
+    if _broker is not None:
+        ok, info = _call_engine_broker(project_id, inp, scenario, options, run_id)
+        _finish_run(project_id, run_id, ok, info)
+        return
+    # Prefer the persistent worker pool; only fall back when the worker itself failed
+    ok, info, infra_failed = _call_engine_worker(inp.resolve(), out.resolve(), scenario, options, run_id)
+    if ok or not infra_failed:
+        _finish_run(project_id, run_id, ok, info)
+        return
+    ok, info = _call_engine_direct(inp, out, scenario, options, run_id)
     if ok:
-        _write_status(project_id, {"status": "finished", "info": info})
+        _finish_run(project_id, run_id, True, info)
         return
     # fallback to subprocess (now forwards options)
-    ok2, info2 = _call_engine_subprocess(inp, out, scenario, options)
-    if ok2:
-        _write_status(project_id, {"status": "finished", "info": info2})
-    else:
-        _write_status(project_id, {"status": "failed", "info": info2})
+    ok2, info2 = _call_engine_subprocess(inp, out, scenario, options, run_id)
+    _finish_run(project_id, run_id, ok2, info2)
+
+# run_key -> id of the latest run queued with that key (see _queue_run)
+_run_index: Dict[str, str] = {}
+_run_index_lock = threading.Lock()
+_engine_hash: Optional[str] = None
+
+# runs are started by the scheduler (lanes, per-project limits, admission), one slot per engine worker;
+# with a broker (CARBOMICA_BROKER) runs execute on broker workers and the slots follow their number
+_broker = brokers.open_broker()
+_scheduler = Scheduler(DEFAULT_WORKERS)
+
+def _track_broker_workers(interval: float = 5.0):
+    while True:
+        try:
+            _scheduler.resize(max(1, _broker.live_workers()))
+        except Exception:
+            pass
+        time.sleep(interval)
+
+if _broker is not None:
+    threading.Thread(target=_track_broker_workers, daemon=True, name="broker-workers").start()
+
+def _iso(ts: float) -> str:
+    return datetime.utcfromtimestamp(ts).isoformat() + "Z"
+
+def _run_key(project_id: str, inp: Optional[Path], scenario: Optional[str], options: Optional[dict]) -> Optional[str]:
+    """
+    Identity of a run request: contents of the input workbook, variables.json and the engine code,
+    plus the scenario and options. None when the project has no input workbook.
+    """
+    global _engine_hash
+    if inp is None:
+        return None
+    if _engine_hash is None:
+        here = Path(__file__).resolve().parent
+        _engine_hash = content_hash(sorted(here.glob("*.py")) + sorted((here / "templates").glob("*.xlsx")))
+    content = content_hash([inp, project_path(project_id) / "variables.json"])
+    return run_key(f"{content}:{_engine_hash}", scenario, options)
+
+def _queue_run(project_id: str, scenario: Optional[str], options: Optional[dict], force: bool = False) -> Dict[str, Any]:
+    """
+    Create the run record and hand the run to the scheduler.
+    A request identical to a queued or running run (same run key) attaches to it, and one identical to
+    a finished run whose artifacts are unchanged is served from that run; force=True always queues.
+    Raises 429 (with Retry-After) when the scheduler's estimated backlog is full.
+    Returns { status, run_id, coalesced, lane?, estimated_seconds?, estimated_start? }.
+    """
+    inp = _resolve_input(project_id)
+    key = _run_key(project_id, inp, scenario, options)
+    with _run_index_lock:
+        if key is not None and not force:
+            rec = None
+            run_id = _run_index.get(key)
+            if run_id:
+                rec = load_run(project_id, run_id)
+            if rec is None or rec.get("status") not in ("queued", "running", "finished"):
+                rec = find_run(project_id, key)
+            if rec is not None and (rec["status"] != "finished" or artifacts_intact(project_id, rec)):
+                _run_index[key] = rec["run_id"]
+                metrics.inc("carbomica_coalesced_runs_total", {"scenario": str(scenario or "unknown"), "status": rec["status"]},
+                            help="Run requests served by an identical queued, running or finished run")
+                return {"status": rec["status"], "run_id": rec["run_id"], "coalesced": True, **_run_eta(rec["run_id"])}
+        estimate = _scheduler.estimate(scenario, options, count_programs(inp) if inp is not None else 0)
+        try:
+            _scheduler.check_admission(estimate["estimated_seconds"])
+        except BacklogFull as e:
+            metrics.inc("carbomica_rejected_runs_total", {"lane": estimate["lane"]}, help="Run requests rejected because the queue was full")
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+        run_id = new_run_id()
+        save_run(project_id, {"run_id": run_id, "project_id": project_id, "scenario": scenario, "options": options, "run_key": key,
+                              "force": bool(force), "status": "queued", "queued_at": now_iso(), "lane": estimate["lane"], "estimated_seconds": estimate["estimated_seconds"]})
+        if key is not None:
+            _run_index[key] = run_id
+        _write_status(project_id, {"status": "queued", "scenario": scenario, "run_id": run_id})
+        # force also bypasses the engine's stage caches (run_main.project_pipeline)
+        engine_options = {**(options or {}), "force": True} if force else options
+        _scheduler.submit(run_id, project_id, estimate, _run_background, project_id, scenario, engine_options, run_id)
+    return {"status": "queued", "run_id": run_id, "coalesced": False, **_run_eta(run_id)}
+
+def _run_eta(run_id: Optional[str]) -> Dict[str, Any]:
+    """
+    Scheduler estimate for a queued or running run: { lane, estimated_seconds, estimated_start, ... }, else {}.
+    """
+    eta = _scheduler.eta(run_id) if run_id else None
+    if eta is None:
+        return {}
+    eta["estimated_start"] = _iso(eta["estimated_start"])
+    return eta
 
 @app.post("/projects/{project_id}/run")
-def run_project(project_id: str, background_tasks: BackgroundTasks, scenario: Optional[str] = None, options: Optional[dict] = None):
-    proj = project_path(project_id)
-    inp = proj / "input_data.xlsx"
-    if not inp.exists():
+def run_project(project_id: str, scenario: Optional[str] = None, options: Optional[dict] = None, force: bool = False):
+    # the project's recorded input workbook (imported and uploaded projects keep their file names)
+    if _resolve_input(project_id) is None:
         raise HTTPException(status_code=404, detail="Input file not found")
-    # enqueue background task
-    _write_status(project_id, {"status": "queued"})
-    background_tasks.add_task(_run_background, project_id, scenario, options)
-    return {"status": "queued"}
+    # enqueue background task (or attach to an identical run)
+    return _queue_run(project_id, scenario, options, force=force)
 
 @app.get("/projects/{project_id}/status")
 def project_status(project_id: str):
-    return _read_status(project_id)
+    """
+    Latest run status of the project; queued and running runs include the scheduler's lane,
+    estimated_seconds, estimated_wait_seconds and estimated_start.
+    """
+    status = _read_status(project_id)
+    if status.get("status") in ("queued", "running"):
+        status = {**status, **_run_eta(status.get("run_id"))}
+    return status
+
+# projects built in the API process (validate / evaluate) stay warm between calls (same cache shape
+# as the engine workers); building (like an in-process run) changes the working directory and
+# PROJECT_DIR, which are process-wide, so one at a time
+_project_cache: Dict[str, Any] = {}
+_project_lock = threading.Lock()
+
+def _warm_context(project_id: str):
+    """
+    Return the cached (or freshly built) project context, raising 404 if the project or input is missing.
+    """
+    proj = project_path(project_id)
+    if not proj.exists():
+        raise HTTPException(status_code=404, detail="Project not found")
+    inp = _resolve_input(project_id)
+    if inp is None:
+        raise HTTPException(status_code=404, detail="Input file not found")
+    from run_main import project_context
+    try:
+        with _project_lock:
+            return project_context(str(proj), cache=_project_cache)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"failed to load project: {e}")
+
+@app.post("/projects/{project_id}/validate")
+def validate_project(project_id: str, payload: Optional[dict] = None):
+    """
+    Check the project's programs numerically against its input workbook (see validation.py).
+    Body (optional): { investment?: number, workers?: int, export?: bool }
+    Returns the report: { status: 'pass'|'fail', summary: {total, passed, failed}, checks: [...] }.
+    Raw exports are written to outputs/validation/ only when export is true.
+    """
+    payload = payload or {}
+    kwargs: Dict[str, Any] = {}
+    try:
+        if payload.get("investment") is not None:
+            kwargs["investment"] = float(payload["investment"])
+        if payload.get("workers") is not None:
+            kwargs["workers"] = int(payload["workers"])
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="investment and workers must be numbers")
+    ctx = _warm_context(project_id)
+    if payload.get("export"):
+        kwargs["export_dir"] = str(project_path(project_id) / "outputs" / "validation")
+
+    import validation
+    try:
+        return validation.validate_context(ctx, **kwargs)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"validation failed to run: {e}")
+
+@app.post("/projects/{project_id}/evaluate")
+def evaluate_project(project_id: str, payload: Optional[dict] = None):
+    """
+    Synchronous what-if evaluation for interactive controls (see evaluator.what_if); nothing is written.
+    Body: { allocation: {intervention code: spending} } or { coverage: {intervention code: fraction} };
+    an empty body evaluates zero spending, which lists the interventions with their max_spend.
+    Returns { engine, total, status_quo_total, reduction, emissions: {source: value},
+              programs: [{code, label, spend, coverage, max_spend}], seconds }.
+    The project is built on the first call and kept warm until its input workbook or variables change.
+    """
+    payload = payload or {}
+    allocation, coverage = payload.get("allocation"), payload.get("coverage")
+    if allocation is not None and coverage is not None:
+        raise HTTPException(status_code=400, detail="pass either allocation or coverage, not both")
+    if not isinstance(allocation if allocation is not None else coverage if coverage is not None else {}, dict):
+        raise HTTPException(status_code=400, detail="allocation / coverage must be an object of intervention: value")
+    ctx = _warm_context(project_id)
+
+    import evaluator
+    try:
+        with _project_lock:
+            evaluator.cached_model(ctx)  # compiled once per project build
+        return evaluator.what_if(ctx, allocation=allocation, coverage=coverage)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"evaluation failed: {e}")
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """
+    Prometheus text exposition: run counts, run and per-stage durations, current job states and the
+    scheduler's queue per lane and estimated backlog.
+    """
+    states: Dict[tuple, float] = {}
+    for data in list(_jobs.values()):
+        key = (("status", str(data.get("status"))),)
+        states[key] = states.get(key, 0) + 1
+    queue = _scheduler.snapshot()
+    lanes: Dict[tuple, float] = {}
+    for state in ("queued", "running"):
+        for lane, n in queue[state].items():
+            lanes[(("lane", lane), ("state", state))] = n
+    body = metrics.render(gauges={"carbomica_jobs": states, "carbomica_scheduler_runs": lanes,
+                                  "carbomica_scheduler_backlog_seconds": {(): queue["backlog_seconds"]}})
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.get("/projects/{project_id}/runs")
+def project_runs(project_id: str):
+    """
+    List runs for a project (newest first): [{ run_id, scenario, status, queued_at, started_at, finished_at }]
+    """
+    return {"runs": list_runs(project_id)}
+
+@app.get("/projects/{project_id}/runs/{run_id}")
+def project_run(project_id: str, run_id: str):
+    """
+    Return the run record: status fields plus the run manifest (artifacts, results, timings) once finished.
+    """
+    rec = load_run(project_id, run_id)
+    if rec is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if rec.get("status") in ("queued", "running"):
+        rec.update(_run_eta(run_id))
+    return rec
 
 # helper to list projects — read the persisted index (normalized shape)
 @app.get("/projects")
@@ -308,42 +642,44 @@ async def create_project(
         generate_books(saved_path, gen_start, gen_end, output_dir=str(books_dir))
     except Exception as e:
         # Don't fail create -- just log and continue; front-end can retry book generation
+        with projects_index_lock():
+            idx = load_projects_index()
+            # update index with books_path even if generation failed
+            for p in idx.get("projects", []):
+                if p.get("project_id") == pid:
+                    p["books_path"] = str(books_dir.resolve())
+                    break
+            save_projects_index(idx)
+
+    # update projects index entry with filename / start_year / name / facility_code / books_path
+    with projects_index_lock():
         idx = load_projects_index()
-        # update index with books_path even if generation failed
+        updated = False
         for p in idx.get("projects", []):
             if p.get("project_id") == pid:
+                p["project_name"] = vars_.get("project_name") or p.get("project_name")
+                if start_year is not None:
+                    p["start_year"] = vars_.get("start_year")
+                if facility_code:
+                    p["facility_code"] = vars_.get("facility_code")
+                p["input_filename"] = Path(saved_path).name
                 p["books_path"] = str(books_dir.resolve())
+                p["has_outputs"] = (project_path(pid) / "outputs").exists()
+                updated = True
                 break
+        if not updated:
+            idx.setdefault("projects", []).append({
+                "project_id": pid,
+                "project_name": vars_.get("project_name"),
+                "start_year": vars_.get("start_year"),
+                "input_filename": Path(saved_path).name,
+                "books_path": str(books_dir.resolve()),
+                "created_at": None,
+                "has_outputs": (project_path(pid) / "outputs").exists(),
+                "facility_code": vars_.get("facility_code"),
+            })
         save_projects_index(idx)
 
-    # update projects index entry with filename / start_year / name / facility_code / books_path
-    idx = load_projects_index()
-    updated = False
-    for p in idx.get("projects", []):
-        if p.get("project_id") == pid:
-            p["project_name"] = vars_.get("project_name") or p.get("project_name")
-            if start_year is not None:
-                p["start_year"] = vars_.get("start_year")
-            if facility_code:
-                p["facility_code"] = vars_.get("facility_code")
-            p["input_filename"] = Path(saved_path).name
-            p["books_path"] = str(books_dir.resolve())
-            p["has_outputs"] = (project_path(pid) / "outputs").exists()
-            updated = True
-            break
-    if not updated:
-        idx.setdefault("projects", []).append({
-            "project_id": pid,
-            "project_name": vars_.get("project_name"),
-            "start_year": vars_.get("start_year"),
-            "input_filename": Path(saved_path).name,
-            "books_path": str(books_dir.resolve()),
-            "created_at": None,
-            "has_outputs": (project_path(pid) / "outputs").exists(),
-            "facility_code": vars_.get("facility_code"),
-        })
-    save_projects_index(idx)
-
     return {
         "project_id": pid,
         "input_path": str(dest),
@@ -353,6 +689,91 @@ async def create_project(
         "books_path": str(books_dir.resolve()),
     }
 
+@app.post("/projects/import")
+async def import_projects(file: UploadFile = File(...), start_year: Optional[int] = Form(None), workers: Optional[int] = Form(None)):
+    """
+    Create a project per input workbook of a zip archive (see bulk_import.py). Workbooks are
+    validated, all projects are added to the index at once and their books are generated in
+    parallel worker processes (never in the server process, whose working directory other
+    requests rely on). The response streams progress as NDJSON, one event per line:
+    start, a file event per workbook (created or invalid with the error), a books event per
+    project as its books are generated, and done with the counts.
+    """
+    tmp = tempfile.NamedTemporaryFile(prefix="carbomica-import-", suffix=".zip", delete=False)
+    try:
+        with tmp:
+            shutil.copyfileobj(file.file, tmp)
+    finally:
+        await file.close()
+    if not zipfile.is_zipfile(tmp.name):
+        os.unlink(tmp.name)
+        raise HTTPException(status_code=400, detail="Expected a zip archive of input workbooks")
+
+    def stream():
+        try:
+            for event in bulk_import.import_projects(tmp.name, start_year, workers, in_process=False):
+                yield json.dumps(event, default=str) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "error": str(e)}) + "\n"
+        finally:
+            os.unlink(tmp.name)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/projects/import-bundle")
+def import_bundle(file: UploadFile = File(...), project_name: Optional[str] = Form(None)):
+    """
+    Create a project from a bundle exported with GET /projects/{id}/export (see bundles.py). Every
+    file is checked against the sha256 recorded in the bundle before the project is added to the
+    index; a damaged or altered bundle is rejected with 400 and nothing is kept.
+    """
+    tmp = tempfile.NamedTemporaryFile(prefix="carbomica-bundle-", delete=False)
+    with tmp:
+        shutil.copyfileobj(file.file, tmp)
+    try:
+        info = bundles.import_bundle(tmp.name, project_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.unlink(tmp.name)
+    _write_status(info["project_id"], {"status": "uploaded", "source_id": info["source_id"]})
+    return info
+
+@app.get("/projects/{project_id}/export")
+def export_project(project_id: str, format: str = "zip", results_only: bool = False, latest_run: bool = False):
+    """
+    Stream a bundle of the project: input workbook, variables, books, results, graphs, cached
+    pipeline stages and run records, with the sha256 of every file in bundle.json. The archive
+    is built while it is sent, so memory use does not grow with the project.
+    format: 'zip' or 'tar.zst' (needs zstandard); results_only: only results, graphs and run
+    records; latest_run: only the newest finished run's record and artifacts.
+    """
+    try:
+        stream = bundles.export_bundle(project_id, format, results_only, latest_run)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Project not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = f"{project_id}{'-results' if results_only else ''}.{format}"
+    return StreamingResponse(stream, media_type=bundles.FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.post("/projects/{project_id}/clone")
+def clone(project_id: str, payload: Optional[Dict[str, Any]] = None):
+    """
+    Create a variant of a project. The clone shares the parent's input workbook, books, results,
+    graphs and cached pipeline stages (reflinks or hardlinks, see storage.clone_project), so it is
+    created without generating books and its runs reuse the parent's work until its inputs change
+    through put_sheet or variable edits. Files are copied only as they diverge.
+    payload: { project_name?: str } (default: "<parent name> (copy)")
+    """
+    try:
+        info = clone_project(project_id, (payload or {}).get("project_name"))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Project not found")
+    _write_status(info["project_id"], {"status": "uploaded", "parent_id": project_id})
+    return info
+
 # get a sheet as JSON (databook/progbook)
 @app.get("/projects/{project_id}/sheet")
 def get_sheet(project_id: str, sheet: str = "databook", sheet_name: Optional[str] = None):
@@ -449,12 +870,32 @@ def get_sheet(project_id: str, sheet: str = "databook", sheet_name: Optional[str
         return JSONResponse(status_code=500, content={"error": str(e), "trace": traceback.format_exc()})
 
 # update a sheet (replace whole sheet)
+def _replace_sheet(path: Path, sheet_name: str, df: pd.DataFrame):
+    """
+    Replace (or append) a sheet of a workbook with df (header row first), keeping the sheet order.
+    Formulas of the other sheets are saved as their last computed values: openpyxl cannot
+    recompute them, and a workbook it saved with formulas reads as empty cells in pandas.
+    """
+    import openpyxl
+    wb = openpyxl.load_workbook(path, data_only=True)
+    if sheet_name in wb.sheetnames:
+        pos = wb.sheetnames.index(sheet_name)
+        wb.remove(wb[sheet_name])
+        ws = wb.create_sheet(sheet_name, pos)
+    else:
+        ws = wb.create_sheet(sheet_name)
+    ws.append([str(c) for c in df.columns])
+    for row in df.itertuples(index=False):
+        ws.append([None if pd.isna(v) else (v.item() if hasattr(v, "item") else v) for v in row])
+    wb.save(path)
+
 @app.put("/projects/{project_id}/sheet")
 def put_sheet(project_id: str, payload: Dict):
     """
     payload: { sheet: "emission data"|'emission targets'|..., sheet_name?: str, rows: [{col:val,..}], columns?: [colnames] }
-    This replaces the sheet in outputs/{sheet}.xlsx (or creates it). Also tries to write changes directly into per-project books/{...}
-    (databook/progbook) when available; otherwise falls back to editing the uploaded input workbook.
+    This replaces the sheet in outputs/{sheet}.xlsx (or creates it) and in the project's input workbook.
+    The books (databook/progbook) are generated from the input workbook, so the next run regenerates
+    them with the edit; their own sheets cannot be edited (400), as a regeneration would discard it.
     """
     proj = project_path(project_id)
     data = payload
@@ -464,6 +905,47 @@ def put_sheet(project_id: str, payload: Dict):
     columns = data.get("columns", None)
     if not isinstance(rows, list):
         raise HTTPException(status_code=400, detail="rows must be a list")
+    desired = str(sheet_name or sheet or "Sheet1")
+
+    def find_sheet(path):
+        try:
+            return next((s for s in pd.ExcelFile(path).sheet_names if s.strip().lower() == desired.strip().lower()), None)
+        except Exception:
+            return None
+
+    # the project's uploaded workbook (recorded input_filename or any .xlsx in project)
+    input_candidates = []
+    try:
+        idx = load_projects_index()
+        for p in idx.get("projects", []):
+            if p.get("project_id") == project_id:
+                fn = p.get("input_filename")
+                if fn:
+                    input_candidates.append(proj / fn)
+                break
+    except Exception:
+        pass
+
+    try:
+        vars_ = load_variables(project_id) or {}
+        fn = vars_.get("input_filename")
+        if fn:
+            input_candidates.append(proj / fn)
+    except Exception:
+        pass
+
+    if not input_candidates:
+        for f in proj.glob("*.xls*"):
+            input_candidates.append(f)
+
+    input_file = next((c for c in input_candidates if c.exists()), None)
+    input_sheet = find_sheet(input_file) if input_file else None
+    if input_sheet is None:
+        book = next((b for b in sorted((proj / "books").glob("*.xls*")) if find_sheet(b)), None)
+        if book is not None:
+            raise HTTPException(status_code=400, detail=f"'{desired}' is a sheet of the generated book {book.name}; "
+                                                        "books are regenerated from the input workbook, edit its sheets instead")
+
     out_dir = proj / "outputs"
     out_dir.mkdir(exist_ok=True, parents=True)
     target = out_dir / f"{sheet}.xlsx"
@@ -471,92 +953,18 @@ def put_sheet(project_id: str, payload: Dict):
         df = pd.DataFrame(rows)
         if columns:
             df = df.reindex(columns=columns)
-        # write to outputs/{sheet}.xlsx for quick viewing
+        # write to outputs/{sheet}.xlsx for quick viewing (files shared with a clone's parent are unshared first)
+        unshare(target, keep=False)
         df.to_excel(target, sheet_name=sheet or "Sheet1", index=False, engine="openpyxl")
 
-        # Prefer to write into per-project books if databook/progbook exists
-        books_dir = proj / "books"
-        written_to_books = False
-        if books_dir.exists():
-            # try to find an appropriate workbook in books/ that contains the sheet name
-            candidate_books = list(books_dir.glob("*.xls*"))
-            # heuristic: prefer files that include 'databook'/'progbook' or facility code
-            candidate_books.sort(key=lambda p: (('databook' in p.name.lower()) or ('progbook' in p.name.lower())), reverse=True)
-            for cb in candidate_books:
-                try:
-                    xlf = pd.ExcelFile(cb)
-                    # match sheet_name preference: sheet_name param -> sheet, else look for sheet in sheet_titles
-                    desired = sheet_name or sheet
-                    match = next((s for s in xlf.sheet_names if s.strip().lower() == str(desired).strip().lower()), None)
-                    # if we found a workbook that already contains the sheet, write into it
-                    target_sheet_name = match or (sheet_name or sheet or "Sheet1")
-                    # use ExcelWriter replace if supported
-                    try:
-                        with pd.ExcelWriter(cb, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
-                            df.to_excel(writer, sheet_name=target_sheet_name, index=False)
-                    except ValueError:
-                        # fallback remove sheet then append
-                        import openpyxl
-                        wb = openpyxl.load_workbook(cb)
-                        if target_sheet_name in wb.sheetnames:
-                            std = wb[target_sheet_name]
-                            wb.remove(std)
-                            wb.save(cb)
-                        with pd.ExcelWriter(cb, engine="openpyxl", mode="a") as writer:
-                            df.to_excel(writer, sheet_name=target_sheet_name, index=False)
-                    written_to_books = True
-                    break
-                except Exception:
-                    continue
-
         wrote_to_input = False
-        if not written_to_books:
-            # Try to write back into the project's uploaded workbook (recorded input_filename or any .xlsx in project)
-            input_candidates = []
-            try:
-                idx = load_projects_index()
-                for p in idx.get("projects", []):
-                    if p.get("project_id") == project_id:
-                        fn = p.get("input_filename")
-                        if fn:
-                            input_candidates.append(proj / fn)
-                        break
-            except Exception:
-                pass
-
-            try:
-                vars_ = load_variables(project_id) or {}
-                fn = vars_.get("input_filename")
-                if fn:
-                    input_candidates.append(proj / fn)
-            except Exception:
-                pass
+        if input_file:
+            # replace or create sheet inside the input workbook
+            unshare(input_file)
+            _replace_sheet(input_file, input_sheet or desired, df)
+            wrote_to_input = True
 
-            if not input_candidates:
-                for f in proj.glob("*.xls*"):
-                    input_candidates.append(f)
-
-            input_file = next((c for c in input_candidates if c.exists()), None)
-
-            if input_file:
-                # replace or create sheet inside the input workbook
-                try:
-                    with pd.ExcelWriter(input_file, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
-                        df.to_excel(writer, sheet_name=sheet or "Sheet1", index=False)
-                    wrote_to_input = True
-                except ValueError:
-                    import openpyxl
-                    wb = openpyxl.load_workbook(input_file)
-                    target_sheet_name = sheet or "Sheet1"
-                    if target_sheet_name in wb.sheetnames:
-                        std = wb[target_sheet_name]
-                        wb.remove(std)
-                        wb.save(input_file)
-                    with pd.ExcelWriter(input_file, engine="openpyxl", mode="a") as writer:
-                        df.to_excel(writer, sheet_name=target_sheet_name, index=False)
-                    wrote_to_input = True
-
-        return {"status": "ok", "path": str(target), "wrote_to_books": written_to_books, "wrote_to_input": wrote_to_input}
+        return {"status": "ok", "path": str(target), "wrote_to_input": wrote_to_input}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e), "trace": traceback.format_exc()})
 
@@ -641,17 +1049,55 @@ def create_scenario(project_id: str, payload: Dict[str, Any]):
     return {"scenario": new}
 
 @app.post("/projects/{project_id}/scenarios/run")
-def run_scenario(project_id: str, background_tasks: BackgroundTasks, payload: Dict):
+def run_scenario(project_id: str, payload: Dict):
     """
-    payload: { scenario: 'name', options?: {...} }
-    Enqueue background run (uses existing _run_background) and records status.
+    payload: { scenario: 'name', options?: {...}, force?: bool }
+    Enqueue background run (uses existing _run_background) and records status; an identical queued,
+    running or finished run is returned instead unless force is set (see _queue_run).
     """
     scenario = payload.get("scenario") or payload.get("name") or "baseline"
     options = payload.get("options", None)
     # record queued status per scenario
-    _write_status(project_id, {"status": "queued", "scenario": scenario})
-    background_tasks.add_task(_run_background, project_id, scenario, options)
-    return {"status": "queued", "scenario": scenario}
+    queued = _queue_run(project_id, scenario, options, force=bool(payload.get("force")))
+    return {**queued, "scenario": scenario}
+
+
+@app.post("/projects/{project_id}/scenarios/run-batch")
+def run_scenario_batch(project_id: str, payload: Optional[Dict[str, Any]] = None):
+    """
+    Run several scenarios as one job with a single project build (see run_main.run_batch).
+    payload: { scenarios?: [name | {name, scenario?, spending?, budgets?, options?}], workers?: int, options?: {...}, force?: bool }
+    Names refer to the scenarios saved in variables.json (else to a scenario kind such as 'coverage');
+    without scenarios every saved scenario is run. options apply to the whole job (e.g. validate, profile).
+    Returns { status, run_id, coalesced, scenarios: [{name, scenario, options}] }; per-scenario results are in
+    the run record under results.batch.entries.
+    """
+    import run_main
+    payload = payload or {}
+    saved = {}
+    for v in (load_variables(project_id) or {}).get("scenarios") or []:
+        if isinstance(v, dict) and v.get("name"):
+            saved[v["name"]] = v
+        elif isinstance(v, str):
+            saved[v] = {"name": v}
+    requested = payload.get("scenarios")
+    if requested is None:
+        requested = list(saved.values())
+    if not isinstance(requested, list) or not requested:
+        raise HTTPException(status_code=400, detail="no scenarios to run")
+    try:
+        entries = run_main.batch_entries([saved.get(d, d) if isinstance(d, str) else d for d in requested])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    options = dict(payload.get("options") or {})
+    options["batch"] = entries
+    if payload.get("workers") is not None:
+        try:
+            options["workers"] = int(payload["workers"])
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="workers must be an integer")
+    queued = _queue_run(project_id, "batch", options, force=bool(payload.get("force")))
+    return {**queued, "scenarios": entries}
 
 
 @app.get("/projects/{project_id}/scenarios/{scenario}/table")
@@ -0,0 +1,500 @@
+"""
+Vectorised emissions model for projects built from books.py.
+
+The generated framework is small: each emission source is `<src>_baseline*(1-<src>_mult)`,
+co2e_emissions is the sum of the sources, and each `<src>_mult` is driven by a Covout over the
+programs targeting that source. With the 'random' coverage interaction (and the best single
+effect for overlapping programs) the Covout value is
+
+    mult = b + sum_k d_k c_k prod_{j<k} (1 - c_j)      deltas d sorted by |d|, largest first
+
+where c_i = min(1, spend_i / unit_cost_i / eligible_i), so each pair of programs takes the
+signed delta of the larger |d|; compile_model checks this against the Covout pair by pair and
+raises ValueError for impact interactions it cannot express. EmissionsModel compiles these
+pieces from a built Atomica project into padded NumPy arrays so a whole batch of allocations is
+evaluated with a few array operations instead of one P.run_sim each:
+
+    model = compile_model(P, progset, start_year)
+    model.total(spend)            # spend: (n_programs,) or (batch, n_programs) -> total emissions
+    model.total(spend, effect_scale, unit_costs)   # the same with sampled inputs per row
+    model.validate(P)             # compare against P.run_sim on sampled allocations
+    greedy_allocation(model, budget)      # milliseconds, for previews and as a starting point
+    optimize_allocation(model, budget)
+    what_if(ctx, allocation={...})        # one allocation or coverage for a warm project context
+"""
+import re
+import time
+from typing import Optional, Dict, Any, List
+
+import numpy as np
+
+_EMISSION_FN = re.compile(r"^\s*(\w+)\s*\*\s*\(\s*1\s*-\s*(\w+)\s*\)\s*$")
+TOTAL_PAR = "co2e_emissions"
+DEFAULT_RTOL = 1e-6
+GREEDY_STEPS = 200
+
+
+class EmissionsModel:
+    """
+    Emissions at start_year as a function of program spending.
+    :param programs: Program code names (column order of spend arrays).
+    :param unit_costs: Unit cost per program ($/facility/year).
+    :param eligible: Size of each program's target compartments.
+    :param sources: Emission source parameter names.
+    :param baselines: Baseline emissions per source.
+    :param mult_baseline: Covout baseline per source (status-quo mult for sources without a Covout).
+    :param prog_index: (n_sources, K) program index per source, padded with n_programs.
+    :param deltas: (n_sources, K) effect minus baseline, same layout, padded with 0.
+    :param mult_bounds: (min, max) arrays bounding each mult parameter.
+    """
+
+    def __init__(self, programs, unit_costs, eligible, sources, baselines, mult_baseline, prog_index, deltas, mult_bounds, additive=None, start_year=None, facility_code=None):
+        self.programs: List[str] = list(programs)
+        self.sources: List[str] = list(sources)
+        self.unit_costs = np.asarray(unit_costs, dtype=float)
+        self.eligible = np.asarray(eligible, dtype=float)
+        self.baselines = np.asarray(baselines, dtype=float)
+        self.mult_baseline = np.asarray(mult_baseline, dtype=float)
+        self.prog_index = np.asarray(prog_index, dtype=int)
+        self.deltas = np.asarray(deltas, dtype=float)
+        self.mult_min, self.mult_max = (np.asarray(b, dtype=float) for b in mult_bounds)
+        self.additive = np.zeros(len(self.sources), dtype=bool) if additive is None else np.asarray(additive, dtype=bool)
+        self.start_year = start_year
+        self.facility_code = facility_code
+
+    @property
+    def n_programs(self) -> int:
+        return len(self.programs)
+
+    def allocation_vector(self, alloc: Dict[str, float]) -> np.ndarray:
+        return np.array([float(alloc.get(prog, 0.0)) for prog in self.programs])
+
+    def allocation_dict(self, spend) -> Dict[str, float]:
+        return {prog: float(v) for prog, v in zip(self.programs, np.asarray(spend, dtype=float))}
+
+    def coverage(self, spend, unit_costs=None) -> np.ndarray:
+        '''
+        Proportion covered per program for spend of shape (n_programs,) or (batch, n_programs).
+        :param unit_costs: Optional unit costs replacing the project's, (n_programs,) or (batch, n_programs).
+        '''
+        spend = np.maximum(np.asarray(spend, dtype=float), 0.0)
+        unit_costs = self.unit_costs if unit_costs is None else np.asarray(unit_costs, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = spend / unit_costs / self.eligible
+        return np.clip(np.nan_to_num(cov, nan=0.0, posinf=1.0), 0.0, 1.0)
+
+    def mults(self, spend, effect_scale=None, unit_costs=None) -> np.ndarray:
+        '''
+        Covout values per source, shape (batch, n_sources).
+        :param effect_scale: Optional factor on each program's effect, (n_programs,) or (batch, n_programs).
+        :param unit_costs: Optional unit costs, see coverage().
+        '''
+        cov = np.atleast_2d(self.coverage(spend, unit_costs))
+        # padded column n_programs has zero coverage and zero delta
+        covp = np.concatenate([cov, np.zeros((cov.shape[0], 1))], axis=1)
+        c = covp[:, self.prog_index]                                      # (batch, sources, K)
+        deltas = self.deltas[None]
+        if effect_scale is not None:
+            deltas, order = _scaled_deltas(self.deltas, self.prog_index, effect_scale)
+            shape = np.broadcast_shapes(c.shape, order.shape)
+            c = np.take_along_axis(np.broadcast_to(c, shape), np.broadcast_to(order, shape), axis=2)
+        uncovered = np.cumprod(1.0 - c, axis=2)
+        uncovered = np.concatenate([np.ones_like(c[:, :, :1]), uncovered[:, :, :-1]], axis=2)
+        overlap = np.where(self.additive[None, :, None], 1.0, uncovered)
+        mult = self.mult_baseline + (deltas * c * overlap).sum(axis=2)
+        return np.clip(mult, self.mult_min, self.mult_max)
+
+    def emissions(self, spend, effect_scale=None, unit_costs=None) -> np.ndarray:
+        '''
+        Emissions per source, shape (batch, n_sources).
+        '''
+        return self.baselines * (1.0 - self.mults(spend, effect_scale, unit_costs))
+
+    def total(self, spend, effect_scale=None, unit_costs=None) -> np.ndarray:
+        '''
+        Total emissions (co2e_emissions), shape (batch,).
+        '''
+        return self.emissions(spend, effect_scale, unit_costs).sum(axis=1)
+
+    def with_inputs(self, effect_scale=None, unit_costs=None) -> "EmissionsModel":
+        '''
+        Copy of the model with each program's effect scaled by effect_scale and/or new unit costs,
+        e.g. one sample of an uncertainty analysis that is then re-optimised.
+        '''
+        deltas, prog_index = self.deltas, self.prog_index
+        if effect_scale is not None:
+            scaled, order = _scaled_deltas(self.deltas, self.prog_index, np.asarray(effect_scale, dtype=float))
+            deltas, prog_index = scaled[0], np.take_along_axis(self.prog_index, order[0], axis=1)
+        return EmissionsModel(
+            self.programs, self.unit_costs if unit_costs is None else unit_costs, self.eligible, self.sources,
+            self.baselines, self.mult_baseline, prog_index, deltas, (self.mult_min, self.mult_max),
+            additive=self.additive, start_year=self.start_year, facility_code=self.facility_code,
+        )
+
+    def validate(self, P, n_samples: int = 20, seed: int = 0, rtol: float = DEFAULT_RTOL, atol: float = 1e-6) -> Dict[str, Any]:
+        '''
+        Compare per-source emissions with P.run_sim for sampled allocations (zero spending,
+        each program at its unit cost, and random spending up to twice the unit costs).
+        :return: {"passed", "samples", "max_abs_error", "max_rel_error"}
+        '''
+        import atomica as at
+        rng = np.random.default_rng(seed)
+        samples = [np.zeros(self.n_programs)]
+        samples += [np.where(np.arange(self.n_programs) == i, self.unit_costs, 0.0) for i in range(min(self.n_programs, n_samples))]
+        samples += list(rng.uniform(0.0, 2.0, (n_samples, self.n_programs)) * self.unit_costs * rng.integers(0, 2, (n_samples, self.n_programs)))
+        fast = self.emissions(np.array(samples))
+        max_abs = max_rel = 0.0
+        passed = True
+        for spend, row in zip(samples, fast):
+            instructions = at.ProgramInstructions(start_year=self.start_year, alloc=self.allocation_dict(spend))
+            res = P.run_sim(P.parsets[0], progset=P.progsets[0], progset_instructions=instructions, result_name="validate")
+            start_i = list(res.t).index(self.start_year)
+            pop = res.pop_names[0]
+            sim = np.array([res.get_variable(src, pop)[0].vals[start_i] for src in self.sources])
+            err = np.abs(sim - row)
+            max_abs = max(max_abs, float(err.max(initial=0.0)))
+            max_rel = max(max_rel, float((err / np.maximum(np.abs(sim), 1e-12)).max(initial=0.0)))
+            passed = passed and bool(np.allclose(row, sim, rtol=rtol, atol=atol))
+        return {"passed": passed, "samples": len(samples), "max_abs_error": max_abs, "max_rel_error": max_rel}
+
+
+def compile_model(P, progset, start_year, facility_code=None, status_quo=None) -> EmissionsModel:
+    '''
+    Build an EmissionsModel from a project generated by books.py.
+    Raises ValueError if the framework does not have the books.py structure.
+    :param P: Atomica project (framework, databook and progbook loaded).
+    :param progset: Program set of the project.
+    :param start_year: Year the emissions are evaluated in (as in the scenarios).
+    :param status_quo: Status-quo result of P to read baselines from (simulated if omitted).
+    '''
+    F = P.framework
+    functions = F.pars["function"]
+    total_fn = functions.get(TOTAL_PAR)
+    if not isinstance(total_fn, str):
+        raise ValueError(f"framework has no {TOTAL_PAR} function")
+    sources = [s.strip() for s in total_fn.split("+")]
+    structure = {}
+    for src in sources:
+        m = _EMISSION_FN.match(str(functions.get(src)))
+        if not m:
+            raise ValueError(f"emission source {src!r} is not of the form <baseline>*(1-<mult>)")
+        structure[src] = (m.group(1), m.group(2))
+
+    # one status-quo simulation gives baselines, status-quo mults and compartment sizes
+    res = status_quo if status_quo is not None else P.run_sim(parset=P.parsets[0], result_name="evaluator")
+    start_i = list(res.t).index(start_year)
+    pop = facility_code or res.pop_names[0]
+
+    def value(name):
+        return float(res.get_variable(name, pop)[0].vals[start_i])
+
+    programs = list(progset.programs.keys())
+    unit_costs, eligible = [], []
+    for prog in programs:
+        program = progset.programs[prog]
+        unit_costs.append(float(np.squeeze(program.unit_cost.interpolate(start_year))))
+        eligible.append(sum(value(comp) for comp in program.target_comps for p in program.target_pops if p == pop))
+
+    rows_idx, rows_delta, mult_base, additive, lo, hi = [], [], [], [], [], []
+    for src in sources:
+        base_par, mult_par = structure[src]
+        lo.append(_bound(F.pars.at[mult_par, "minimum value"], -np.inf))
+        hi.append(_bound(F.pars.at[mult_par, "maximum value"], np.inf))
+        covout = progset.covouts.get((mult_par, pop))
+        if covout is None or not covout.progs:
+            mult_base.append(value(mult_par))
+            rows_idx.append([])
+            rows_delta.append([])
+            additive.append(False)
+            continue
+        if covout.cov_interaction not in ("random", "additive"):
+            raise ValueError(f"unsupported coverage interaction {covout.cov_interaction!r} for {mult_par}")
+        b = float(covout.baseline)
+        pairs = sorted(((programs.index(p), float(v) - b) for p, v in covout.progs.items()), key=lambda x: -abs(x[1]))
+        _check_pairs(covout, [(programs[i], d) for i, d in pairs], mult_par)
+        mult_base.append(b)
+        rows_idx.append([i for i, _ in pairs])
+        rows_delta.append([d for _, d in pairs])
+        additive.append(covout.cov_interaction == "additive")
+
+    k = max([len(r) for r in rows_idx] + [1])
+    prog_index = np.full((len(sources), k), len(programs), dtype=int)
+    deltas = np.zeros((len(sources), k))
+    for s, (idx, d) in enumerate(zip(rows_idx, rows_delta)):
+        prog_index[s, :len(idx)] = idx
+        deltas[s, :len(d)] = d
+
+    return EmissionsModel(
+        programs, unit_costs, eligible, sources,
+        baselines=[value(structure[src][0]) for src in sources],
+        mult_baseline=mult_base, prog_index=prog_index, deltas=deltas,
+        mult_bounds=(lo, hi), additive=additive, start_year=start_year, facility_code=pop,
+    )
+
+
+def _check_pairs(covout, pairs, mult_par):
+    '''
+    The closed form gives every pair of programs the signed delta of whichever comes first in
+    `pairs`. Compare that with the outcome the Covout itself uses for each pair (explicit impact
+    interactions, ties, mixed signs) and refuse to compile a source where they differ.
+    :param pairs: [(program, delta)] in evaluation order.
+    '''
+    if any(len(combo) > 2 for combo in covout._interactions):
+        raise ValueError(f"unsupported impact interaction {covout.imp_interaction!r} for {mult_par}")
+    cached = list(covout._cached_progs.keys())
+    for a in range(len(pairs)):
+        for z in range(a + 1, len(pairs)):
+            mask = np.isin(cached, [pairs[a][0], pairs[z][0]])
+            if not np.isclose(covout.compute_impact_interaction(mask), pairs[a][1], rtol=1e-12, atol=1e-12):
+                raise ValueError(f"impact of {pairs[a][0]}+{pairs[z][0]} on {mult_par} is not the best single effect")
+
+
+def _scaled_deltas(deltas, prog_index, effect_scale):
+    '''
+    Scale the deltas per program and re-sort each source's programs by |delta|, largest first (the
+    order the random interaction uses). effect_scale is (n_programs,) or (batch, n_programs).
+    :return: (deltas, order), both (batch, n_sources, K); order indexes the original columns.
+    '''
+    scale = np.atleast_2d(np.asarray(effect_scale, dtype=float))
+    scale = np.concatenate([scale, np.ones((scale.shape[0], 1))], axis=1)  # padding column keeps delta 0
+    scaled = deltas[None] * scale[:, prog_index]
+    order = np.argsort(-np.abs(scaled), axis=2, kind="stable")
+    return np.take_along_axis(scaled, order, axis=2), order
+
+
+def _bound(v, default):
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return default
+    return default if np.isnan(v) else v
+
+
+def project_to_budget(spend, budget: float) -> np.ndarray:
+    '''
+    Clip spending at zero and rescale each row to sum to budget (like TotalSpendConstraint).
+    '''
+    x = np.maximum(np.asarray(spend, dtype=float), 0.0)
+    s = x.sum(axis=-1, keepdims=True)
+    n = x.shape[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(s > 0, x * budget / s, budget / n)
+
+
+def greedy_allocation(model: EmissionsModel, budget: float, n_steps: int = GREEDY_STEPS) -> Dict[str, Any]:
+    '''
+    Allocate the budget in increments of budget/n_steps, each to the program with the largest
+    emission reduction per dollar given the spending so far. Increments are cut at the spend where
+    a program's coverage saturates; any budget left once every program with a positive marginal
+    reduction is saturated stays unspent.
+    :return: {"allocation": {program: spend}, "x": array, "total": emissions, "unspent": float, "evaluations": int}
+    '''
+    n = model.n_programs
+    caps = model.unit_costs * model.eligible  # spending that covers every eligible facility
+    x = np.zeros(n)
+    remaining = float(budget)
+    step = float(budget) / max(1, n_steps)
+    current = float(model.total(x)[0])
+    evaluations = 1
+    eye = np.eye(n, dtype=bool)
+    while remaining > 1e-9 * max(float(budget), 1.0):
+        inc = np.clip(np.minimum(min(step, remaining), caps - x), 0.0, None)
+        open_ = inc > 0
+        if not open_.any():
+            break
+        # one batch: the current allocation plus each program's increment
+        totals = model.total(x + np.where(eye, inc[:, None], 0.0))
+        evaluations += n
+        gain = np.where(open_, (current - totals) / np.where(open_, inc, 1.0), -np.inf)
+        i = int(np.argmax(gain))
+        if gain[i] <= 0:
+            break
+        x[i] += inc[i]
+        remaining -= inc[i]
+        current = float(totals[i])
+    return {
+        "allocation": model.allocation_dict(x),
+        "x": x,
+        "total": current,
+        "unspent": max(remaining, 0.0),
+        "evaluations": evaluations,
+    }
+
+
+def optimize_allocation(model: EmissionsModel, budget: float, n_starts: int = 2000, n_refine: int = 5, maxiters: int = 5000, maxtime: Optional[float] = None, reltol: float = 1e-7, seed: int = 0, x0=None, trace=None) -> Dict[str, Any]:
+    '''
+    Minimise total emissions for a total budget using the compiled model as the objective.
+    A batch of random allocations (plus x0, if given) is evaluated in one call, and the n_refine
+    best are refined with sciris ASD (the local method used by at.optimize); evaluations are
+    cheap enough to use a much tighter tolerance than at.optimize does.
+    :param maxiters: ASD iterations per refinement.
+    :param maxtime: ASD time limit per refinement (seconds).
+    :param trace: Optional tracing.ConvergenceTrace; records progress and may stop the search early.
+    :return: {"allocation": {program: spend}, "x": array, "total": emissions, "evaluations": int, "exitreason": str}
+    '''
+    import sciris as sc
+    from tracing import StopOptimisation
+
+    n = model.n_programs
+    rng = np.random.default_rng(seed)
+    starts = rng.dirichlet(np.ones(n), size=n_starts) * budget
+    if x0 is not None:
+        starts = np.vstack([project_to_budget(x0, budget), starts])
+    totals = model.total(starts)
+    evaluations = [len(starts)]
+    best_start = int(np.argmin(totals))
+
+    def objective(x):
+        evaluations[0] += 1
+        x = project_to_budget(x, budget)
+        val = float(model.total(x)[0])
+        if trace is not None:
+            trace.record(val, x)
+        return val
+
+    best_x, best_val, exitreason = starts[best_start], float(totals[best_start]), None
+    try:
+        if trace is not None:
+            trace.record(best_val, best_x)
+        for i in np.argsort(totals)[:max(1, n_refine)]:
+            res = sc.asd(objective, starts[i], xmin=np.zeros(n), xmax=np.full(n, float(budget)), maxiters=maxiters, maxtime=maxtime, reltol=reltol, randseed=seed, verbose=0)
+            if res["fval"] < best_val:
+                best_x, best_val, exitreason = res["x"], float(res["fval"]), res.get("exitreason")
+    except StopOptimisation as stop:
+        best_x, exitreason = trace.best_payload, f"stopped early ({stop})"
+    x = project_to_budget(best_x, budget)
+    return {
+        "allocation": model.allocation_dict(x),
+        "x": x,
+        "total": float(model.total(x)[0]),
+        "evaluations": evaluations[0],
+        "exitreason": exitreason,
+    }
+
+
+def dose_response(model: EmissionsModel, levels, mode: str = "coverage") -> Dict[str, Any]:
+    '''
+    Each program alone (all others at zero) across a grid of coverage or spending levels, evaluated
+    in one batch against the status quo.
+    :param levels: Coverage fractions (mode 'coverage') or spending amounts (mode 'spend').
+    :return: {"status_quo": total, "spend", "coverage", "emissions", "abatement"} with (n_programs, n_levels) arrays.
+    '''
+    if mode not in ("coverage", "spend"):
+        raise ValueError("dose-response mode must be 'coverage' or 'spend'")
+    levels = np.asarray(levels, dtype=float)
+    n, n_levels = model.n_programs, len(levels)
+    caps = model.unit_costs * model.eligible
+    spend = levels[None, :] * caps[:, None] if mode == "coverage" else np.tile(levels, (n, 1))
+    batch = np.zeros((n * n_levels + 1, n))  # last row: status quo
+    rows = np.arange(n * n_levels)
+    batch[rows, np.repeat(np.arange(n), n_levels)] = spend.ravel()
+    totals = model.total(batch)
+    coverage = model.coverage(batch[:-1])[rows, np.repeat(np.arange(n), n_levels)].reshape(n, n_levels)
+    emissions = totals[:-1].reshape(n, n_levels)
+    return {
+        "status_quo": float(totals[-1]),
+        "spend": spend,
+        "coverage": coverage,
+        "emissions": emissions,
+        "abatement": totals[-1] - emissions,
+    }
+
+
+def mac_ranking(model: EmissionsModel, curves: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    '''
+    Marginal abatement cost ranking: each program's annual cost at full coverage divided by the
+    emissions it abates alone, cheapest abatement first; programs that abate nothing come last.
+    :param curves: dose_response result with coverage 1 as its last level (computed if omitted).
+    :return: [{"program", "spend", "abatement", "cost_per_tonne", "rank"}]
+    '''
+    curves = curves or dose_response(model, [0.0, 1.0])
+    spend, abatement = curves["spend"][:, -1], curves["abatement"][:, -1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cost = np.where(abatement > 0, spend / abatement, np.inf)
+    order = sorted(range(model.n_programs), key=lambda i: (cost[i], -abatement[i]))
+    return [{"program": model.programs[i], "spend": float(spend[i]), "abatement": float(abatement[i]),
+             "cost_per_tonne": float(cost[i]) if np.isfinite(cost[i]) else None, "rank": rank + 1}
+            for rank, i in enumerate(order)]
+
+
+def cached_model(ctx: Dict[str, Any]) -> Optional[EmissionsModel]:
+    '''
+    Compiled model for a project context (run_main.load_project_context), built on first use and kept
+    in the context so it is rebuilt with the project. None if the framework cannot be compiled.
+    '''
+    if "evaluator" not in ctx:
+        try:
+            ctx["evaluator"] = compile_model(ctx["P"], ctx["progset"], ctx["start_year"], ctx["facility_code"])
+        except ValueError:
+            ctx["evaluator"] = None
+    return ctx["evaluator"]
+
+
+def _source_label(par: str) -> str:
+    return par.replace('_', ' ').title()  # as in the emissions tables of utils.calc_emissions
+
+
+def what_if(ctx: Dict[str, Any], allocation: Optional[Dict[str, float]] = None, coverage: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    '''
+    Emissions at start_year for one allocation (spending per program) or coverage (fraction per
+    program; programs left out get nothing), without writing any tables or graphs. Uses the compiled
+    model, or a single P.run_sim if the framework cannot be compiled.
+    Raises ValueError for unknown programs or values out of range.
+    :return: {"engine", "total", "status_quo_total", "reduction", "emissions": {source label: value},
+              "programs": [{"code", "label", "spend", "coverage", "max_spend"}], "seconds"}
+    '''
+    t0 = time.perf_counter()
+    progset = ctx["progset"]
+    programs = list(progset.programs.keys())
+    values = coverage if coverage is not None else (allocation or {})
+    unknown = sorted(set(values) - set(programs))
+    if unknown:
+        raise ValueError(f"unknown interventions: {unknown}")
+    try:
+        values = {prog: float(v) for prog, v in values.items()}
+    except (TypeError, ValueError):
+        raise ValueError("allocation and coverage values must be numbers")
+    if any(v < 0 for v in values.values()) or (coverage is not None and any(v > 1 for v in values.values())):
+        raise ValueError("spending must be >= 0 and coverage between 0 and 1")
+
+    model = cached_model(ctx)
+    if model is not None:
+        caps = model.unit_costs * model.eligible
+        if coverage is not None:
+            spend = model.allocation_vector(values) * caps
+        else:
+            spend = model.allocation_vector(values)
+        rows = model.emissions(np.vstack([spend, np.zeros(model.n_programs)]))
+        emissions = dict(zip(model.sources, rows[0]))
+        status_quo = float(rows[1].sum())
+        cov = model.coverage(spend)
+        progs = [{"code": prog, "label": progset.programs[prog].label, "spend": float(spend[i]), "coverage": float(cov[i]), "max_spend": float(caps[i])}
+                 for i, prog in enumerate(programs)]
+        engine = "evaluator"
+    else:
+        import atomica as at
+        P, start_year = ctx["P"], ctx["start_year"]
+        if "status_quo_total" not in ctx:
+            res = P.run_sim(parset=P.parsets[0], result_name="Status-quo")
+            ctx["status_quo_total"] = float(res.get_variable(TOTAL_PAR, ctx["facility_code"])[0].vals[list(res.t).index(start_year)])
+        status_quo = ctx["status_quo_total"]
+        full = {prog: values.get(prog, 0.0) for prog in programs}
+        instructions = at.ProgramInstructions(start_year=start_year, **({"coverage": full} if coverage is not None else {"alloc": full}))
+        res = P.run_sim(P.parsets[0], progset=progset, progset_instructions=instructions, result_name="what-if")
+        start_i = list(res.t).index(start_year)
+        pop = ctx["facility_code"]
+        sources = [par for par in res.par_names(pop) if '_mult' not in par and '_emissions' not in par and '_baseline' not in par]
+        emissions = {src: float(res.get_variable(src, pop)[0].vals[start_i]) for src in sources}
+        key = "coverage" if coverage is not None else "spend"
+        progs = [{"code": prog, "label": progset.programs[prog].label, "spend": None, "coverage": None, "max_spend": None, key: full[prog]} for prog in programs]
+        engine = "atomica"
+    total = float(sum(emissions.values()))
+    return {
+        "engine": engine,
+        "total": total,
+        "status_quo_total": status_quo,
+        "reduction": status_quo - total,
+        "emissions": {_source_label(src): float(v) for src, v in emissions.items()},
+        "programs": progs,
+        "seconds": time.perf_counter() - t0,
+    }
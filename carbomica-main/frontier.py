@@ -0,0 +1,178 @@
+"""
+Emissions-vs-cost Pareto frontier on the compiled evaluator.py model.
+
+Instead of optimising a fixed list of budgets, compute_frontier starts from a coarse grid between
+min_budget and max_budget (default: the spending that saturates every effective intervention) and
+repeatedly bisects the intervals around points where the curve bends, i.e. where the optimised
+emissions differ from the straight line through the neighbouring points by more than `tolerance`
+(a fraction of the emission range). Intervals with a drop larger than MAX_STEP of the range are
+also bisected. Each round's budgets are optimised in parallel.
+
+    frontier = compute_frontier(model, {"max_points": 25, "tolerance": 0.01})
+    frontier["points"]      # [{"budget", "emissions", "allocation", "marginal"}], sorted by budget
+"""
+import os
+import time
+from typing import Optional, Dict, Any, List
+
+import numpy as np
+
+import evaluator as ev
+from utils import process_pool, worker_state
+
+DEFAULT_FRONTIER = {
+    'min_budget': 0.0,
+    'max_budget': None,     # default: spending that saturates every intervention with an effect
+    'initial_points': 5,    # evenly spaced budgets of the first round
+    'max_points': 25,       # optimiser calls in total
+    'tolerance': 0.01,      # bend threshold as a fraction of the emission range
+    'method': 'fast',       # 'fast' (evaluator ASD) or 'greedy'
+    'seed': 0,
+    'workers': None,        # processes (default: one per budget of a round, up to the CPU count)
+}
+MAX_STEP = 0.1           # bisect intervals whose emissions drop by more than this fraction of the range
+MIN_INTERVAL = 1 / 1024  # ... but not below this fraction of the budget range
+# a worker costs a numpy/sciris import (~0.5 s); only go parallel for rounds with at least this many budgets
+MIN_PARALLEL_POINTS = 4
+
+
+def frontier_settings(settings=None) -> Dict[str, Any]:
+    '''
+    Merge user settings over DEFAULT_FRONTIER.
+    Raises ValueError for unknown keys or invalid values.
+    '''
+    out = dict(DEFAULT_FRONTIER)
+    for key, val in (settings or {}).items():
+        if key not in out:
+            raise ValueError(f"unknown frontier setting: {key!r}")
+        if val is not None:
+            out[key] = val
+    try:
+        for key in ('initial_points', 'max_points', 'seed'):
+            out[key] = int(out[key])
+        for key in ('min_budget', 'tolerance'):
+            out[key] = float(out[key])
+        out['max_budget'] = None if out['max_budget'] is None else float(out['max_budget'])
+        out['workers'] = None if out['workers'] is None else int(out['workers'])
+    except (TypeError, ValueError):
+        raise ValueError("frontier settings must be numbers")
+    if out['method'] not in ('fast', 'greedy'):
+        raise ValueError("frontier method must be 'fast' or 'greedy'")
+    if out['initial_points'] < 3 or out['max_points'] < out['initial_points']:
+        raise ValueError("frontier needs initial_points >= 3 and max_points >= initial_points")
+    if out['min_budget'] < 0 or out['tolerance'] <= 0:
+        raise ValueError("frontier min_budget must be >= 0 and tolerance > 0")
+    return out
+
+
+def saturation_budget(model: ev.EmissionsModel) -> float:
+    '''
+    Spending that fully covers every program with a non-zero effect; more budget cannot lower emissions.
+    '''
+    effective = np.zeros(model.n_programs + 1, dtype=bool)
+    effective[model.prog_index[model.deltas != 0]] = True
+    return float((model.unit_costs * model.eligible)[effective[:-1]].sum())
+
+
+# ---------- optimiser calls (in-process or in pool workers) ----------
+
+def _optimise_point(budget: float, state=None) -> Dict[str, Any]:
+    state = state or worker_state()
+    model = state["model"]
+    res = ev.greedy_allocation(model, budget)
+    if state["method"] == 'fast' and budget > 0:
+        res = ev.optimize_allocation(model, budget, x0=res["x"], seed=state["seed"])
+    return {"budget": float(budget), "emissions": float(res["total"]), "x": np.asarray(res["x"], dtype=float)}
+
+
+def _bisections(points: List[Dict[str, Any]], scale: float, tol: float, min_width: float) -> List[float]:
+    '''
+    Midpoints of the intervals to refine, most bent first.
+    '''
+    b = np.array([p["budget"] for p in points])
+    e = np.array([p["emissions"] for p in points])
+    score = {}  # interval index -> priority
+    for i in range(1, len(points) - 1):
+        line = e[i - 1] + (e[i + 1] - e[i - 1]) * (b[i] - b[i - 1]) / (b[i + 1] - b[i - 1])
+        err = abs(e[i] - line) / scale
+        if err > tol:
+            for j in (i - 1, i):
+                score[j] = max(score.get(j, 0.0), err)
+    for j in range(len(points) - 1):
+        step = abs(e[j + 1] - e[j]) / scale
+        if step > MAX_STEP:
+            score[j] = max(score.get(j, 0.0), step)
+    keep = [j for j in score if b[j + 1] - b[j] > 2 * min_width]
+    return [float((b[j] + b[j + 1]) / 2) for j in sorted(keep, key=lambda j: -score[j])]
+
+
+def compute_frontier(model: ev.EmissionsModel, settings=None, labels: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''
+    Adaptive emissions-vs-budget frontier.
+    :param model: evaluator.compile_model result for the project.
+    :param settings: Settings overriding DEFAULT_FRONTIER.
+    :param labels: Program labels used as allocation keys (default: code names).
+    :return: {"points": [{"budget", "emissions", "allocation", "marginal"}], "min_budget", "max_budget",
+              "optimiser_calls", "rounds", "uniform_points", "method", "workers", "seconds"}.
+              marginal is the emission reduction per extra dollar since the previous point;
+              uniform_points is the size of a uniform grid with the finest spacing used.
+    '''
+    t0 = time.perf_counter()
+    cfg = frontier_settings(settings)
+    labels = labels or {prog: prog for prog in model.programs}
+    lo = cfg['min_budget']
+    hi = cfg['max_budget'] if cfg['max_budget'] is not None else saturation_budget(model)
+    if hi <= lo:
+        raise ValueError(f"frontier max_budget ({hi:,.0f}) must exceed min_budget ({lo:,.0f})")
+    state = {"model": model, "method": cfg['method'], "seed": cfg['seed']}
+
+    workers = cfg['workers']
+    if workers is None:
+        workers = min(os.cpu_count() or 1, cfg['initial_points']) if cfg['initial_points'] >= MIN_PARALLEL_POINTS else 1
+    pool = process_pool(workers, state=state)
+    if pool is None:
+        workers = 1
+
+    def optimise(budgets):
+        if pool is not None and len(budgets) > 1:
+            return list(pool.map(_optimise_point, budgets))
+        return [_optimise_point(b, state) for b in budgets]
+
+    try:
+        points = optimise(list(np.linspace(lo, hi, cfg['initial_points'])))
+        rounds = 1
+        while len(points) < cfg['max_points']:
+            e = [p["emissions"] for p in points]
+            scale = max(max(e) - min(e), 1e-12)
+            new = _bisections(points, scale, cfg['tolerance'], (hi - lo) * MIN_INTERVAL)[:cfg['max_points'] - len(points)]
+            if not new:
+                break
+            points = sorted(points + optimise(new), key=lambda p: p["budget"])
+            rounds += 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    out_points = []
+    for i, p in enumerate(points):
+        marginal = None
+        if i:
+            marginal = (points[i - 1]["emissions"] - p["emissions"]) / (p["budget"] - points[i - 1]["budget"])
+        out_points.append({
+            "budget": p["budget"],
+            "emissions": p["emissions"],
+            "allocation": {labels[prog]: float(v) for prog, v in zip(model.programs, p["x"])},
+            "marginal": marginal,
+        })
+    widths = np.diff([p["budget"] for p in points])
+    return {
+        "points": out_points,
+        "min_budget": lo,
+        "max_budget": hi,
+        "method": cfg['method'],
+        "optimiser_calls": len(points),
+        "rounds": rounds,
+        "uniform_points": int(round((hi - lo) / widths.min())) + 1,
+        "workers": workers,
+        "seconds": time.perf_counter() - t0,
+    }
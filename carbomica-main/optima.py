@@ -0,0 +1,162 @@
+"""
+Last optimal allocations of a project, for incremental re-optimisation.
+
+Every 'atomica' optimisation stores its optimal allocation per budget in outputs/optima.json,
+together with a cell snapshot of the input workbook and a hash of variables.json. The books are
+generated from that workbook and put_sheet edits are written into it, so the next optimisation
+compares the current inputs with that snapshot:
+
+- a small change (a few cells edited in the value sheets, e.g. one cost or effect size changed
+  with put_sheet) starts ASD from the previous optimum of each budget already optimised and
+  skips PSO for it, unless the run sets PSO options or greedy_start itself;
+- anything else (unchanged inputs, e.g. a forced rerun; a structural sheet or variables.json
+  changed, rows or columns added or removed, more than SMALL_CHANGE_CELLS cells edited)
+  optimises from scratch as before.
+
+Either way the run reports how far the optimum moved from the stored one (see record).
+"""
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+import pandas as pd
+
+SMALL_CHANGE_CELLS = int(os.environ.get("CARBOMICA_SMALL_CHANGE_CELLS", "10"))
+# sheets defining the model's structure (facility, emission sources, intervention list)
+STRUCTURAL_SHEETS = ("facility", "emission sources", "interventions")
+OPTIMA_FILE = "optima.json"  # under the project's outputs/ folder
+
+
+def _cell(val):
+    if val is None or (isinstance(val, float) and val != val):
+        return None
+    if isinstance(val, (int, float, str, bool)):
+        return val
+    return str(val)
+
+
+def sheet_snapshot(input_path, project_dir=None) -> Dict[str, Any]:
+    '''
+    Cell values of every sheet of the input workbook, plus the sha256 of variables.json (without the project name).
+    :return: {"sheets": {sheet: [[cell, ...], ...]}, "variables": hex digest}.
+    '''
+    frames = pd.read_excel(input_path, sheet_name=None, header=None)
+    sheets = {name: [[_cell(v) for v in row] for row in df.itertuples(index=False)] for name, df in frames.items()}
+    variables = Path(project_dir or Path(input_path).parent) / "variables.json"
+    try:
+        # the project name does not change results (clones of a project only differ by it)
+        data = {k: v for k, v in json.loads(variables.read_text(encoding="utf-8")).items() if k != "project_name"}
+        digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+    except (OSError, ValueError, AttributeError):
+        digest = hashlib.sha256(variables.read_bytes() if variables.exists() else b"").hexdigest()
+    return {"sheets": sheets, "variables": digest}
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Which sheets and how many cells differ between two snapshots.
+    :return: {"changed_sheets": [...], "changed_cells": n, "structural": bool, "small": bool, "unchanged": bool, "reason"?: str}.
+             structural: a structural sheet or variables.json changed, or a sheet was added, removed or resized.
+             small: between 1 and SMALL_CHANGE_CELLS cells of value sheets changed.
+    '''
+    changed, cells, reasons = [], 0, []
+    if old.get("variables") != new.get("variables"):
+        reasons.append("variables.json changed")
+    old_sheets, new_sheets = old.get("sheets", {}), new.get("sheets", {})
+    for name in sorted(set(old_sheets) | set(new_sheets)):
+        a, b = old_sheets.get(name), new_sheets.get(name)
+        if a == b:
+            continue
+        changed.append(name)
+        if a is None or b is None:
+            reasons.append(f"sheet {name!r} {'added' if a is None else 'removed'}")
+        elif len(a) != len(b) or any(len(ra) != len(rb) for ra, rb in zip(a, b)):
+            reasons.append(f"sheet {name!r} resized")
+        else:
+            if name.strip().lower() in STRUCTURAL_SHEETS:
+                reasons.append(f"sheet {name!r} changed")
+            cells += sum(x != y for ra, rb in zip(a, b) for x, y in zip(ra, rb))
+    structural = bool(reasons)
+    if not structural and cells > SMALL_CHANGE_CELLS:
+        reasons.append(f"{cells} cells changed (more than {SMALL_CHANGE_CELLS})")
+    unchanged = not reasons and cells == 0
+    if unchanged:
+        reasons.append("inputs unchanged")
+    out = {"changed_sheets": changed, "changed_cells": cells, "structural": structural, "small": not reasons, "unchanged": unchanged}
+    if reasons:
+        out["reason"] = "; ".join(reasons)
+    return out
+
+
+def _path(project_dir) -> Path:
+    return Path(project_dir) / "outputs" / OPTIMA_FILE
+
+
+def _budget_key(budget) -> str:
+    return repr(float(budget))
+
+
+def load(project_dir) -> Optional[Dict[str, Any]]:
+    '''
+    Stored optima {"snapshot", "budgets": {budget: {"allocation", "total"}}}, or None.
+    '''
+    try:
+        return json.loads(_path(project_dir).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def plan(project_dir, input_path, budgets: List[float], warm: bool = True) -> Dict[str, Any]:
+    '''
+    Compare the inputs with the stored optima and pick ASD starting points.
+    :param warm: False when the run asks for its own PSO settings or a greedy start; no starting points are picked.
+    :return: {"snapshot", "change" (see compare, None without stored optima),
+              "warm_start": {budget: {program: spend}} (empty unless the change is small), "previous"}.
+    '''
+    snapshot = sheet_snapshot(input_path, project_dir)
+    stored = load(project_dir)
+    if not stored:
+        return {"snapshot": snapshot, "change": None, "warm_start": {}, "previous": {}}
+    change = compare(stored.get("snapshot") or {}, snapshot)
+    previous = stored.get("budgets", {})
+    warm_start = {}
+    if warm and change["small"]:
+        warm_start = {budget: previous[_budget_key(budget)]["allocation"] for budget in budgets if _budget_key(budget) in previous}
+    return {"snapshot": snapshot, "change": change, "warm_start": warm_start, "previous": previous}
+
+
+def record(project_dir, plan: Dict[str, Any], optima: Dict[float, Dict[str, Any]]) -> Dict[str, Any]:
+    '''
+    Store the new optima ({budget: {"allocation" {program: spend}, "total"}}) with the input snapshot
+    and report how far each moved from the stored one.
+    :return: {budget: {"previous_total", "total", "total_change", "relative_change", "allocation_shift",
+              "shift_fraction"}} for budgets optimised before. allocation_shift is the spending moved between
+              interventions (half the L1 distance); shift_fraction is that as a fraction of the budget.
+    '''
+    moved = {}
+    for budget, new in optima.items():
+        old = plan["previous"].get(_budget_key(budget))
+        if not old:
+            continue
+        progs = set(old["allocation"]) | set(new["allocation"])
+        shift = sum(abs(new["allocation"].get(p, 0.0) - old["allocation"].get(p, 0.0)) for p in progs) / 2
+        moved[_budget_key(budget)] = {
+            "previous_total": old["total"],
+            "total": new["total"],
+            "total_change": new["total"] - old["total"],
+            "relative_change": (new["total"] - old["total"]) / old["total"] if old["total"] else None,
+            "allocation_shift": shift,
+            "shift_fraction": shift / budget if budget else 0.0,
+        }
+    # budgets of earlier runs stay available while the inputs only change a little
+    change = plan["change"]
+    budgets = dict(plan["previous"]) if change and (change["small"] or change.get("unchanged")) else {}
+    budgets.update({_budget_key(b): {"allocation": v["allocation"], "total": v["total"]} for b, v in optima.items()})
+    path = _path(project_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps({"snapshot": plan["snapshot"], "budgets": budgets}, default=float), encoding="utf-8")
+    tmp.replace(path)
+    return moved
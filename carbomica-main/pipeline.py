@@ -0,0 +1,239 @@
+"""
+Engine runs as an explicit graph of memoised stages.
+
+    books -> project -> scenario -> charts
+
+Each stage declares its own inputs (file content hashes, settings, the hash of the code it runs)
+and its upstream stages. Its key is a hash of those inputs and the upstream keys, so a change
+invalidates exactly the stages downstream of it. Outputs are kept in a store:
+
+- 'disk': JSON files under the project's outputs/pipeline/ folder (books stamps, scenario
+  summaries with their chart specs, rendered graphs), checked with the stage's `valid` function
+  (e.g. the files it wrote are still there and unchanged);
+- 'memory': the caller's cache dict (long-lived workers keep built Atomica projects warm; a stage
+  with an `adopt` function also reuses the output another project built from identical inputs,
+  e.g. a clone);
+- None: never cached.
+
+Stages are evaluated lazily from the requested one: a cached stage's upstream stages are not
+needed and are skipped. A chart title change re-renders only the charts, a variables.json budget
+change skips book generation, and an unchanged request reuses the scenario summary.
+
+    pipe = Pipeline([Stage("a", {"x": 1}, run_a, store="disk"), Stage("b", {}, run_b, deps=["a"])], disk_dir=...)
+    pipe.output("b")
+    pipe.plan()     # [{"stage", "status": "executed"|"cached"|"skipped"|"failed", "key", "seconds"?, "reason"?, "error"?}]
+"""
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable, Iterable
+
+from runs import content_hash
+
+PIPELINE_DIR = "pipeline"  # under the project's outputs/ folder
+MAX_ENTRIES = int(os.environ.get("CARBOMICA_PIPELINE_ENTRIES", "32"))  # disk entries kept per stage
+
+BASE_DIR = Path(__file__).resolve().parent
+# modules that do not take part in computing scenario results (the API, job plumbing, chart rendering)
+NON_ENGINE_MODULES = ("app.py", "benchmark.py", "broker.py", "charts.py", "engine_api.py", "program_checks.py",
+                      "runs.py", "scheduler.py", "storage.py", "variables.py", "worker.py")
+
+
+def code_hash(patterns: Iterable[str], exclude: Iterable[str] = ()) -> str:
+    '''
+    Content hash of the engine files matching glob patterns relative to the repository folder.
+    '''
+    exclude = set(exclude)
+    files = sorted({f for pattern in patterns for f in BASE_DIR.glob(pattern) if f.name not in exclude})
+    return content_hash(files)
+
+
+def file_stats(paths: Iterable[Path]) -> Dict[str, List[int]]:
+    '''
+    {path: [mtime_ns, size]} of existing files, to check a stage's files were not changed since.
+    '''
+    out = {}
+    for p in paths:
+        try:
+            st = Path(p).stat()
+        except OSError:
+            continue
+        out[str(p)] = [st.st_mtime_ns, st.st_size]
+    return out
+
+
+def stats_unchanged(stats: Dict[str, List[int]]) -> bool:
+    return file_stats(stats) == stats
+
+
+def _json_default(val):
+    if hasattr(val, "tolist"):  # numpy scalars and arrays
+        return val.tolist()
+    return str(val)
+
+
+class Stage:
+    """
+    One step of a pipeline: run(*upstream outputs) -> output.
+    :param inputs: JSON-serialisable description of everything besides upstream stages the output depends on.
+    :param store: 'disk' (JSON-serialisable outputs), 'memory' or None.
+    :param valid: Optional check of a cached output (False: the stage runs again).
+    :param adopt: For 'memory' stages, maps a matching output cached under another scope to this one.
+    """
+
+    def __init__(self, name: str, inputs: Dict[str, Any], run: Callable, deps: Iterable[str] = (),
+                 store: Optional[str] = None, valid: Optional[Callable[[Any], bool]] = None,
+                 adopt: Optional[Callable[[Any], Any]] = None):
+        if store not in ("disk", "memory", None):
+            raise ValueError(f"unknown pipeline store: {store!r}")
+        self.name = name
+        self.inputs = inputs
+        self.run = run
+        self.deps = list(deps)
+        self.store = store
+        self.valid = valid
+        self.adopt = adopt
+
+
+class Pipeline:
+    """
+    Stages evaluated on demand, with outputs memoised under their input keys.
+    :param memory: Dict for 'memory' stages (entries keyed by scope and stage name, latest key only).
+    :param disk_dir: Folder for 'disk' stages.
+    :param scope: Distinguishes memory entries of different projects sharing one dict.
+    :param force: Run every needed stage, ignoring cached outputs (new outputs are still stored).
+    """
+
+    def __init__(self, stages: List[Stage], memory: Optional[Dict[Any, Any]] = None, disk_dir=None,
+                 scope: str = "", force: bool = False):
+        self.stages = {s.name: s for s in stages}
+        for s in stages:
+            for dep in s.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"stage {s.name!r} depends on unknown stage {dep!r}")
+        self.memory = memory
+        self.disk_dir = Path(disk_dir) if disk_dir is not None else None
+        self.scope = scope
+        self.force = force
+        self.keys: Dict[str, str] = {}
+        self._outputs: Dict[str, Any] = {}
+        self._plan: Dict[str, Dict[str, Any]] = {}
+        self._requested: List[str] = []
+
+    def key(self, name: str) -> str:
+        '''
+        sha256 of the stage's name, inputs and upstream keys.
+        '''
+        if name not in self.keys:
+            stage = self.stages[name]
+            body = json.dumps({"stage": name, "inputs": stage.inputs, "deps": [self.key(d) for d in stage.deps]},
+                              sort_keys=True, default=str)
+            self.keys[name] = hashlib.sha256(body.encode("utf-8")).hexdigest()
+        return self.keys[name]
+
+    def _disk_path(self, name: str) -> Path:
+        return self.disk_dir / f"{name}-{self.key(name)[:24]}.json"
+
+    def _lookup(self, name: str):
+        '''
+        (True, output) for a valid cached output, else (False, reason).
+        '''
+        stage, key = self.stages[name], self.key(name)
+        if self.force:
+            return False, "forced"
+        if stage.store == "memory" and self.memory is not None:
+            hit = self.memory.get((self.scope, name))
+            if (hit is None or hit[0] != key) and stage.adopt is not None:
+                other = next((v for (scope, n), v in list(self.memory.items()) if n == name and v[0] == key), None)
+                if other is not None:
+                    hit = (key, stage.adopt(other[1]))
+                    self.memory[(self.scope, name)] = hit
+            if hit is None:
+                return False, "not cached"
+            if hit[0] != key:
+                return False, "inputs changed"
+            output = hit[1]
+        elif stage.store == "disk" and self.disk_dir is not None:
+            try:
+                data = json.loads(self._disk_path(name).read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                return False, "not cached"
+            if data.get("key") != key:
+                return False, "not cached"
+            output = data["output"]
+        else:
+            return False, "not cached"
+        if stage.valid is not None and not stage.valid(output):
+            return False, "outputs changed"
+        return True, output
+
+    def _save(self, name: str, output):
+        stage = self.stages[name]
+        if stage.store == "memory" and self.memory is not None:
+            self.memory[(self.scope, name)] = (self.key(name), output)
+        elif stage.store == "disk" and self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            path = self._disk_path(name)
+            tmp = path.with_suffix(".json.tmp")
+            tmp.write_text(json.dumps({"key": self.key(name), "output": output}, default=_json_default), encoding="utf-8")
+            tmp.replace(path)
+            # keep the newest entries of the stage
+            old = sorted(self.disk_dir.glob(f"{name}-*.json"), key=lambda p: p.stat().st_mtime, reverse=True)[MAX_ENTRIES:]
+            for p in old:
+                p.unlink(missing_ok=True)
+
+    def cached(self, name: str) -> bool:
+        '''
+        Whether output(name) would be served from a store without running any stage.
+        '''
+        return name in self._outputs or self._lookup(name)[0]
+
+    def output(self, name: str):
+        '''
+        Output of a stage: memoised in this pipeline, else from its store, else computed from
+        its upstream outputs (recursively) and stored.
+        '''
+        if name not in self._requested:
+            self._requested.append(name)
+        if name in self._outputs:
+            return self._outputs[name]
+        stage = self.stages[name]
+        hit, found = self._lookup(name)
+        if hit:
+            self._plan[name] = {"stage": name, "status": "cached", "key": self.key(name)[:12]}
+            self._outputs[name] = found
+            return found
+        upstream = [self.output(dep) for dep in stage.deps]
+        t0 = time.perf_counter()
+        try:
+            out = stage.run(*upstream)
+        except Exception as exc:
+            self._plan[name] = {"stage": name, "status": "failed", "key": self.key(name)[:12],
+                                "seconds": time.perf_counter() - t0, "reason": found, "error": str(exc)}
+            raise
+        self._plan[name] = {"stage": name, "status": "executed", "key": self.key(name)[:12],
+                            "seconds": time.perf_counter() - t0, "reason": found}
+        self._save(name, out)
+        self._outputs[name] = out
+        return out
+
+    def plan(self) -> List[Dict[str, Any]]:
+        '''
+        Status of every stage the requested stages depend on, upstream first: executed (with the
+        reason and seconds), cached, failed (raised, with the error; its downstream stages are
+        skipped) or skipped (not needed because a later stage was cached).
+        '''
+        order: List[str] = []
+
+        def visit(name):
+            if name in order:
+                return
+            for dep in self.stages[name].deps:
+                visit(dep)
+            order.append(name)
+
+        for name in self._requested:
+            visit(name)
+        return [self._plan.get(name, {"stage": name, "status": "skipped", "key": self.key(name)[:12]}) for name in order]
@@ -1,38 +1,41 @@
-import atomica as at
-from project import P, progset, start_year
-import os
-if not os.path.exists('results'): os.makedirs('results')
-if not os.path.exists('figs'): os.makedirs('figs')
 '''
 Script to check output of programs under certain coverage and budget conditions.
-E.g.: It can be useful to set intervention effects to 0 (perfect effect), the same unit_cost for all interventions, and check that spending (0.5 x unit_cost) or (1 x unit_cost) produces the correct outputs (a program effect of 0.5 or 0, respectively).
+Runs the checks in validation.py (zero coverage, full coverage, each program fully covered, each
+program with a fixed investment) and compares emissions with the values expected from the input
+data sheet. Raw Atomica exports are only written with --export.
 
+E.g.: python program_checks.py --project projects/<id> --export results
 '''
+import os
+import sys
+import json
+import argparse
+
+from validation import validate_project, DEFAULT_INVESTMENT
 
-# Run a budget scenario and verify that outputs make sense
-investment = 1e5  # set investment
 
-# Scale up each prog to see impact
-for prog in progset.programs.keys():
-    instructions_spending = at.ProgramInstructions(start_year=start_year, alloc={prog: investment})
-    budget_res = P.run_sim(P.parsets[0],progset=P.progsets[0], progset_instructions=instructions_spending, result_name=prog)
-    budget_res.export_raw('results/budget_raw_{}'.format(prog))
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check program outputs against the input data sheet")
+    parser.add_argument("--project", default=os.environ.get("PROJECT_DIR", "."), help="Project folder (default: PROJECT_DIR or the current folder)")
+    parser.add_argument("--investment", type=float, default=DEFAULT_INVESTMENT, help="Spending for the per-program budget checks")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: automatic)")
+    parser.add_argument("--export", default=None, help="Folder for raw exports of every check")
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    args = parser.parse_args(argv)
 
-# Run a zero- and full-coverage scenario and verify that outputs make sense
-# Zero-coverage of programs
-no_coverage = {prog: 0 for prog in progset.programs.keys()}
-instructions_cov = at.ProgramInstructions(start_year=start_year, coverage=no_coverage)
-no_coverage_res = P.run_sim(P.parsets[0], progset=P.progsets[0], progset_instructions=instructions_cov, result_name='no_coverage')
-no_coverage_res.export_raw('results/no_coverage_raw')
+    report = validate_project(args.project, workers=args.workers, investment=args.investment, export_dir=args.export)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for chk in report["checks"]:
+            label = chk["check"] + (f" [{chk['program']}]" if chk["program"] else "")
+            print(f"{'PASS' if chk['passed'] else 'FAIL'}  {label}  (max abs error {chk['max_abs_error']:.3g})")
+            for m in chk["mismatches"]:
+                print(f"      {m['source']}: expected {m['expected']:.6g}, got {m['actual']:.6g}")
+        s = report["summary"]
+        print(f"{report['status'].upper()}: {s['passed']}/{s['total']} checks passed in {report['seconds']:.2f}s")
+    return 0 if report["status"] == "pass" else 1
 
-# Full coverage of all programs
-coverage = {prog: 1 for prog in progset.programs.keys()} 
-instructions_cov = at.ProgramInstructions(start_year=start_year, coverage=coverage)
-coverage_res = P.run_sim(P.parsets[0], progset=P.progsets[0], progset_instructions=instructions_cov, result_name="Full")
-coverage_res.export_raw('results/full_coverage_raw')
 
-# Scale up each prog individually to see impact
-for prog in progset.programs.keys():
-    instructions_cov = at.ProgramInstructions(start_year=start_year, coverage={prog: 1})
-    coverage_prog_res = P.run_sim(P.parsets[0], progset=P.progsets[0], progset_instructions=instructions_cov, result_name=prog)
-    coverage_prog_res.export_raw('results/full_coverage_raw_{}'.format(prog))
+if __name__ == "__main__":
+    sys.exit(main())
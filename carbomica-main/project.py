@@ -1,5 +1,9 @@
 """
 Define atomica project based on input data spreadsheet.
+
+Use load_project(project_dir) to build a project for a given project folder. For older scripts
+`from project import P, progset, start_year` still works: the module attributes are built
+lazily on first access from PROJECT_DIR / PROJECT_ID.
 """
 
 import os
@@ -9,73 +13,136 @@ from pathlib import Path
 import atomica as at
 import pandas as pd
 from books import generate_books
+from tracing import span
 
 # determine project folder (env var PROJECT_DIR preferred, then PROJECT_ID inside projects/)
 BASE_DIR = Path(__file__).resolve().parent
 PROJECTS_DIR = BASE_DIR / "projects"
 
-proj_dir = None
-if os.environ.get("PROJECT_DIR"):
-    proj_dir = Path(os.environ["PROJECT_DIR"])
-elif os.environ.get("PROJECT_ID"):
-    proj_dir = PROJECTS_DIR / os.environ["PROJECT_ID"]
-else:
-    proj_dir = None  # will fall back to repo root/lookups
-
-# load persisted variables if available
-vars_data = {}
-if proj_dir:
-    vars_file = proj_dir / "variables.json"
-    if vars_file.exists():
-        try:
-            vars_data = json.loads(vars_file.read_text(encoding="utf-8"))
-        except Exception:
-            vars_data = {}
-
-# Time frame of simulation (use persisted start_year if present)
-default_start = 2024
-start_year = int(vars_data.get("start_year", default_start))
-end_year = int(vars_data.get("end_year", start_year + 5))
-
-# Input data sheet file name (prefer project input_filename, else defaults)
-input_filename = vars_data.get("input_filename") or "input_data_example.xlsx"
-if proj_dir:
-    possible_path = proj_dir / input_filename
-    if possible_path.exists():
-        input_data_sheet = str(possible_path)
-    else:
+
+def _env_project_dir():
+    if os.environ.get("PROJECT_DIR"):
+        return Path(os.environ["PROJECT_DIR"])
+    if os.environ.get("PROJECT_ID"):
+        return PROJECTS_DIR / os.environ["PROJECT_ID"]
+    return None  # will fall back to repo root/lookups
+
+
+def _load_vars(proj_dir):
+    # load persisted variables if available
+    if proj_dir:
+        vars_file = Path(proj_dir) / "variables.json"
+        if vars_file.exists():
+            try:
+                return json.loads(vars_file.read_text(encoding="utf-8"))
+            except Exception:
+                return {}
+    return {}
+
+
+def resolve_input_sheet(proj_dir=None, vars_data=None):
+    """
+    Return the input workbook path for a project folder (project input_filename, else repo defaults).
+    """
+    vars_data = vars_data if vars_data is not None else _load_vars(proj_dir)
+    input_filename = vars_data.get("input_filename") or "input_data_example.xlsx"
+    if proj_dir:
+        possible_path = Path(proj_dir) / input_filename
+        if possible_path.exists():
+            return str(possible_path)
         # fallback to repo root file if present
         repo_candidate = BASE_DIR / input_filename
-        input_data_sheet = str(repo_candidate) if repo_candidate.exists() else input_filename
-else:
+        return str(repo_candidate) if repo_candidate.exists() else input_filename
     # no project dir supplied; use repo local file name
-    input_data_sheet = input_filename
-
-# Attempt to read facility_code from the input spreadsheet (best-effort)
-facility_code = None
-try:
-    df_fac = pd.read_excel(input_data_sheet, sheet_name="facility", index_col="Code Name")
-    facility_code = df_fac.index[0] if len(df_fac.index) > 0 else None
-except Exception:
-    facility_code = vars_data.get("facility_code") or None
-
-# generate framework, databook and progbook (books.py handles output paths)
-generate_books(input_data_sheet, start_year, end_year)
-
-# Atomica project definition
-if not facility_code:
-    raise RuntimeError(f"Could not determine facility_code from {input_data_sheet}")
-
-P = at.Project(
-    framework=f'books/carbomica_framework_{facility_code}.xlsx',
-    databook=f'books/carbomica_databook_{facility_code}.xlsx',
-    do_run=False,
-)
-
-# Projection settings
-P.settings.sim_dt = 1
-P.settings.sim_start = start_year
-P.settings.sim_end = end_year
-
-# Load program/progbook
-progset = P.load_progbook(f'books/carbomica_progbook_{facility_code}.xlsx')
+    return input_filename
+
+
+def project_settings(project_dir=None):
+    '''
+    Settings of a project folder that the generated books depend on.
+    :return: dict with start_year, end_year, input_data_sheet and facility_code (variables.json fallback, may be None).
+    '''
+    proj_dir = Path(project_dir) if project_dir else None
+    vars_data = _load_vars(proj_dir)
+    # Time frame of simulation (use persisted start_year if present)
+    default_start = 2024
+    start_year = int(vars_data.get("start_year", default_start))
+    return {
+        "start_year": start_year,
+        "end_year": int(vars_data.get("end_year", start_year + 5)),
+        "input_data_sheet": resolve_input_sheet(proj_dir, vars_data),
+        "facility_code": vars_data.get("facility_code") or None,
+    }
+
+
+def load_project(project_dir=None, books_dir=None, regenerate=True):
+    '''
+    Generate the books for a project folder and build its Atomica project.
+    :param project_dir: Project folder holding variables.json and the input workbook (None: repo defaults).
+    :param books_dir: Where generated books are written (default: project_dir/books, else ./books).
+    :param regenerate: Set False to build from books already in books_dir.
+    :return: dict with P, progset, start_year, end_year, facility_code, input_data_sheet and books_dir.
+    '''
+    proj_dir = Path(project_dir) if project_dir else None
+    settings = project_settings(proj_dir)
+    start_year, end_year = settings["start_year"], settings["end_year"]
+    input_data_sheet = settings["input_data_sheet"]
+
+    # Attempt to read facility_code from the input spreadsheet (best-effort)
+    facility_code = None
+    try:
+        df_fac = pd.read_excel(input_data_sheet, sheet_name="facility", index_col="Code Name")
+        facility_code = df_fac.index[0] if len(df_fac.index) > 0 else None
+    except Exception:
+        facility_code = settings["facility_code"]
+
+    if books_dir is None:
+        books_dir = (proj_dir / "books") if proj_dir else Path("books")
+    books_dir = Path(books_dir)
+
+    # generate framework, databook and progbook (books.py handles output paths)
+    if regenerate:
+        with span("books"):
+            generate_books(input_data_sheet, start_year, end_year, output_dir=str(books_dir))
+
+    # Atomica project definition
+    if not facility_code:
+        raise RuntimeError(f"Could not determine facility_code from {input_data_sheet}")
+
+    with span("project_load"):
+        P = at.Project(
+            framework=str(books_dir / f'carbomica_framework_{facility_code}.xlsx'),
+            databook=str(books_dir / f'carbomica_databook_{facility_code}.xlsx'),
+            do_run=False,
+        )
+
+        # Projection settings
+        P.settings.sim_dt = 1
+        P.settings.sim_start = start_year
+        P.settings.sim_end = end_year
+
+        # Load program/progbook
+        progset = P.load_progbook(str(books_dir / f'carbomica_progbook_{facility_code}.xlsx'))
+
+    return {
+        "P": P,
+        "progset": progset,
+        "start_year": start_year,
+        "end_year": end_year,
+        "facility_code": facility_code,
+        "input_data_sheet": input_data_sheet,
+        "books_dir": str(books_dir),
+    }
+
+
+_module_project = None
+
+
+def __getattr__(name):
+    # lazily build the module-level project (legacy `from project import P, progset, ...`)
+    global _module_project
+    if name in ("P", "progset", "start_year", "end_year", "facility_code", "input_data_sheet"):
+        if _module_project is None:
+            _module_project = load_project(_env_project_dir(), books_dir="books")
+        return _module_project[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,220 @@
+"""
+Compact NumPy blocks of simulation results, shared between processes without pickling.
+
+An Atomica Result carries the whole model and pickles into megabytes, while the result writers in
+utils.py only need a few arrays. A ResultBlock holds just those:
+
+    values[parameter, time, result]   the facility's emission parameters (as in the emissions tables)
+    alloc[program, result]            spending at the reporting year (NaN for results without programs)
+    coverage[program, result]         coverage fraction at the reporting year
+
+plus the names of the results, parameters, programs and years. The arrays live in one buffer:
+private memory, a shared memory segment ('shm') or a memory-mapped file ('file'). The parent
+allocates a shared block for every result it needs, workers attach to it from its small
+descriptor and fill their results in place, and the parent reads DataFrames straight off the arrays.
+
+    block = ResultBlock.allocate(block_meta(status_quo, progset, facility_code, start_year, names), "shm")
+    ResultBlock.attach(block.descriptor()).fill(i, result)     # in a worker
+    block.emissions_frame()                                     # results x parameter labels, a view
+    block.close()                                               # the allocating process also unlinks
+"""
+import os
+import tempfile
+import uuid
+from pathlib import Path
+from multiprocessing import shared_memory
+from typing import Optional, Dict, Any, List
+
+import numpy as np
+import pandas as pd
+
+# 'shm' (shared memory segments) or 'file' (memory-mapped files under BLOCK_DIR, e.g. on hosts with a small /dev/shm)
+TRANSPORT = os.environ.get("CARBOMICA_BLOCK_TRANSPORT", "shm")
+BLOCK_DIR = Path(os.environ.get("CARBOMICA_BLOCK_DIR") or Path(tempfile.gettempdir()) / "carbomica-blocks")
+
+_DTYPE = np.dtype(np.float64)
+
+
+def emission_parameters(result) -> List[str]:
+    '''
+    The emission source parameters of a result, as reported in the emissions tables.
+    '''
+    pars = result.par_names(result.pop_names[0])
+    return [par for par in pars if '_mult' not in par and '_emissions' not in par and '_baseline' not in par]
+
+
+def block_meta(result, progset, facility_code, year, names: List[str]) -> Dict[str, Any]:
+    '''
+    Layout of a block for results shaped like `result` (same parameters and years).
+    :param progset: Program set whose programs are reported (None: no allocations).
+    :param names: Result names, one per result slot.
+    '''
+    pars = emission_parameters(result)
+    programs = list(progset.programs) if progset is not None else []
+    return {
+        "results": [str(n) for n in names],
+        "t": [float(x) for x in result.t],
+        "pars": pars,
+        "par_labels": [par.replace('_', ' ').title() for par in pars],
+        "programs": programs,
+        "program_labels": [progset.programs[prog].label for prog in programs],
+        "facility": facility_code,
+        "year": float(year),
+    }
+
+
+def _shapes(meta):
+    n_res, n_progs = len(meta["results"]), len(meta["programs"])
+    return {"values": (len(meta["pars"]), len(meta["t"]), n_res), "alloc": (n_progs, n_res), "coverage": (n_progs, n_res)}
+
+
+def _nbytes(meta) -> int:
+    return sum(int(np.prod(shape)) for shape in _shapes(meta).values()) * _DTYPE.itemsize
+
+
+class ResultBlock:
+    """
+    Arrays of several results over one buffer; see the module docstring.
+    """
+
+    def __init__(self, meta: Dict[str, Any], buffer=None, transport: Optional[str] = None, handle=None, owner: bool = False):
+        self.meta = meta
+        self.transport = transport
+        self._handle = handle
+        self._owner = owner
+        if buffer is None:
+            buffer = np.full(_nbytes(meta) // _DTYPE.itemsize, np.nan, dtype=_DTYPE)
+        offset = 0
+        for name, shape in _shapes(meta).items():
+            size = int(np.prod(shape))
+            setattr(self, name, np.ndarray(shape, dtype=_DTYPE, buffer=buffer, offset=offset * _DTYPE.itemsize))
+            offset += size
+
+    @classmethod
+    def allocate(cls, meta: Dict[str, Any], transport: Optional[str] = None) -> "ResultBlock":
+        '''
+        New block of NaNs: private memory (transport None), 'shm' or 'file'.
+        '''
+        size = max(_nbytes(meta), 1)
+        if transport is None:
+            return cls(meta)
+        if transport == "shm":
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            block = cls(meta, shm.buf, "shm", shm, owner=True)
+        elif transport == "file":
+            BLOCK_DIR.mkdir(parents=True, exist_ok=True)
+            path = BLOCK_DIR / f"{uuid.uuid4().hex}.block"
+            mm = np.memmap(path, dtype=np.uint8, mode="w+", shape=(size,))
+            block = cls(meta, mm, "file", (mm, path), owner=True)
+        else:
+            raise ValueError(f"unknown result block transport: {transport!r}")
+        for name in _shapes(meta):
+            getattr(block, name)[...] = np.nan
+        return block
+
+    def descriptor(self) -> Dict[str, Any]:
+        '''
+        Small picklable description other processes attach with (shared blocks only).
+        '''
+        if self.transport == "shm":
+            return {"transport": "shm", "name": self._handle.name, "meta": self.meta}
+        if self.transport == "file":
+            return {"transport": "file", "path": str(self._handle[1]), "meta": self.meta}
+        raise ValueError("a private result block has no descriptor")
+
+    @classmethod
+    def attach(cls, descriptor: Dict[str, Any]) -> "ResultBlock":
+        '''
+        Map a shared block allocated by the parent process (no copy).
+        '''
+        meta = descriptor["meta"]
+        if descriptor["transport"] == "shm":
+            # attaching processes are workers started by the allocating one and share its resource
+            # tracker, which unlinks the segment only if the allocating process dies without closing it
+            shm = shared_memory.SharedMemory(name=descriptor["name"])
+            return cls(meta, shm.buf, "shm", shm)
+        mm = np.memmap(descriptor["path"], dtype=np.uint8, mode="r+", shape=(max(_nbytes(meta), 1),))
+        return cls(meta, mm, "file", (mm, Path(descriptor["path"])))
+
+    @classmethod
+    def from_results(cls, results, facility_code, year=None, progset=None) -> "ResultBlock":
+        '''
+        Private block of a list of Atomica results (programs from `progset`, else the first result that has them).
+        '''
+        if progset is None:
+            progset = next((res.model.progset for res in results if res.model.progset is not None), None)
+        year = results[0].t[0] if year is None else year
+        block = cls.allocate(block_meta(results[0], progset, facility_code, year, [res.name for res in results]))
+        for i, res in enumerate(results):
+            block.fill(i, res)
+        return block
+
+    def fill(self, i: int, result):
+        '''
+        Copy the arrays of one Atomica result into result slot i.
+        '''
+        meta = self.meta
+        for j, par in enumerate(meta["pars"]):
+            self.values[j, :, i] = result.get_variable(par, meta["facility"])[0].vals
+        if meta["programs"] and result.model.progset is not None:
+            alloc = result.get_alloc(meta["year"])
+            cov = result.get_coverage('fraction', meta["year"])
+            self.alloc[:, i] = [float(np.squeeze(alloc[prog])) for prog in meta["programs"]]
+            self.coverage[:, i] = [float(np.squeeze(cov[prog])) for prog in meta["programs"]]
+
+    def view(self, results: slice) -> "ResultBlock":
+        '''
+        Block over a slice of the result slots, sharing this block's memory.
+        '''
+        sub = ResultBlock.__new__(ResultBlock)
+        sub.meta = {**self.meta, "results": self.meta["results"][results]}
+        sub.transport, sub._handle, sub._owner = None, None, False
+        sub.values, sub.alloc, sub.coverage = self.values[:, :, results], self.alloc[:, results], self.coverage[:, results]
+        sub._parent = self  # keep the buffer alive
+        return sub
+
+    def year_index(self, year=None) -> int:
+        return self.meta["t"].index(float(self.meta["year"] if year is None else year))
+
+    def emissions_frame(self, year=None) -> pd.DataFrame:
+        '''
+        Emissions by source at `year` (default: the reporting year), results x parameter labels, without copying.
+        '''
+        return pd.DataFrame(self.values[:, self.year_index(year), :].T, index=self.meta["results"], columns=self.meta["par_labels"], copy=False)
+
+    def alloc_frame(self) -> pd.DataFrame:
+        '''
+        Spending, program labels x results, without copying.
+        '''
+        return pd.DataFrame(self.alloc, index=self.meta["program_labels"], columns=self.meta["results"], copy=False)
+
+    def coverage_frame(self) -> pd.DataFrame:
+        '''
+        Coverage fractions, program labels x results, without copying.
+        '''
+        return pd.DataFrame(self.coverage, index=self.meta["program_labels"], columns=self.meta["results"], copy=False)
+
+    def close(self):
+        '''
+        Release the mapping; the allocating process also removes the segment or file.
+        Frames built from the block must not be used afterwards.
+        '''
+        handle, self._handle = self._handle, None
+        if handle is None:
+            return
+        self.values = self.alloc = self.coverage = None
+        if self.transport == "shm":
+            try:
+                handle.close()
+            except BufferError:
+                pass  # frames still reference the memory; it is unmapped when they are collected
+            if self._owner:
+                handle.unlink()
+        elif self.transport == "file" and self._owner:
+            handle[1].unlink(missing_ok=True)  # the mapping itself goes with the last array using it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
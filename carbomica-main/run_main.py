@@ -6,14 +6,357 @@ Provide run_project(...) as the programmatic entrypoint that accepts
 input_path, out_dir, scenario and options (options may include 'spending' and/or 'budgets').
 """
 import os
+import json
+import time
+import uuid
 import traceback
+from datetime import datetime
 from pathlib import Path
 from typing import Optional, List, Any, Dict
 
+from tracing import trace_run, span
+
 # engine scenario functions are imported inside run_project to avoid triggering work at import
 # (they may rely on PROJECT_DIR / working dir setup)
 
-def run_project(input_path: str, out_dir: str, scenario: Optional[str] = None, options: Optional[Dict[str, Any]] = None):
+
+# scenario options that change neither the simulations nor the tables (chart_titles only affects the charts stage)
+_PRESENTATION_OPTIONS = ("profile", "force", "chart_titles")
+
+
+def _books_valid(output: Dict[str, Any]) -> bool:
+    # books are generated from the input workbook (edits go there, see engine_api.put_sheet): a book
+    # changed or removed since is regenerated
+    from pipeline import stats_unchanged  # type: ignore
+    return bool(output["files"]) and stats_unchanged(output["files"])
+
+
+def project_pipeline(project_dir: str, cache: Optional[Dict[str, Any]] = None, scenario: Optional[str] = None,
+                     opts: Optional[Dict[str, Any]] = None):
+    """
+    The engine's stage graph for a project folder (see pipeline.py):
+    books (generate_books; stamped in outputs/pipeline) -> project (Atomica project; kept in `cache`)
+    -> scenario (simulations, optimisation and tables; summary and chart specs in outputs/pipeline)
+    -> charts (graphs rendered from the chart specs).
+    The scenario and charts stages are only defined when a scenario is given.
+    """
+    from pipeline import Pipeline, Stage, code_hash, file_stats, stats_unchanged, NON_ENGINE_MODULES, PIPELINE_DIR  # type: ignore
+    from project import project_settings  # type: ignore
+    from runs import content_hash  # type: ignore
+
+    proj = Path(project_dir).resolve()
+    settings = project_settings(proj)
+    books_dir = proj / "books"
+
+    def make_books():
+        from books import generate_books  # type: ignore
+        from storage import unshare  # type: ignore
+        for f in books_dir.glob("*.xlsx"):
+            unshare(f, keep=False)  # books shared with a parent project are rewritten, not edited
+        with span("books"):
+            generate_books(settings["input_data_sheet"], settings["start_year"], settings["end_year"], output_dir=str(books_dir))
+        return {"books_dir": str(books_dir), "files": file_stats(sorted(books_dir.glob("*.xlsx")))}
+
+    def book_stats():
+        return {Path(p).name: v for p, v in file_stats(sorted(books_dir.glob("*.xlsx"))).items()}
+
+    def make_project(books):
+        from project import load_project  # type: ignore
+        ctx = load_project(proj, books_dir=books["books_dir"], regenerate=False)
+        # the framework, databook and progbook it was built from; books regenerated since (e.g. by
+        # another process) rebuild the project
+        ctx["book_stats"] = {Path(p).name: v for p, v in books["files"].items()}
+        return ctx
+
+    stages = [
+        Stage("books", {"workbook": content_hash([Path(settings["input_data_sheet"])]),
+                        "start_year": settings["start_year"], "end_year": settings["end_year"],
+                        "facility_code": settings["facility_code"], "code": code_hash(["books.py", "templates/*.xlsx"])},
+              make_books, store="disk", valid=_books_valid),
+        # a project built for another folder from identical books (a clone) is reused with this folder's paths
+        Stage("project", {"code": code_hash(["project.py"])}, make_project, deps=["books"], store="memory",
+              valid=lambda ctx: ctx.get("book_stats") == book_stats(),
+              adopt=lambda ctx: {**ctx, "books_dir": str(books_dir), "input_data_sheet": settings["input_data_sheet"]}),
+    ]
+    opts = opts or {}
+    if scenario is not None:
+        import utils  # type: ignore
+
+        def make_scenario(ctx):
+            from checkpoints import Checkpoint, current as current_checkpoint  # type: ignore
+            # per-budget optimisation checkpoints; a rerun of the same inputs resumes from them
+            ckpt = Checkpoint.for_run(str(proj), settings["input_data_sheet"], scenario, opts)
+            ckpt_token = current_checkpoint.set(ckpt)
+            specs = []
+            charts_token = utils.deferred_charts.set(specs)
+            try:
+                fields, summary = _run_scenario(ctx, scenario, opts)
+            finally:
+                utils.deferred_charts.reset(charts_token)
+                current_checkpoint.reset(ckpt_token)
+            ckpt.remove()
+            if ckpt.resumed:
+                fields["resumed"] = True
+            tables = [proj / a["path"] for a in summary.get("artifacts", []) if a.get("kind") == "table"]
+            return {"fields": fields, "summary": summary, "charts": specs, "tables": file_stats(tables)}
+
+        def make_charts(scen):
+            titles = opts.get("chart_titles") or {}
+            return {"graphs": file_stats([utils.render_chart(spec, titles) for spec in scen["charts"]])}
+
+        stages += [
+            Stage("scenario", {"scenario": scenario, "options": {k: v for k, v in opts.items() if k not in _PRESENTATION_OPTIONS},
+                               "code": code_hash(["*.py"], exclude=NON_ENGINE_MODULES)},
+                  make_scenario, deps=["project"], store="disk", valid=lambda out: stats_unchanged(out["tables"])),
+            Stage("charts", {"titles": opts.get("chart_titles") or {}, "code": code_hash(["charts.py"])},
+                  make_charts, deps=["scenario"], store="disk", valid=lambda out: stats_unchanged(out["graphs"])),
+        ]
+    return Pipeline(stages, memory=cache, disk_dir=proj / "outputs" / PIPELINE_DIR, scope=str(proj), force=bool(opts.get("force")))
+
+
+def load_project_context(project_dir: str, cache: Optional[Dict[str, Any]] = None):
+    """
+    Build (or reuse) the Atomica project for a project folder through the books and project stages
+    of project_pipeline, from the input workbook project.project_settings resolves in the folder.
+    Books are only regenerated when that workbook, the time frame or the book templates change;
+    long-lived workers pass their own `cache` dict so repeated runs also skip project construction
+    while the framework, databook and progbook files are unchanged. Expects PROJECT_DIR and the
+    working directory set as for a run.
+    """
+    return project_pipeline(project_dir, cache).output("project")
+
+
+def project_context(project_dir: str, cache: Optional[Dict[str, Any]] = None):
+    """
+    load_project_context for callers outside a run (validation, the API's what-if evaluation).
+    A cache hit returns straight away; otherwise PROJECT_DIR and the working directory books.py
+    expects are set while the project is built and restored afterwards.
+    """
+    proj = Path(project_dir).resolve()
+    pipe = project_pipeline(str(proj), cache)
+    if pipe.cached("project"):
+        return pipe.output("project")
+    prev_cwd = os.getcwd()
+    prev_project_dir = os.environ.get("PROJECT_DIR")
+    os.environ["PROJECT_DIR"] = str(proj)
+    try:
+        os.chdir(str(Path(__file__).parent.resolve()))  # books.py reads templates/ relative to the working directory
+        return pipe.output("project")
+    finally:
+        os.chdir(prev_cwd)
+        if prev_project_dir is None:
+            os.environ.pop("PROJECT_DIR", None)
+        else:
+            os.environ["PROJECT_DIR"] = prev_project_dir
+
+
+def _parse_budgets(budgets_raw) -> List[float]:
+    default = [20000.0, 50000.0, 100000.0]
+    if isinstance(budgets_raw, (list, tuple)):
+        try:
+            return [float(b) for b in budgets_raw]
+        except Exception:
+            return default
+    if isinstance(budgets_raw, str):
+        try:
+            return [float(x.strip()) for x in budgets_raw.split(",") if x.strip()]
+        except Exception:
+            return default
+    return default
+
+
+def _run_scenario(ctx: Dict[str, Any], scen: str, opts: Dict[str, Any]):
+    """
+    Dispatch to the scenario functions. Returns (manifest fields, scenario summary).
+    """
+    from scenarios import coverage_scenario, budget_scenario, optimization, uncertainty_scenario, frontier_scenario, dose_response_scenario  # type: ignore
+
+    P, progset, start_year, facility_code = ctx["P"], ctx["progset"], ctx["start_year"], ctx["facility_code"]
+
+    # several scenarios on one project build (see run_batch)
+    if scen == "batch":
+        entries = batch_entries(opts.get("batch"))
+        summary = run_batch(ctx, entries, workers=opts.get("workers"))
+        return {"scenario": "batch", "scenarios": [e["name"] for e in entries]}, summary
+
+    # coverage / baseline
+    if scen in ("baseline", "coverage", "full"):
+        return {"scenario": "coverage"}, coverage_scenario(P, progset, start_year, facility_code)
+
+    # Monte Carlo uncertainty over effect sizes and costs (budgets optional)
+    if scen in ("uncertainty", "montecarlo", "monte_carlo"):
+        budgets = _parse_budgets(opts.get("budgets")) if opts.get("budgets") is not None else []
+        summary = uncertainty_scenario(P, progset, start_year, ctx["end_year"], facility_code, ctx["input_data_sheet"],
+                                       budgets, settings=opts.get("uncertainty"))
+        return {"scenario": "uncertainty", "budgets": budgets}, summary
+
+    # emissions-vs-budget frontier (adaptively chosen budgets)
+    if scen in ("frontier", "pareto"):
+        return {"scenario": "frontier"}, frontier_scenario(P, progset, start_year, facility_code, settings=opts.get("frontier"))
+
+    # dose-response curves and marginal abatement cost ranking
+    if scen in ("dose_response", "dose-response", "mac"):
+        dr = opts.get("dose_response") or {}
+        mode = dr.get("mode") or "coverage"
+        summary = dose_response_scenario(P, progset, start_year, facility_code, mode=mode,
+                                         levels=dr.get("levels") or 11, max_spend=dr.get("max_spend"))
+        return {"scenario": "dose_response", "mode": mode}, summary
+
+    # budget scenario (single spending)
+    if scen in ("budget",) or ("spending" in opts and opts.get("spending") is not None):
+        try:
+            spending = float(opts.get("spending")) if ("spending" in opts and opts.get("spending") is not None) else float(1e4)
+        except Exception:
+            spending = 1e4
+        summary = budget_scenario(P, progset, start_year, facility_code, spending)
+        return {"scenario": "budget", "spending": spending}, summary
+
+    # optimization scenario (multiple budgets)
+    if scen in ("optimization", "opt", "optimize") or ("budgets" in opts and opts.get("budgets") is not None):
+        budgets = _parse_budgets(opts.get("budgets"))
+        method = opts.get("method") or "atomica"
+        # warm start from the project's last optima after a small input edit (see optima.py)
+        plan = None
+        if method == "atomica" and opts.get("incremental", True) is not False:
+            import optima  # type: ignore
+            # explicit PSO settings or a greedy start ask for that optimisation rather than a warm start
+            optimiser = opts.get("optimiser") if isinstance(opts.get("optimiser"), dict) else {}
+            warm = not opts.get("greedy_start") and not any(k.startswith("pso_") or k == "seed" for k in optimiser)
+            plan = optima.plan(Path(ctx["books_dir"]).parent, ctx["input_data_sheet"], budgets, warm=warm)
+        summary = optimization(P, progset, start_year, facility_code, budgets, method=method,
+                               greedy_start=bool(opts.get("greedy_start")),
+                               report_gap=None if opts.get("report_gap") is None else bool(opts.get("report_gap")),
+                               settings=opts.get("optimiser"), warm_start=plan["warm_start"] if plan else None)
+        if plan is not None:
+            summary["incremental"] = _record_optima(ctx, plan, budgets, summary)
+        return {"scenario": "optimization", "budgets": budgets, "method": method}, summary
+
+    # Unknown scenario: attempt to run coverage as safe fallback
+    return {"scenario": "fallback_coverage"}, coverage_scenario(P, progset, start_year, facility_code)
+
+
+def _record_optima(ctx: Dict[str, Any], plan: Dict[str, Any], budgets: List[float], summary: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Store an optimisation's allocations as the project's last optima and describe the incremental run:
+    {change, warm_started: [budget], moved: {budget: {...}}} (see optima.plan / optima.record).
+    """
+    import optima  # type: ignore
+
+    codes = {prog.label: code for code, prog in ctx["progset"].programs.items()}
+    found = {}
+    for budget in budgets:
+        name = "${:0,.0f}".format(budget)
+        alloc = summary.get("allocations", {}).get(name)
+        info = summary.get("optimisation", {}).get(name)
+        if alloc is not None and info is not None:
+            found[budget] = {"allocation": {codes.get(label, label): float(v) for label, v in alloc.items()}, "total": info["total"]}
+    moved = optima.record(Path(ctx["books_dir"]).parent, plan, found)
+    return {"change": plan["change"], "warm_started": sorted(plan["warm_start"]), "moved": moved}
+
+
+# scenario kinds worth a worker process of their own in a batch
+BATCH_PARALLEL_KINDS = ("optimization", "opt", "optimize", "frontier", "pareto", "uncertainty", "montecarlo", "monte_carlo")
+
+
+def batch_entries(definitions) -> List[Dict[str, Any]]:
+    """
+    Normalise scenario definitions (as stored in variables.json 'scenarios') into batch entries
+    {name, scenario, options}. A string is a scenario name; a dict may set 'scenario' (or 'type')
+    explicitly, otherwise 'spending' means a budget scenario, 'budgets' an optimization and anything
+    else runs the scenario its name refers to. Raises ValueError for unnamed or duplicate entries.
+    """
+    entries = []
+    for d in definitions or []:
+        if isinstance(d, str):
+            d = {"name": d}
+        if not isinstance(d, dict) or not (d.get("name") or d.get("scenario")):
+            raise ValueError("every batch scenario needs a name")
+        name = str(d.get("name") or d.get("scenario"))
+        opts = dict(d.get("options") or {})
+        for key in ("spending", "budgets", "method"):
+            if d.get(key) is not None:
+                opts[key] = d[key]
+        kind = d.get("scenario") or d.get("type")
+        if not kind:
+            kind = "budget" if opts.get("spending") is not None else "optimization" if opts.get("budgets") is not None else name
+        kind = str(kind).strip().lower()
+        if kind == "batch":
+            raise ValueError("batch scenarios cannot be nested")
+        entries.append({"name": name, "scenario": kind, "options": opts})
+    names = [e["name"] for e in entries]
+    if len(set(names)) != len(names):
+        raise ValueError("batch scenario names must be unique")
+    return entries
+
+
+def _run_entry(ctx: Dict[str, Any], entry: Dict[str, Any]) -> Dict[str, Any]:
+    import utils  # type: ignore
+    import checkpoints  # type: ignore
+    t0 = time.perf_counter()
+    token = utils.output_tag.set(entry.get("tag"))
+    parent = checkpoints.current.get()
+    ckpt = parent.child(entry["name"]) if parent is not None else None
+    ckpt_token = checkpoints.current.set(ckpt)
+    try:
+        fields, summary = _run_scenario(ctx, entry["scenario"], entry["options"])
+        if ckpt is not None:
+            ckpt.remove()
+        return {"name": entry["name"], "status": "ok", **fields, "artifacts": summary.pop("artifacts", []),
+                "results": summary, "seconds": time.perf_counter() - t0}
+    except Exception as exc:
+        return {"name": entry["name"], "status": "error", "scenario": entry["scenario"], "error": str(exc),
+                "trace": traceback.format_exc(), "seconds": time.perf_counter() - t0}
+    finally:
+        checkpoints.current.reset(ckpt_token)
+        utils.output_tag.reset(token)
+
+
+def _run_entry_in_worker(entry: Dict[str, Any]) -> Dict[str, Any]:
+    from utils import worker_state  # type: ignore
+    return _run_entry(worker_state(), entry)
+
+
+def run_batch(ctx: Dict[str, Any], entries: List[Dict[str, Any]], workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Run several scenarios on one built project. Serially they share the project, its status-quo
+    simulation and compiled emissions model; with workers > 1 (default: one per optimisation-type
+    entry, up to the CPU count) they are spread over processes that each build the project once
+    from the generated books. A failing entry does not stop the others.
+    Entries of the same kind get their name appended to their output file names.
+    Returns a summary: {artifacts, batch: {entries: {name: manifest fields, results, seconds}, failed, workers}}.
+    """
+    from utils import process_pool  # type: ignore
+
+    kinds = [e["scenario"] for e in entries]
+    for e in entries:
+        e["tag"] = "".join(c if c.isalnum() or c in "-_" else "_" for c in e["name"]) if kinds.count(e["scenario"]) > 1 else None
+    if workers is None:
+        # a worker process costs a project build, which only pays off for optimisations
+        heavy = sum(1 for kind in kinds if kind in BATCH_PARALLEL_KINDS)
+        workers = min(os.cpu_count() or 1, heavy) if heavy > 1 else 1
+    workers = max(1, int(workers)) if len(entries) > 1 else 1
+    pool = process_pool(workers, project_dir=Path(ctx["books_dir"]).parent)
+    if pool is not None:
+        with span("batch", workers=workers), pool:
+            done = list(pool.map(_run_entry_in_worker, entries))
+    else:
+        workers = 1
+        done = []
+        for e in entries:
+            with span("batch", scenario=e["name"]):
+                done.append(_run_entry(ctx, e))
+    artifacts = [a for res in done for a in res.pop("artifacts", [])]
+    return {
+        "artifacts": artifacts,
+        "batch": {
+            "entries": {res["name"]: res for res in done},
+            "failed": sum(1 for res in done if res["status"] != "ok"),
+            "workers": workers,
+        },
+    }
+
+
+def run_project(input_path: str, out_dir: str, scenario: Optional[str] = None, options: Optional[Dict[str, Any]] = None, cache: Optional[Dict[str, Any]] = None, run_id: Optional[str] = None):
     """
     Programmatic entrypoint for the engine.
 
@@ -22,14 +365,70 @@ def run_project(input_path: str, out_dir: str, scenario: Optional[str] = None, o
     - out_dir: path to output directory (string). Caller usually sets this to projects/{id}/outputs
     - scenario: optional scenario name ('baseline'/'coverage'/'budget'/'optimization' or custom)
     - options: optional dict with keys like 'spending' (number) or 'budgets' (list)
+    - cache: optional dict used to keep built projects warm between calls (see load_project_context)
+    - run_id: optional id for this run (a new uuid is generated when omitted)
+    - options['profile']: optional 'cprofile' or 'pyinstrument' to save a profile of the run
+    - options['method']: optional optimization method, 'atomica' (default, PSO + ASD), 'fast' (evaluator.py)
+      or 'greedy' (greedy marginal allocation); options['greedy_start'] starts the 'atomica' ASD from the
+      greedy allocation instead of PSO; options['report_gap'] = False skips the reference run for 'greedy',
+      and True adds the greedy gap to an 'atomica' run
+    - options['optimiser']: optional optimiser settings {pso_maxiter, pso_swarmsize, pso_starts, pso_workers, seed, asd_maxiters, maxtime, reltol, stall_evals}
+      (see scenarios.DEFAULT_OPTIMISER); convergence traces are returned in results.optimisation
+    - scenario 'batch': run options['batch'] (scenario definitions, see batch_entries) on one project build,
+      over options['workers'] processes; per-scenario manifests in results.batch.entries
+    - options['validate']: optional bool; run the program checks first and fail the run if any check fails
+    - options['incremental']: 'atomica' optimisations keep the last optimum per budget in outputs/optima.json; after a
+      small input edit (see optima.py) ASD starts from it and PSO is skipped, unless options['optimiser'] sets pso_* or
+      seed or options['greedy_start'] is set. False disables this; the input change,
+      warm-started budgets and how far each optimum moved are returned in results.incremental
+    - runs go through project_pipeline (books -> project -> scenario -> charts); a stage whose inputs did not change
+      is reused (books stamped and scenario summaries stored in outputs/pipeline), and the manifest's pipeline lists
+      each stage as executed, cached or skipped. options['force'] reruns every stage; options['chart_titles']
+      ({chart type: title}) only re-renders the charts
+    - optimisations checkpoint each budget under outputs/checkpoints (see checkpoints.py); a run with the same
+      inputs, scenario and options resumes from the checkpoint and its manifest has resumed: true
+    - scenario 'uncertainty': Monte Carlo over effect sizes and costs with options['uncertainty'] settings
+      (see uncertainty.DEFAULT_UNCERTAINTY) and optional options['budgets']; percentiles in results.uncertainty
+    - scenario 'frontier': emissions-vs-budget frontier with options['frontier'] settings (see frontier.DEFAULT_FRONTIER);
+      points {budget, emissions, allocation, marginal} in results.frontier
+    - scenario 'dose_response': each intervention alone across options['dose_response'] = {mode: 'coverage'|'spend',
+      levels: count or list, max_spend?}; curves and the marginal abatement cost ranking in results.dose_response
 
     Behaviour:
     - If scenario indicates coverage/baseline -> call coverage_scenario(...)
     - If options.spending present or scenario == 'budget' -> call budget_scenario(..., spending)
     - If options.budgets present or scenario == 'optimization' -> call optimization(..., budgets)
-    - Returns a dict with status info (engine_api._call_engine_direct will accept this)
+    - Returns the run manifest:
+      { status: 'ok', run_id, scenario, spending?/budgets?, started_at, finished_at,
+        artifacts: [{kind: 'table'|'graph', type, path (relative to the project folder)}],
+        results: {emissions: {result: {source: value}}, totals: {result: value}, allocations?: {result: {intervention: value}},
+                  optimisation?: {result: {method, total, greedy_total?, reference_total?, greedy_gap?, ...}}},
+        pipeline: [{stage, status: 'executed'|'cached'|'skipped', key, seconds?, reason?}],
+        timings: {books, project_load, sims, optimisation, plotting, io, total} (seconds),
+        memory: {peak_rss_mb, rss_start_mb, rss_end_mb, method, children_peak_rss_mb?} (see tracing.MemoryMeter),
+        spans: [{name, start, duration, parent?, attrs?}] }
+      or { status: 'error', run_id, error, trace } on failure.
     """
+    run_id = run_id or str(uuid.uuid4())
+    opts = options or {}
+    with trace_run(opts.get("profile")) as trace:
+        res = _run_project_traced(input_path, out_dir, scenario, opts, cache, run_id)
+    res["timings"] = {**trace.stage_timings(), "total": time.perf_counter() - trace.t0}
+    if trace.memory:
+        res["memory"] = trace.memory
+    res["spans"] = trace.to_list()
+    if trace.profile_text and res.get("status") == "ok":
+        prof_path = Path(out_dir) / f"profile_{run_id}.txt"
+        prof_path.write_text(trace.profile_text, encoding="utf-8")
+        from utils import _relpath  # type: ignore
+        res.setdefault("artifacts", []).append({"kind": "profile", "type": opts.get("profile"), "path": _relpath(prof_path, Path(out_dir).parent)})
+    return res
+
+
+def _run_project_traced(input_path: str, out_dir: str, scenario: Optional[str], opts: Dict[str, Any], cache: Optional[Dict[str, Any]], run_id: str):
+    started_at = datetime.utcnow().isoformat() + "Z"
     prev_cwd = os.getcwd()
+    prev_project_dir = os.environ.get("PROJECT_DIR")
     try:
         # ensure output directory exists
         out_p = Path(out_dir)
@@ -47,71 +446,58 @@ def run_project(input_path: str, out_dir: str, scenario: Optional[str] = None, o
             # if this fails, fall back to previous cwd but proceed
             pass
 
-        # Import project and scenarios now that PROJECT_DIR is set and cwd points to repo root
-        try:
-            from project import P, progset, start_year, facility_code  # type: ignore
-        except Exception as e:
-            return {"status": "error", "error": f"failed to import project module: {e}", "trace": traceback.format_exc()}
-
-        try:
-            from scenarios import coverage_scenario, budget_scenario, optimization  # type: ignore
-        except Exception as e:
-            return {"status": "error", "error": f"failed to import scenarios module: {e}", "trace": traceback.format_exc()}
-
         # Normalize options
-        opts = options or {}
         scen = (scenario or "baseline").strip().lower()
 
-        # coverage / baseline
-        if scen in ("baseline", "coverage", "full"):
-            coverage_scenario(P, progset, start_year, facility_code)
-            return {"status": "ok", "scenario": "coverage"}
+        # books -> project -> scenario -> charts, each stage reused while its inputs are unchanged
+        pipe = project_pipeline(project_dir, cache, scen, opts)
 
-        # budget scenario (single spending)
-        if scen in ("budget",) or ("spending" in opts and opts.get("spending") is not None):
+        # Optionally gate the run on the program checks (validation.py)
+        validation = None
+        if opts.get("validate"):
             try:
-                spending = float(opts.get("spending")) if ("spending" in opts and opts.get("spending") is not None) else float(1e4)
-            except Exception:
-                spending = 1e4
-            budget_scenario(P, progset, start_year, facility_code, spending)
-            return {"status": "ok", "scenario": "budget", "spending": spending}
-
-        # optimization scenario (multiple budgets)
-        if scen in ("optimization", "opt", "optimize") or ("budgets" in opts and opts.get("budgets") is not None):
-            budgets_raw = opts.get("budgets")
-            if isinstance(budgets_raw, (list, tuple)):
-                try:
-                    budgets = [float(b) for b in budgets_raw]
-                except Exception:
-                    budgets = [20000.0, 50000.0, 100000.0]
-            elif isinstance(budgets_raw, str):
-                try:
-                    budgets = [float(x.strip()) for x in budgets_raw.split(",") if x.strip()]
-                except Exception:
-                    budgets = [20000.0, 50000.0, 100000.0]
-            else:
-                budgets = [20000.0, 50000.0, 100000.0]
-
-            optimization(P, progset, start_year, facility_code, budgets)
-            return {"status": "ok", "scenario": "optimization", "budgets": budgets}
-
-        # Unknown scenario: attempt to run coverage as safe fallback
-        coverage_scenario(P, progset, start_year, facility_code)
-        return {"status": "ok", "scenario": "fallback_coverage"}
+                ctx = pipe.output("project")
+            except Exception as e:
+                return {"status": "error", "run_id": run_id, "error": f"failed to load project: {e}", "trace": traceback.format_exc(), "pipeline": pipe.plan()}
+            from validation import validate_context  # type: ignore
+            with span("validation"):
+                report = validate_context(ctx)
+            validation = {k: report[k] for k in ("status", "summary", "seconds")}
+            if report["status"] != "pass":
+                s = report["summary"]
+                return {"status": "error", "run_id": run_id, "error": f"validation failed: {s['failed']} of {s['total']} program checks", "validation": report, "pipeline": pipe.plan()}
+
+        try:
+            pipe.output("charts")
+        except Exception as exc:
+            return {"status": "error", "run_id": run_id, "error": str(exc), "trace": traceback.format_exc(), "pipeline": pipe.plan()}
+        scenario_out = pipe.output("scenario")
+        summary = dict(scenario_out["summary"])
+        manifest = {"status": "ok", "run_id": run_id, **scenario_out["fields"], "started_at": started_at, "finished_at": datetime.utcnow().isoformat() + "Z"}
+        if validation:
+            manifest["validation"] = validation
+        manifest["artifacts"] = summary.pop("artifacts", [])
+        manifest["results"] = summary
+        manifest["pipeline"] = pipe.plan()
+        return manifest
     except Exception as exc:
-        return {"status": "error", "error": str(exc), "trace": traceback.format_exc()}
+        return {"status": "error", "run_id": run_id, "error": str(exc), "trace": traceback.format_exc()}
     finally:
-        # restore previous cwd
+        # restore previous cwd and PROJECT_DIR (in-process callers, e.g. the API fallback)
         try:
             os.chdir(prev_cwd)
         except Exception:
             pass
+        if prev_project_dir is None:
+            os.environ.pop("PROJECT_DIR", None)
+        else:
+            os.environ["PROJECT_DIR"] = prev_project_dir
 
 
 def main():
     """
     CLI wrapper for running from subprocess.
-    Accepts --input, --out, --scenario, --spending, --budgets.
+    Accepts --input, --out, --scenario, --spending, --budgets, --method.
     """
     import argparse
     parser = argparse.ArgumentParser(description="Run project scenarios")
@@ -120,6 +506,8 @@ def main():
     parser.add_argument("--scenario", "-s", default="baseline", help="Scenario name")
     parser.add_argument("--spending", type=float, help="Single spending value for budget scenario")
     parser.add_argument("--budgets", type=str, help="Comma-separated budgets for optimization (e.g. 20000,50000,100000)")
+    parser.add_argument("--method", default=None, help="Optimization method: atomica (default), fast or greedy")
+    parser.add_argument("--run-id", default=None, help="Run id recorded in the run manifest")
     args = parser.parse_args()
 
     options = {}
@@ -130,10 +518,13 @@ def main():
             options["budgets"] = [float(x.strip()) for x in args.budgets.split(",") if x.strip()]
         except Exception:
             options["budgets"] = args.budgets
+    if args.method:
+        options["method"] = args.method
 
-    res = run_project(args.input, args.out, args.scenario, options)
+    res = run_project(args.input, args.out, args.scenario, options, run_id=args.run_id)
     if isinstance(res, dict) and res.get("status") == "ok":
-        print("OK:", res)
+        # last line is the JSON manifest so callers can parse it from stdout
+        print("OK:", json.dumps(res))
         return 0
     else:
         print("ERROR:", res)
@@ -0,0 +1,128 @@
+from pathlib import Path
+from typing import Optional, List, Dict, Iterable
+import hashlib
+import json
+import re
+import uuid
+from datetime import datetime, timezone
+from storage import project_path
+
+RUNS_DIRNAME = "runs"
+_RUN_ID_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+def runs_dir(project_id: str) -> Path:
+    p = project_path(project_id) / RUNS_DIRNAME
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+def new_run_id() -> str:
+    return str(uuid.uuid4())
+
+def now_iso() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+def _run_file(project_id: str, run_id: str) -> Optional[Path]:
+    # run ids end up in file names, so only accept simple tokens
+    if not run_id or not _RUN_ID_RE.match(run_id):
+        return None
+    return runs_dir(project_id) / f"{run_id}.json"
+
+def load_run(project_id: str, run_id: str) -> Optional[dict]:
+    f = _run_file(project_id, run_id)
+    if f is None or not f.exists():
+        return None
+    try:
+        return json.loads(f.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+def save_run(project_id: str, record: dict) -> None:
+    f = _run_file(project_id, record.get("run_id"))
+    if f is None:
+        raise ValueError(f"invalid run id: {record.get('run_id')!r}")
+    # write-then-rename so readers never see a half-written record
+    tmp = f.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(record, indent=2, default=str), encoding="utf-8")
+    tmp.replace(f)
+
+def update_run(project_id: str, run_id: str, **fields) -> dict:
+    rec = load_run(project_id, run_id) or {"run_id": run_id, "project_id": project_id}
+    rec.update(fields)
+    save_run(project_id, rec)
+    return rec
+
+def list_runs(project_id: str) -> List[dict]:
+    """
+    Summaries of all runs for a project, newest first.
+    """
+    out = []
+    for f in runs_dir(project_id).glob("*.json"):
+        try:
+            rec = json.loads(f.read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        out.append({k: rec.get(k) for k in ("run_id", "scenario", "status", "queued_at", "started_at", "finished_at")})
+    out.sort(key=lambda r: r.get("queued_at") or "", reverse=True)
+    return out
+
+# (path, mtime_ns, size) -> sha256 of the file, so unchanged workbooks are not re-read
+_file_hashes: Dict[tuple, str] = {}
+
+def content_hash(paths: Iterable[Path]) -> str:
+    """
+    sha256 over the contents of the given files (a missing file counts as empty).
+    """
+    h = hashlib.sha256()
+    for p in paths:
+        p = Path(p)
+        try:
+            st = p.stat()
+        except OSError:
+            h.update(f"{p.name}:missing;".encode())
+            continue
+        key = (str(p.resolve()), st.st_mtime_ns, st.st_size)
+        digest = _file_hashes.get(key)
+        if digest is None:
+            digest = hashlib.sha256(p.read_bytes()).hexdigest()
+            _file_hashes[key] = digest
+        h.update(f"{p.name}:{digest};".encode())
+    return h.hexdigest()
+
+def run_key(content: str, scenario: Optional[str], options: Optional[dict]) -> str:
+    """
+    Identity of a run request: project content hash, scenario and options (key order ignored).
+    """
+    body = json.dumps({"content": content, "scenario": scenario, "options": options or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+def find_run(project_id: str, key: str, statuses=("finished",)) -> Optional[dict]:
+    """
+    Newest run record with the given run_key and one of the given statuses.
+    """
+    best = None
+    for f in runs_dir(project_id).glob("*.json"):
+        try:
+            rec = json.loads(f.read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        if rec.get("run_key") == key and rec.get("status") in statuses:
+            if best is None or (rec.get("queued_at") or "") > (best.get("queued_at") or ""):
+                best = rec
+    return best
+
+def artifacts_intact(project_id: str, record: dict) -> bool:
+    """
+    True if every artifact of a finished run still exists and was not rewritten after the run finished.
+    """
+    try:
+        finished = datetime.fromisoformat(record["finished_at"].rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+    except (KeyError, AttributeError, ValueError):
+        return False
+    proj = project_path(project_id)
+    for art in record.get("artifacts") or []:
+        try:
+            if (proj / art["path"]).stat().st_mtime > finished:
+                return False
+        except (KeyError, TypeError, OSError):
+            return False
+    return True
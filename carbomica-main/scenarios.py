@@ -1,7 +1,16 @@
 import atomica as at
+import numpy as np
 import utils as ut
+import evaluator as ev
+import uncertainty as unc
+import frontier as fr
+import checkpoints
+import resultblocks as rb
+from tracing import span, ConvergenceTrace, StopOptimisation
 from pathlib import Path
+import time
 import os
+import weakref
 
 # Remove any top-level creation of repo-root 'results' or 'figs' at import time.
 # Ensure creation only happens when running scenarios with a project context.
@@ -15,6 +24,97 @@ def ensure_results_for_project(project_dir: str):
     (proj / "graphs").mkdir(parents=True, exist_ok=True)
 
 
+def _summary(*outputs):
+    '''
+    Merge the dicts returned by the utils writers into one scenario summary
+    (artifacts list plus emissions/totals/allocations keyed by result name).
+    '''
+    summary = {"artifacts": []}
+    for out in outputs:
+        for key, val in out.items():
+            if key == "artifacts":
+                summary["artifacts"].extend(val)
+            else:
+                summary.setdefault(key, {}).update(val)
+    return summary
+
+
+# per-project caches, shared by every scenario run on the same project build (a batch run, a warm worker)
+_status_quo_results = weakref.WeakKeyDictionary()
+_models = weakref.WeakKeyDictionary()
+
+def status_quo(P):
+    '''
+    Status-quo result of a project, simulated once per project build.
+    '''
+    res = _status_quo_results.get(P)
+    if res is None:
+        with span('sims', result='Status-quo'):
+            res = _status_quo_results[P] = P.run_sim(parset='default',result_name='Status-quo')
+    return res
+
+def compiled_model(P, progset, start_year, facility_code):
+    '''
+    evaluator.py model of a project, compiled once per project build from the shared status-quo result.
+    '''
+    models = _models.setdefault(P, {})
+    key = (start_year, facility_code)
+    if key not in models:
+        models[key] = ev.compile_model(P, progset, start_year, facility_code, status_quo=status_quo(P))
+    return models[key]
+
+# a simulation worker costs an atomica import plus a project load (seconds) while a simulation of a
+# small project takes milliseconds, so only go parallel with at least this many simulations per worker
+MIN_SIMS_PER_WORKER = 25
+
+def _simulate_into(args):
+    '''
+    Run simulations in a worker and write them into the parent's shared result block; only the
+    block descriptor and slot numbers cross the process boundary, never Atomica results.
+    '''
+    descriptor, runs = args
+    ctx = ut.worker_state()
+    P, start_year = ctx["P"], ctx["start_year"]
+    with rb.ResultBlock.attach(descriptor) as block:
+        for i, name, instr in runs:
+            instructions = at.ProgramInstructions(start_year=start_year, **instr)
+            block.fill(i, P.run_sim(parset='default', progset=P.progsets[0], progset_instructions=instructions, result_name=name))
+    return len(runs)
+
+def simulate_block(P, progset, start_year, facility_code, runs, workers=None):
+    '''
+    Status quo plus one simulation per run, as a ResultBlock.
+    :param runs: [(result name, {"coverage": {program: fraction}} or {"alloc": {program: spend}})].
+    :param workers: Processes (None: one per MIN_SIMS_PER_WORKER simulations, up to the CPU count). Workers
+                    build the project from the generated books and fill a shared block in place.
+    :return: ResultBlock reported at start_year, status quo in slot 0; close it once written out.
+    '''
+    sq = status_quo(P)
+    meta = rb.block_meta(sq, progset, facility_code, start_year, [sq.name] + [name for name, _ in runs])
+    project_dir = os.environ.get("PROJECT_DIR")
+    if workers is None:
+        workers = max(1, min(os.cpu_count() or 1, len(runs) // MIN_SIMS_PER_WORKER))
+    if not project_dir or not (Path(project_dir) / "books").is_dir():
+        workers = 1  # workers load the project's books
+    pool = ut.process_pool(workers, project_dir=project_dir)
+    block = rb.ResultBlock.allocate(meta, rb.TRANSPORT if pool is not None else None)
+    try:
+        block.fill(0, sq)
+        slots = [(i + 1, name, instr) for i, (name, instr) in enumerate(runs)]
+        if pool is not None:
+            chunks = [slots[k::workers] for k in range(workers)]
+            with span('sims', results=len(runs), workers=workers), pool:
+                list(pool.map(_simulate_into, [(block.descriptor(), chunk) for chunk in chunks]))
+        else:
+            for i, name, instr in slots:
+                instructions = at.ProgramInstructions(start_year=start_year, **instr)
+                with span('sims', result=name):
+                    block.fill(i, P.run_sim(parset='default', progset=P.progsets[0], progset_instructions=instructions, result_name=name))
+    except BaseException:
+        block.close()  # the caller never receives the block, so remove its shared segment here
+        raise
+    return block
+
 def coverage_scenario(P, progset, start_year, facility_code):
     '''
     Run a scenario where interventions are individually fully covered.
@@ -22,19 +122,18 @@ def coverage_scenario(P, progset, start_year, facility_code):
     :param P: Atomica project.
     :param start_year: Start year of simulations.
     :param facility_code: Code of the facility.
-    :return: 
+    :return: Summary dict (artifacts, emissions, totals).
     '''
-    results_scenario = [P.run_sim(parset='default',result_name='Status-quo')] # run status-quo
-    
+    runs = []
     for prog in progset.programs:
         coverage_scenario = {prog_all: 0 for prog_all in progset.programs}
         coverage_scenario[prog] = 1
-        instructions = at.ProgramInstructions(start_year=start_year, coverage=coverage_scenario) # define program instructions
-        result_coverage = P.run_sim(parset='default',progset=P.progsets[0], progset_instructions=instructions, result_name=progset.programs[prog].label) # run budget scenario
-        results_scenario.append(result_coverage)
-        
-    # Calculate emissions 
-    ut.calc_emissions(results_scenario,start_year,facility_code,file_name='coverage_scenario_Emissions_{}'.format(facility_code),title='CO2e emissions - full coverage')
+        runs.append((progset.programs[prog].label, {'coverage': coverage_scenario}))
+    # status-quo (simulated once per project) and one simulation per intervention
+    with simulate_block(P, progset, start_year, facility_code, runs) as results_scenario:
+        # Calculate emissions
+        emissions = ut.calc_emissions(results_scenario,start_year,facility_code,file_name='coverage_scenario_Emissions_{}'.format(facility_code),title='CO2e emissions - full coverage')
+    return _summary(emissions)
 
 def budget_scenario(P, progset, start_year, facility_code, spending:int):
     '''
@@ -44,21 +143,66 @@ def budget_scenario(P, progset, start_year, facility_code, spending:int):
     :param start_year: Start year of simulations.
     :param facility_code: Code of the facility.
     :param spending: Spending on individual interventions.
-    :return: 
+    :return: Summary dict (artifacts, emissions, totals).
     '''
-    results_scenario = [P.run_sim(parset='default',result_name='Status-quo')] # run status-quo
-    
+    runs = []
     for prog in progset.programs:
         budget_scenario = {prog_all: 0 for prog_all in progset.programs}
         budget_scenario[prog] = spending
-        instructions = at.ProgramInstructions(start_year=start_year, alloc=budget_scenario) # define program instructions
-        result_budget = P.run_sim(parset='default',progset=P.progsets[0], progset_instructions=instructions, result_name=progset.programs[prog].label) # run budget scenario
-        results_scenario.append(result_budget)
-        
-    # Calculate emissions 
-    ut.calc_emissions(results_scenario,start_year,facility_code,file_name='budget_scenario_Emissions_{}'.format(facility_code),title='CO2e emissions - fixed budget (${:0,.0f})'.format(spending))
+        runs.append((progset.programs[prog].label, {'alloc': budget_scenario}))
+    # status-quo (simulated once per project) and one simulation per intervention
+    with simulate_block(P, progset, start_year, facility_code, runs) as results_scenario:
+        # Calculate emissions
+        emissions = ut.calc_emissions(results_scenario,start_year,facility_code,file_name='budget_scenario_Emissions_{}'.format(facility_code),title='CO2e emissions - fixed budget (${:0,.0f})'.format(spending))
+    return _summary(emissions)
+
+# Optimiser settings (options.optimiser in API requests); None keeps the library default
+DEFAULT_OPTIMISER = {
+    'pso_maxiter': 10,     # PSO iterations
+    'pso_swarmsize': None, # PSO particles (pyswarm: 100)
+    'asd_maxiters': None,  # ASD iterations (sciris: 1000; 5000 per refinement for method 'fast')
+    'maxtime': None,       # time limit in seconds per budget, shared by its PSO and ASD stages
+    'reltol': None,        # ASD relative tolerance, also the smallest improvement that resets stall_evals
+    'stall_evals': None,   # stop a stage after this many objective evaluations without improvement
+    'pso_starts': 1,       # independently seeded PSO runs per budget; the best one seeds ASD
+    'seed': None,          # seed for ASD and the first PSO run (start i uses seed + i); random PSO seeds when None
+    'pso_workers': None,   # processes for the PSO starts (default: one per start, up to the CPU count)
+}
+_INT_SETTINGS = ('pso_maxiter', 'pso_swarmsize', 'asd_maxiters', 'stall_evals', 'pso_starts', 'seed', 'pso_workers')
+
+def optimiser_settings(settings=None):
+    '''
+    Merge user optimiser settings over DEFAULT_OPTIMISER.
+    Raises ValueError for unknown keys or non-numeric values.
+    '''
+    out = dict(DEFAULT_OPTIMISER)
+    for key, val in (settings or {}).items():
+        if key not in out:
+            raise ValueError(f"unknown optimiser setting: {key!r}")
+        if val is None:
+            continue
+        try:
+            out[key] = int(val) if key in _INT_SETTINGS else float(val)
+        except (TypeError, ValueError):
+            raise ValueError(f"optimiser setting {key!r} must be a number")
+    return out
+
+class _TracedMeasurable(at.MinimizeMeasurable):
+    '''
+    MinimizeMeasurable that reports every objective value (and the allocation producing it) to a ConvergenceTrace.
+    '''
+    def __init__(self, measurable_name, t, trace):
+        at.MinimizeMeasurable.__init__(self, measurable_name, t)
+        self.trace = trace
+        self.year = t
+
+    def get_objective_val(self, model, baseline):
+        val = at.MinimizeMeasurable.get_objective_val(self, model, baseline)
+        alloc = model.program_instructions.alloc
+        self.trace.record(val, lambda: {prog: float(np.squeeze(ts.interpolate(self.year))) for prog, ts in alloc.items()})
+        return val
 
-def optimization(P, progset, start_year, facility_code, budgets:list):
+def optimization(P, progset, start_year, facility_code, budgets:list, method:str='atomica', greedy_start:bool=False, report_gap:bool=None, settings:dict=None, warm_start:dict=None):
     '''
     Optimize spending allocation on interventions by minizing emissions for a set total budget.
     Results on emission reductions and optimized budget allocations are saved in an excel sheet.
@@ -66,55 +210,332 @@ def optimization(P, progset, start_year, facility_code, budgets:list):
     :param start_year: Start year of simulations.
     :param facility_code: Code of the facility.
     :param budgets: List of budgets to optimize.
-    :return: 
+    :param method: 'atomica' (PSO then ASD with at.optimize), 'fast' (ASD on the compiled evaluator.py model)
+                   or 'greedy' (greedy marginal cost-effectiveness allocation, milliseconds).
+    :param greedy_start: With method 'atomica', start ASD from the greedy allocation instead of running PSO.
+    :param report_gap: With method 'greedy', also run the fast optimiser to report the greedy gap (default on);
+                       with method 'atomica', also compute the greedy allocations to report their gap (default off).
+    :param settings: Optimiser settings overriding DEFAULT_OPTIMISER (iterations, time limit, tolerances).
+    :param warm_start: With method 'atomica', optional {budget: {program: spend}} previous optima (see optima.py);
+                       ASD starts from them instead of running PSO for those budgets.
+    :return: Summary dict (artifacts, emissions, totals, allocations, optimisation diagnostics per budget).
+    '''
+    if method not in ('fast', 'greedy', 'atomica'):
+        raise ValueError(f"unknown optimization method: {method!r}")
+    cfg = optimiser_settings(settings)
+    if report_gap is None:
+        report_gap = method == 'greedy'
+    # Atomica's optimiser only needs the compiled model for a greedy start or the greedy gap, and
+    # falls back to PSO (and no gap) for projects the model cannot express
+    model, greedy = None, {}
+    if method != 'atomica' or greedy_start or report_gap:
+        try:
+            model = compiled_model(P, progset, start_year, facility_code)
+        except ValueError:
+            if method != 'atomica':
+                raise
+    if model is not None:
+        greedy = {budget: ev.greedy_allocation(model, budget) for budget in budgets}
+
+    # each budget's result is copied into the block as soon as it is simulated and then dropped, so
+    # memory does not grow with the number of budgets (status-quo in slot 0, then one slot per budget)
+    sq = status_quo(P)
+    names = [_budget_name(budget) for budget in budgets]
+    block = rb.ResultBlock.allocate(rb.block_meta(sq, progset, facility_code, start_year, [sq.name] + names))
+    block.fill(0, sq)
+    if method in ('fast', 'greedy'):
+        achieved = _optimize_model(P, model, greedy, start_year, facility_code, budgets, method, report_gap, cfg, block)
+    else:
+        start = {budget: greedy[budget]['allocation'] for budget in budgets} if greedy_start and greedy else None
+        achieved = _optimize_atomica(P, progset, start_year, facility_code, budgets, cfg, block, initial=start, warm_start=warm_start)
+
+    # Greedy allocation versus the full optimiser (gap as a fraction of the optimised emissions)
+    diagnostics = {}
+    for budget, name in zip(budgets, names):
+        info = {'method': method, **achieved[budget]}
+        if budget not in greedy:
+            diagnostics[name] = info
+            continue
+        info['greedy_total'] = greedy[budget]['total']
+        reference = info['total'] if method != 'greedy' else info.get('reference_total')
+        if reference:
+            info['reference_total'] = reference
+            info['greedy_gap'] = (greedy[budget]['total'] - reference) / reference
+        diagnostics[name] = info
+
+    # Plot and save emissions
+    emissions = ut.calc_emissions(block,start_year,facility_code,file_name='optimization_Emissions_{}'.format(facility_code))
+
+    # Plot budget allocation (exclude status-quo result)
+    allocation = ut.plot_allocation(block.view(slice(1, None)),file_name='optimization_Budget_Allocation_{}'.format(facility_code)) # allocation
+
+    # Save budget allocation and interventions coverage (exclude status-quo result)
+    ut.write_alloc_excel(progset, block.view(slice(1, None)), start_year,file_name='optimization_Budget_Allocation_{}'.format(facility_code))
+    return _summary(emissions, allocation, {'optimisation': diagnostics})
+
+def _budget_name(budget):
+    return '${:0,.0f}'.format(budget)
+
+def _total_at(result, facility_code, year):
+    return float(result.get_variable(ev.TOTAL_PAR, facility_code)[0].vals[list(result.t).index(year)])
+
+def _deadline(cfg):
+    return time.perf_counter() + cfg['maxtime'] if cfg['maxtime'] else None
+
+def _optimize_model(P, model, greedy, start_year, facility_code, budgets, method, report_gap, cfg, block):
+    '''
+    Optimize each budget on the compiled emissions model ('fast': ASD seeded with the greedy
+    allocation; 'greedy': the greedy allocation itself) and simulate the allocations with Atomica.
+    :param block: ResultBlock receiving the result of budget i in slot i + 1.
+    :return: Per-budget diagnostics.
+    '''
+    fast_args = {key: cfg[name] for key, name in (('maxiters', 'asd_maxiters'), ('reltol', 'reltol'), ('seed', 'seed')) if cfg[name] is not None}
+    achieved = {}
+    ckpt = checkpoints.current.get() if method == 'fast' else None
+    for i, budget in enumerate(budgets, start=1):
+        name = _budget_name(budget)
+        if ckpt is not None and ckpt.budget(budget) is not None:
+            result_optimized, achieved[budget] = _resume_budget(P, ckpt.budget(budget), name, start_year)
+            block.fill(i, result_optimized)
+            continue
+        info = {}
+        if method == 'greedy':
+            optimum = greedy[budget]
+            if report_gap:
+                with span('optimisation', budget=budget, method='fast'):
+                    info['reference_total'] = ev.optimize_allocation(model, budget, x0=optimum['x'], **fast_args)['total']
+        else:
+            trace = ConvergenceTrace(_deadline(cfg), cfg['reltol'], cfg['stall_evals'])
+            with span('optimisation', budget=budget, method='fast'):
+                optimum = ev.optimize_allocation(model, budget, x0=greedy[budget]['x'], trace=trace, **fast_args)
+            info['convergence'] = {'fast': trace.to_dict()}
+        instructions = at.ProgramInstructions(start_year=start_year, alloc=optimum['allocation'])
+        with span('sims', result=name):
+            result_optimized = P.run_sim(P.parsets[0],P.progsets[0], progset_instructions=instructions)
+        # the simulated allocation must agree with the model it was chosen on
+        simulated = _total_at(result_optimized, facility_code, start_year)
+        if abs(simulated - optimum['total']) > ev.DEFAULT_RTOL * max(abs(simulated), 1.0):
+            raise RuntimeError(f"evaluator total {optimum['total']:.6g} differs from run_sim {simulated:.6g} for budget {budget}")
+        info.update({'total': simulated, 'evaluations': optimum['evaluations']})
+        if optimum.get('unspent'):
+            info['unspent'] = optimum['unspent']
+        achieved[budget] = info
+        block.fill(i, result_optimized)
+        if ckpt is not None:
+            ckpt.save_budget(budget, {prog: float(v) for prog, v in optimum['allocation'].items()}, info)
+    return achieved
+
+def _resume_budget(P, saved, name, start_year):
     '''
+    Simulate the allocation of a budget finished by an earlier, interrupted run (see checkpoints.py).
+    :return: The result and the budget's saved diagnostics.
+    '''
+    instructions = at.ProgramInstructions(start_year=start_year, alloc=saved['allocation'])
+    with span('sims', result=name):
+        result = P.run_sim(P.parsets[0],P.progsets[0], progset_instructions=instructions)
+    result.name = name
+    return result, {**saved['info'], 'resumed': True}
+
+def _run_optimize(P, optimization, instructions, optim_args, trace, start_year):
+    '''
+    at.optimize, returning the best allocation seen so far if the trace stops it early.
+    '''
+    try:
+        return at.optimize(P, optimization, P.parsets[0],P.progsets[0], instructions=instructions, optim_args=optim_args)
+    except StopOptimisation:
+        return at.ProgramInstructions(start_year=start_year, alloc=trace.best_payload)
+
+def _pso_start(P, budget, start_year, seed, cfg, maxtime):
+    '''
+    One seeded PSO run for a budget (runs in a worker process for multi-start PSO).
+    :param P: Atomica project, or None in a process_pool worker (the project it built from the books).
+    :return: {"seed", "best" (objective), "allocation" {program: spend}, "convergence"}
+    '''
+    P = P or ut.worker_state()['P']
+    np.random.seed(seed) # pyswarm draws the swarm from numpy's global random state
+    trace = ConvergenceTrace(time.perf_counter() + maxtime if maxtime else None, cfg['reltol'], cfg['stall_evals'])
     instructions = at.ProgramInstructions(alloc=P.progsets[0], start_year=start_year) # Baseline spending
-    adjustments = [at.SpendingAdjustment(prog, start_year, 'abs', 0.0, 10e6) for prog in progset.programs] # Adjustments (no spending constraint on any intervention)
-    measurables = [at.MinimizeMeasurable('co2e_emissions',start_year)] # Measurables (objective function: minimize total emissions)
-    
-    # Run optimization
-    # Initialize with PSO
-    result_names = []
-    for budget in budgets:
-        result_names.append('${:0,.0f}'.format(budget))
-        
-    results_optimized = []
-    for budget, name in zip(budgets, result_names):
-        constraints = at.TotalSpendConstraint(total_spend=budget, t=start_year) # constraint on total spending
-        # Run optimization
-        optimization = at.Optimization(name='default', method='pso', 
-                                       adjustments=adjustments, measurables=measurables, constraints=constraints)
-        optimized_instructions = at.optimize(P, optimization, P.parsets[0],P.progsets[0], instructions=instructions, optim_args={"maxiter": 10})
-        result_optimized = P.run_sim(P.parsets[0],P.progsets[0], progset_instructions=optimized_instructions)
-        
-        # Compile results
-        result_optimized.name = name
-        results_optimized.append(result_optimized)
-    
-    # Extract spending to use as initial conditions in ASD loop
-    allocation_initial, _ = ut.write_alloc_excel(progset, results_optimized, start_year, print_results=False)
-    
-    # Refine optimization with ASD
-    results_optimized = [P.run_sim(parset='default',result_name='Status-quo')]
-    for budget, name in zip(budgets, result_names):
+    constraints = at.TotalSpendConstraint(total_spend=budget, t=start_year)
+    # no intervention can take more than the whole budget
+    adjustments = [at.SpendingAdjustment(prog, start_year, 'abs', 0.0, float(budget)) for prog in P.progsets[0].programs]
+    measurables = [_TracedMeasurable('co2e_emissions', start_year, trace)] # Measurables (objective function: minimize total emissions)
+    optimization = at.Optimization(name='default', method='pso',
+                                   adjustments=adjustments, measurables=measurables, constraints=constraints)
+    pso_args = {'maxiter': cfg['pso_maxiter']}
+    if cfg['pso_swarmsize']:
+        pso_args['swarmsize'] = cfg['pso_swarmsize']
+    optimized_instructions = _run_optimize(P, optimization, instructions, pso_args, trace, start_year)
+    allocation = {prog: float(np.squeeze(ts.interpolate(start_year))) for prog, ts in optimized_instructions.alloc.items()}
+    return {'seed': int(seed), 'best': trace.best, 'allocation': allocation, 'convergence': trace.to_dict()}
+
+def _pso_multistart(P, budget, start_year, cfg, deadline):
+    '''
+    Run cfg['pso_starts'] seeded PSO runs for a budget, in parallel worker processes when there is
+    more than one, and return them best first.
+    '''
+    k = max(1, cfg['pso_starts'])
+    if cfg['seed'] is not None:
+        seeds = [cfg['seed'] + i for i in range(k)]
+    else:
+        seeds = [int(x) for x in np.random.default_rng().integers(0, 2**31 - 1, k)]
+    maxtime = max(deadline - time.perf_counter(), 0.0) if deadline is not None else None
+    workers = min(k, cfg['pso_workers'] or os.cpu_count() or 1)
+    project_dir = os.environ.get("PROJECT_DIR")
+    if not project_dir or not (Path(project_dir) / "books").is_dir():
+        workers = 1  # workers load the project's books rather than receiving the pickled project
+    pool = ut.process_pool(workers, project_dir=project_dir)
+    if pool is not None:
+        with pool:
+            runs = list(pool.map(_pso_start, [None] * k, [budget] * k, [start_year] * k, seeds, [cfg] * k, [maxtime] * k))
+    else:
+        runs = [_pso_start(P, budget, start_year, seed, cfg, maxtime) for seed in seeds]
+    return sorted(runs, key=lambda run: run['best'])
+
+def _optimize_atomica(P, progset, start_year, facility_code, budgets, cfg, block, initial=None, warm_start=None):
+    '''
+    Optimize each budget with at.optimize (PSO initialisation refined with ASD).
+    Spending on each intervention is bounded by the budget being optimized.
+    :param cfg: Optimiser settings (see optimiser_settings).
+    :param block: ResultBlock receiving the result of budget i in slot i + 1.
+    :param initial: Optional {budget: {program: spend}} ASD starting points, replacing the PSO step.
+    :param warm_start: Optional {budget: {program: spend}} previous optima, preferred over `initial`.
+    :return: Per-budget diagnostics.
+    '''
+    instructions = at.ProgramInstructions(alloc=P.progsets[0], start_year=start_year) # Baseline spending
+    asd_args = {'reltol': cfg['reltol']} if cfg['reltol'] is not None else {}
+    if cfg['seed'] is not None:
+        asd_args['randseed'] = cfg['seed']
+
+    achieved = {}
+    ckpt = checkpoints.current.get()
+    for i, budget in enumerate(budgets, start=1):
+        name = _budget_name(budget)
+        if ckpt is not None and ckpt.budget(budget) is not None:
+            result_optimized, achieved[budget] = _resume_budget(P, ckpt.budget(budget), name, start_year)
+            block.fill(i, result_optimized)
+            continue
+        partial = ckpt.partial(budget) if ckpt is not None else None
+        deadline = _deadline(cfg)
         constraints = at.TotalSpendConstraint(total_spend=budget, t=start_year) # constraint on total spending
-        adjustments = [at.SpendingAdjustment(prog, start_year, initial=allocation_initial[name][progset.programs[prog].label]) for prog in progset.programs.keys()]
-        
-        # Run optimization
-        optimization = at.Optimization(name='default', method='asd', 
+        info = {'convergence': {}}
+
+        if partial is not None:
+            # resume after the last saved stage of an interrupted run
+            start = partial['allocation']
+            info.update(partial['info'])
+            info['resumed_from'] = partial['stage']
+        elif warm_start and budget in warm_start:
+            # previous optimum of slightly different inputs: ASD only
+            start = {prog: float(warm_start[budget].get(prog, 0.0)) for prog in progset.programs.keys()}
+            info['start'] = 'previous'
+        elif initial is None:
+            # Initialize with PSO; the best of the seeded starts is refined with ASD
+            with span('optimisation', budget=budget, method='pso', starts=cfg['pso_starts']):
+                runs = _pso_multistart(P, budget, start_year, cfg, deadline)
+            start = runs[0]['allocation']
+            info['convergence']['pso'] = runs[0]['convergence']
+            info['pso_seed'] = runs[0]['seed']
+            if len(runs) > 1:
+                info['pso_starts'] = [{'seed': run['seed'], 'best': run['best'], 'stopped': run['convergence']['stopped']} for run in runs]
+            if ckpt is not None:
+                ckpt.save_partial(budget, 'pso', start, info=info)
+        else:
+            start = initial[budget]
+            info['start'] = 'greedy'
+
+        # Refine optimization with ASD (best allocation checkpointed periodically)
+        on_best = None
+        if ckpt is not None:
+            on_best = lambda best, alloc, budget=budget, info=info: ckpt.save_partial(budget, 'asd', alloc, best=best, info=info)
+        trace = ConvergenceTrace(deadline, cfg['reltol'], cfg['stall_evals'], on_best=on_best, every=checkpoints.CHECKPOINT_SECONDS)
+        adjustments = [at.SpendingAdjustment(prog, start_year, 'abs', 0.0, float(budget), initial=min(start[prog], float(budget))) for prog in progset.programs.keys()]
+        measurables = [_TracedMeasurable('co2e_emissions', start_year, trace)]
+        optimization = at.Optimization(name='default', method='asd', maxiters=cfg['asd_maxiters'],
                                        adjustments=adjustments, measurables=measurables, constraints=constraints)
-        optimized_instructions = at.optimize(P, optimization, P.parsets[0],P.progsets[0], instructions=instructions)
-        result_optimized = P.run_sim(P.parsets[0],P.progsets[0], progset_instructions=optimized_instructions)
-        
+        with span('optimisation', budget=budget, method='asd'):
+            optimized_instructions = _run_optimize(P, optimization, instructions, asd_args or None, trace, start_year)
+        with span('sims', result=name):
+            result_optimized = P.run_sim(P.parsets[0],P.progsets[0], progset_instructions=optimized_instructions)
+        info['convergence']['asd'] = trace.to_dict()
+
         # Compile results
-        result_optimized.name = name
-        results_optimized.append(result_optimized)
-        
-    # Plot and save emissions
-    ut.calc_emissions(results_optimized,start_year,facility_code,file_name='optimization_Emissions_{}'.format(facility_code))
-    
-    # Plot budget allocation (exclude status-quo result)
-    ut.plot_allocation(results_optimized[1:],file_name='optimization_Budget_Allocation_{}'.format(facility_code)) # allocation
-    
-    # Save budget allocation and interventions coverage (exclude status-quo result)
-    ut.write_alloc_excel(progset, results_optimized[1:], start_year,file_name='results/optimization_Budget_Allocation_{}'.format(facility_code))
+        info['total'] = _total_at(result_optimized, facility_code, start_year)
+        achieved[budget] = info
+        block.fill(i, result_optimized)
+        if ckpt is not None:
+            allocation = {prog: float(np.squeeze(ts.interpolate(start_year))) for prog, ts in optimized_instructions.alloc.items()}
+            ckpt.save_budget(budget, allocation, info)
+    return achieved
+
+def uncertainty_scenario(P, progset, start_year, end_year, facility_code, input_data_sheet, budgets:list=None, settings:dict=None):
+    '''
+    Monte Carlo uncertainty analysis over effect sizes and costs (see uncertainty.py).
+    Percentile tables are saved in an excel sheet, with a band chart of the coverage scenarios
+    and a fan chart over the budgets.
+    :param P: Atomica project.
+    :param start_year: Start year of simulations.
+    :param end_year: End year of simulations (implementation costs are spread over these years).
+    :param facility_code: Code of the facility.
+    :param input_data_sheet: Input workbook holding the point estimates.
+    :param budgets: Budgets whose optimal allocations are evaluated under uncertainty.
+    :param settings: Settings overriding uncertainty.DEFAULT_UNCERTAINTY (samples, ranges, reoptimise, ...).
+    :return: Summary dict (artifacts, uncertainty percentiles).
+    '''
+    from validation import expected_inputs
+    model = compiled_model(P, progset, start_year, facility_code)
+    inputs = expected_inputs(input_data_sheet, facility_code, start_year, end_year)
+    labels = {prog: progset.programs[prog].label for prog in progset.programs}
+    with span('sims', result='uncertainty'):
+        summary = unc.run_uncertainty(model, inputs, budgets or [], settings, n_years=len(np.arange(start_year, end_year)), labels=labels)
+    outputs = ut.write_uncertainty(summary, facility_code, file_name='uncertainty_{}'.format(facility_code))
+    return _summary(outputs, {'uncertainty': summary})
+
+def frontier_scenario(P, progset, start_year, facility_code, settings:dict=None):
+    '''
+    Compute the emissions-vs-budget frontier, choosing budgets adaptively where the curve bends (see frontier.py).
+    Budgets, emissions and allocations are saved in an excel sheet together with a frontier plot.
+    :param P: Atomica project.
+    :param start_year: Start year of simulations.
+    :param facility_code: Code of the facility.
+    :param settings: Settings overriding frontier.DEFAULT_FRONTIER (budget range, points, tolerance, method).
+    :return: Summary dict (artifacts, frontier points and diagnostics).
+    '''
+    model = compiled_model(P, progset, start_year, facility_code)
+    labels = {prog: progset.programs[prog].label for prog in progset.programs}
+    with span('optimisation', result='frontier'):
+        frontier = fr.compute_frontier(model, settings, labels=labels)
+    outputs = ut.plot_frontier(frontier, facility_code, file_name='frontier_{}'.format(facility_code))
+    return _summary(outputs, {'frontier': frontier})
+
+def dose_response_scenario(P, progset, start_year, facility_code, mode:str='coverage', levels=11, max_spend:float=None):
+    '''
+    Evaluate every intervention alone across a grid of coverage or spending levels in one batch on the
+    compiled emissions model (one status-quo simulation), and rank interventions by marginal abatement cost.
+    Cost-to-abatement curves and the ranking are saved in an excel sheet with a curve plot and a MAC chart.
+    :param P: Atomica project.
+    :param start_year: Start year of simulations.
+    :param facility_code: Code of the facility.
+    :param mode: 'coverage' (fractions of each intervention's eligible facilities) or 'spend' (same spending for all).
+    :param levels: Number of evenly spaced levels, or the list of levels itself.
+    :param max_spend: Top of the spending grid in mode 'spend' (default: the largest spending that fully covers an intervention).
+    :return: Summary dict (artifacts, dose_response curves and mac ranking).
+    '''
+    model = compiled_model(P, progset, start_year, facility_code)
+    if isinstance(levels, (list, tuple)):
+        grid = sorted(float(v) for v in levels)
+    else:
+        top = 1.0 if mode == 'coverage' else float(max_spend or (model.unit_costs * model.eligible).max())
+        grid = list(np.linspace(0.0, top, max(2, int(levels))))
+    with span('sims', result='dose_response'):
+        curves = ev.dose_response(model, grid, mode)
+        mac = ev.mac_ranking(model)
+    labels = [progset.programs[prog].label for prog in model.programs]
+    data = {
+        'mode': mode,
+        'levels': grid,
+        'status_quo': curves['status_quo'],
+        'curves': {label: {key: [float(v) for v in curves[key][i]] for key in ('spend', 'coverage', 'emissions', 'abatement')} for i, label in enumerate(labels)},
+        'mac': [{**row, 'intervention': labels[model.programs.index(row['program'])]} for row in mac],
+    }
+    outputs = ut.plot_dose_response(data, facility_code, file_name='dose_response_{}'.format(facility_code))
+    return _summary(outputs, {'dose_response': data})
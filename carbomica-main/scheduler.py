@@ -0,0 +1,284 @@
+"""
+Cost-aware scheduler for engine runs.
+
+engine_api.py hands every queued run to the process-wide Scheduler instead of running it in
+arrival order. Each run gets an estimated cost in seconds (estimate_cost: scenario, number of
+programs, budgets and optimiser settings, scaled by how long past runs of the same kind actually
+took) and goes into a lane:
+
+  fast  estimated at most CARBOMICA_FAST_LANE_SECONDS (default 30); always dispatched first
+  slow  everything else; may use all engine slots but one when there is more than one
+
+Slots match the worker pool size (CARBOMICA_WORKERS, or the live broker workers). At most CARBOMICA_MAX_RUNS_PER_PROJECT runs
+(default 1) of one project run at a time. check_admission raises BacklogFull when the estimated
+backlog per slot would exceed CARBOMICA_MAX_BACKLOG_SECONDS (default 3600), and eta() predicts
+when a queued run will start by replaying the dispatch rules over the current queue.
+"""
+import os
+import time
+import threading
+import itertools
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable
+
+FAST_LANE_SECONDS = float(os.environ.get("CARBOMICA_FAST_LANE_SECONDS", "30"))
+MAX_BACKLOG_SECONDS = float(os.environ.get("CARBOMICA_MAX_BACKLOG_SECONDS", "3600"))
+MAX_RUNS_PER_PROJECT = int(os.environ.get("CARBOMICA_MAX_RUNS_PER_PROJECT", "1"))
+
+# rough single-machine costs, corrected per scenario kind by observed run times (see Scheduler.finished)
+BASE_SECONDS = 3.0            # books, project load, plots and io
+SIM_SECONDS = 0.02            # one Atomica simulation ...
+SIM_SECONDS_PER_PROGRAM = 0.002  # ... plus this per program
+FAST_OPTIMISE_SECONDS = 0.5   # one budget with the evaluator.py optimisers ('fast' / 'greedy')
+DEFAULT_BUDGETS = 3           # run_main's default budget list
+PSO_SWARMSIZE = 100           # pyswarm default
+ASD_MAXITERS = 1000           # sciris default
+_CALIBRATION_WEIGHT = 0.3     # weight of the latest run in the per-kind correction factor
+
+_program_counts: Dict[tuple, int] = {}
+
+
+class BacklogFull(Exception):
+    """
+    Raised by Scheduler.check_admission; retry_after is the estimated wait in seconds.
+    """
+
+    def __init__(self, backlog: float, retry_after: float):
+        super().__init__(f"engine queue is full (estimated backlog {backlog:.0f}s)")
+        self.backlog = backlog
+        self.retry_after = retry_after
+
+
+def count_programs(input_path) -> int:
+    '''
+    Number of interventions in an input workbook, cached per file version. 0 if it cannot be read.
+    '''
+    p = Path(input_path)
+    try:
+        st = p.stat()
+    except OSError:
+        return 0
+    key = (str(p.resolve()), st.st_mtime_ns, st.st_size)
+    if key not in _program_counts:
+        import pandas as pd
+        try:
+            _program_counts[key] = int(len(pd.read_excel(p, sheet_name="interventions").dropna(how="all")))
+        except Exception:
+            _program_counts[key] = 0
+    return _program_counts[key]
+
+
+def _budget_count(budgets) -> int:
+    if isinstance(budgets, (list, tuple)):
+        return len(budgets)
+    if isinstance(budgets, str):
+        return len([b for b in budgets.split(",") if b.strip()])
+    return DEFAULT_BUDGETS
+
+
+def scenario_kind(scenario: Optional[str], options: Optional[dict]) -> str:
+    '''
+    Canonical scenario kind of a run request, following run_main._run_scenario's dispatch.
+    '''
+    opts = options or {}
+    scen = (scenario or "baseline").strip().lower()
+    aliases = {"baseline": "coverage", "full": "coverage", "montecarlo": "uncertainty", "monte_carlo": "uncertainty",
+               "pareto": "frontier", "dose-response": "dose_response", "mac": "dose_response",
+               "opt": "optimization", "optimize": "optimization"}
+    scen = aliases.get(scen, scen)
+    if scen in ("batch", "coverage", "uncertainty", "frontier", "dose_response"):
+        return scen
+    if scen == "budget" or opts.get("spending") is not None:
+        return "budget"
+    if scen == "optimization" or opts.get("budgets") is not None:
+        return "optimization"
+    return "coverage"
+
+
+def estimate_cost(scenario: Optional[str], options: Optional[dict], n_programs: int) -> float:
+    '''
+    Estimated run time in seconds of a run request, before calibration.
+    :param scenario: Scenario as passed to run_main.run_project.
+    :param options: Run options (budgets, method, optimiser settings, ...).
+    :param n_programs: Number of interventions in the project.
+    '''
+    opts = options or {}
+    kind = scenario_kind(scenario, opts)
+    sim = SIM_SECONDS + SIM_SECONDS_PER_PROGRAM * n_programs
+    if kind == "batch":
+        entries = opts.get("batch") or []
+        return BASE_SECONDS + sum(max(estimate_cost(e.get("scenario"), e.get("options"), n_programs) - BASE_SECONDS, 0.0)
+                                  for e in entries if isinstance(e, dict))
+    cost = BASE_SECONDS
+    if opts.get("validate"):
+        cost += (2 * n_programs + 2) * sim
+    if kind in ("coverage", "budget"):
+        return cost + (n_programs + 1) * sim
+    if kind == "dose_response":
+        return cost + 2 * sim
+    if kind == "frontier":
+        settings = opts.get("frontier") or {}
+        return cost + sim + int(settings.get("max_points") or 25) * FAST_OPTIMISE_SECONDS
+    if kind == "uncertainty":
+        settings = opts.get("uncertainty") or {}
+        samples = int(settings.get("samples") or 1000)
+        budgets = _budget_count(opts.get("budgets")) if opts.get("budgets") is not None else 0
+        per_sample = 0.0005 * (n_programs + budgets)
+        if settings.get("reoptimise"):
+            per_sample += 0.05 * budgets
+        return cost + sim + budgets * FAST_OPTIMISE_SECONDS + samples * per_sample
+    # optimization
+    budgets = _budget_count(opts.get("budgets"))
+    if (opts.get("method") or "atomica") in ("fast", "greedy"):
+        return cost + sim + budgets * FAST_OPTIMISE_SECONDS
+    settings = opts.get("optimiser") or {}
+    evals = (int(settings.get("pso_swarmsize") or PSO_SWARMSIZE) * (int(settings.get("pso_maxiter") or 10) + 1)
+             * int(settings.get("pso_starts") or 1) + int(settings.get("asd_maxiters") or ASD_MAXITERS))
+    per_budget = evals * sim
+    if settings.get("maxtime"):
+        per_budget = min(per_budget, float(settings["maxtime"]))
+    return cost + sim + budgets * per_budget
+
+
+class Scheduler:
+    """
+    Thread-safe run queue with two lanes, per-project limits and backlog admission control.
+    Runs execute on their own threads; the engine work itself happens in the worker pool.
+    """
+
+    def __init__(self, slots: int, fast_lane_seconds: float = FAST_LANE_SECONDS, max_backlog: float = MAX_BACKLOG_SECONDS,
+                 per_project: int = MAX_RUNS_PER_PROJECT):
+        self.slots = max(1, int(slots))
+        self.slow_slots = self.slots - 1 if self.slots > 1 else 1  # keep one slot for the fast lane
+        self.fast_lane_seconds = fast_lane_seconds
+        self.max_backlog = max_backlog
+        self.per_project = max(1, int(per_project))
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._queued: List[Dict[str, Any]] = []
+        self._running: Dict[str, Dict[str, Any]] = {}
+        self._scale: Dict[str, float] = {}
+
+    def resize(self, slots: int):
+        '''
+        Change the number of slots (e.g. as broker workers come and go) and start what now fits.
+        '''
+        with self._lock:
+            self.slots = max(1, int(slots))
+            self.slow_slots = self.slots - 1 if self.slots > 1 else 1
+            self._dispatch()
+
+    def estimate(self, scenario: Optional[str], options: Optional[dict], n_programs: int) -> Dict[str, Any]:
+        '''
+        Calibrated cost estimate: {"kind", "estimated_seconds", "lane"}.
+        '''
+        kind = scenario_kind(scenario, options)
+        seconds = estimate_cost(scenario, options, n_programs) * self._scale.get(kind, 1.0)
+        return {"kind": kind, "estimated_seconds": seconds, "lane": "fast" if seconds <= self.fast_lane_seconds else "slow"}
+
+    def backlog_seconds(self) -> float:
+        '''
+        Estimated queued plus remaining running work per slot.
+        '''
+        with self._lock:
+            return self._backlog()
+
+    def _backlog(self) -> float:
+        now = time.time()
+        work = sum(max(j["estimated_seconds"] - (now - j["started"]), 0.0) for j in self._running.values())
+        work += sum(j["estimated_seconds"] for j in self._queued)
+        return work / self.slots
+
+    def check_admission(self, estimated_seconds: float):
+        '''
+        Raise BacklogFull if queueing this much more work would push the backlog past max_backlog.
+        An idle scheduler always admits, however large the run.
+        '''
+        with self._lock:
+            backlog = self._backlog()
+            if self._queued or self._running:
+                if backlog + estimated_seconds / self.slots > self.max_backlog:
+                    raise BacklogFull(backlog, retry_after=max(backlog + estimated_seconds / self.slots - self.max_backlog, 1.0))
+
+    def submit(self, run_id: str, project_id: str, estimate: Dict[str, Any], fn: Callable, *args):
+        '''
+        Queue fn(*args) as run run_id; it starts once the lane, slot and project limits allow.
+        '''
+        with self._lock:
+            self._queued.append({"run_id": run_id, "project_id": project_id, "seq": next(self._seq), "fn": fn, "args": args, **estimate})
+            self._dispatch()
+
+    def _order(self, jobs):
+        return sorted(jobs, key=lambda j: (j["lane"] != "fast", j["seq"]))
+
+    def _can_start(self, job, running) -> bool:
+        if len(running) >= self.slots:
+            return False
+        if job["lane"] == "slow" and sum(1 for j in running if j["lane"] == "slow") >= self.slow_slots:
+            return False
+        return sum(1 for j in running if j["project_id"] == job["project_id"]) < self.per_project
+
+    def _dispatch(self):
+        # caller holds the lock
+        for job in self._order(self._queued):
+            if self._can_start(job, list(self._running.values())):
+                self._queued.remove(job)
+                job["started"] = time.time()
+                self._running[job["run_id"]] = job
+                threading.Thread(target=self._run, args=(job,), daemon=True, name=f"run-{job['run_id']}").start()
+
+    def _run(self, job):
+        try:
+            job["fn"](*job["args"])
+        finally:
+            self.finished(job["run_id"])
+
+    def finished(self, run_id: str):
+        '''
+        Release a run's slot, fold its actual duration into the cost calibration and start what fits.
+        '''
+        with self._lock:
+            job = self._running.pop(run_id, None)
+            if job is not None and job["estimated_seconds"] > 0:
+                ratio = (time.time() - job["started"]) / (job["estimated_seconds"] / self._scale.get(job["kind"], 1.0))
+                old = self._scale.get(job["kind"], 1.0)
+                self._scale[job["kind"]] = min(max((1 - _CALIBRATION_WEIGHT) * old + _CALIBRATION_WEIGHT * ratio, 0.1), 10.0)
+            self._dispatch()
+
+    def eta(self, run_id: str) -> Optional[Dict[str, Any]]:
+        '''
+        Scheduling estimate for a queued or running run:
+        {"lane", "estimated_seconds", "position"?, "estimated_wait_seconds", "estimated_start"} (epoch seconds).
+        Queued runs are placed by replaying the dispatch rules with the estimated durations.
+        '''
+        with self._lock:
+            now = time.time()
+            job = self._running.get(run_id)
+            if job is not None:
+                return {"lane": job["lane"], "estimated_seconds": job["estimated_seconds"], "estimated_wait_seconds": 0.0,
+                        "estimated_start": job["started"]}
+            if not any(j["run_id"] == run_id for j in self._queued):
+                return None
+            # simulated runs: (end time, lane, project)
+            sim = [(now + max(j["estimated_seconds"] - (now - j["started"]), 0.0), j["lane"], j["project_id"]) for j in self._running.values()]
+            for pos, j in enumerate(self._order(self._queued)):
+                start = now
+                while not self._can_start(j, [{"lane": lane, "project_id": pid} for end, lane, pid in sim if end > start]):
+                    start = min(end for end, _, _ in sim if end > start)
+                if j["run_id"] == run_id:
+                    return {"lane": j["lane"], "estimated_seconds": j["estimated_seconds"], "position": pos,
+                            "estimated_wait_seconds": start - now, "estimated_start": start}
+                sim.append((start + j["estimated_seconds"], j["lane"], j["project_id"]))
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        '''
+        Queue state for /metrics: {"queued": {lane: n}, "running": {lane: n}, "backlog_seconds"}.
+        '''
+        with self._lock:
+            out = {"queued": {"fast": 0, "slow": 0}, "running": {"fast": 0, "slow": 0}, "backlog_seconds": self._backlog()}
+            for j in self._queued:
+                out["queued"][j["lane"]] += 1
+            for j in self._running.values():
+                out["running"][j["lane"]] += 1
+            return out
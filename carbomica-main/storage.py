@@ -1,7 +1,10 @@
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Dict, Any
+import os
 import uuid
 import json
+import shutil
+from contextlib import contextmanager
 from datetime import datetime
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -20,15 +23,40 @@ def load_projects_index() -> dict:
         return {"projects": []}
 
 def save_projects_index(data: dict) -> None:
-    projects_index_path().write_text(json.dumps(data, indent=2), encoding="utf-8")
+    # written to a temporary file and renamed, so readers never see a half-written index
+    path = projects_index_path()
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
+@contextmanager
+def projects_index_lock():
+    """
+    Hold while reading, changing and saving the index, so concurrent updates (API threads, bulk
+    imports, other processes) do not lose each other's entries.
+    """
+    from utils import _file_lock
+    with _file_lock(PROJECTS_DIR / "projects.json.lock"):
+        yield
 
 def add_project_to_index(entry: dict) -> None:
-    idx = load_projects_index()
-    # remove any existing project with same id
-    projects = [p for p in idx.get("projects", []) if p.get("project_id") != entry.get("project_id")]
-    projects.append(entry)
-    idx["projects"] = projects
-    save_projects_index(idx)
+    with projects_index_lock():
+        idx = load_projects_index()
+        # remove any existing project with same id
+        projects = [p for p in idx.get("projects", []) if p.get("project_id") != entry.get("project_id")]
+        projects.append(entry)
+        idx["projects"] = projects
+        save_projects_index(idx)
+
+def add_projects_to_index(entries: list) -> None:
+    """
+    Add several projects to the index with a single write (bulk imports).
+    """
+    ids = {e.get("project_id") for e in entries}
+    with projects_index_lock():
+        idx = load_projects_index()
+        idx["projects"] = [p for p in idx.get("projects", []) if p.get("project_id") not in ids] + list(entries)
+        save_projects_index(idx)
 
 def project_path(project_id: str) -> Path:
     return PROJECTS_DIR / project_id
@@ -81,6 +109,7 @@ def save_input_file(project_id: str, upload_file) -> str:
     if not Path(filename).suffix:
         filename = "input_data.xlsx"
     dest = proj_dir / filename
+    unshare(dest, keep=False)  # a clone's input workbook may still be its parent's file
     # if upload_file is FastAPI UploadFile it has .file or .read()
     try:
         content = upload_file.file.read() if hasattr(upload_file, "file") else upload_file.read()
@@ -89,21 +118,138 @@ def save_input_file(project_id: str, upload_file) -> str:
         content = upload_file.read()
     dest.write_bytes(content)
     # update index entry
-    idx = load_projects_index()
-    updated = False
-    for p in idx.get("projects", []):
-        if p.get("project_id") == project_id:
-            p["input_filename"] = filename
-            p["has_outputs"] = (proj_dir / "outputs").exists()
-            updated = True
-            break
-    if not updated:
-        idx.setdefault("projects", []).append({
-            "project_id": project_id,
-            "project_name": None,
-            "input_filename": filename,
-            "created_at": datetime.utcnow().isoformat() + "Z",
-            "has_outputs": (proj_dir / "outputs").exists()
-        })
-    save_projects_index(idx)
-    return str(dest)
\ No newline at end of file
+    with projects_index_lock():
+        idx = load_projects_index()
+        updated = False
+        for p in idx.get("projects", []):
+            if p.get("project_id") == project_id:
+                p["input_filename"] = filename
+                p["has_outputs"] = (proj_dir / "outputs").exists()
+                updated = True
+                break
+        if not updated:
+            idx.setdefault("projects", []).append({
+                "project_id": project_id,
+                "project_name": None,
+                "input_filename": filename,
+                "created_at": datetime.utcnow().isoformat() + "Z",
+                "has_outputs": (proj_dir / "outputs").exists()
+            })
+        save_projects_index(idx)
+    return str(dest)
+# ---------- Clones ----------
+
+# not carried over to clones: the parent's run history, status, in-progress checkpoints and raw validation exports
+CLONE_EXCLUDE = ("runs", "outputs/status.json", "outputs/checkpoints", "outputs/validation")
+FICLONE = 0x40049409  # Linux ioctl sharing a file's extents (btrfs, XFS, ...)
+
+def _reflink(src: Path, dst: Path) -> bool:
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        return False
+    try:
+        with open(src, "rb") as fs, open(dst, "wb") as fd:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+    except OSError:
+        dst.unlink(missing_ok=True)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+def share_file(src: Path, dst: Path) -> str:
+    """
+    Make dst a copy of src that takes no extra space until one of them changes:
+    a reflink where the filesystem supports it, else a hardlink, else a plain copy.
+    Returns 'reflink', 'hardlink' or 'copy'.
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if _reflink(src, dst):
+        return "reflink"
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        shutil.copy2(src, dst)
+        return "copy"
+
+def unshare(path, keep: bool = True) -> None:
+    """
+    Before writing a file in place, give it its own inode if it is hardlinked into another
+    project (see clone_project), so the other project keeps its version.
+    :param keep: Copy the current contents (for writers that update the file); False just
+                 removes this project's link, for writers that replace the whole file.
+    """
+    p = Path(path)
+    try:
+        if p.stat().st_nlink < 2:
+            return
+    except FileNotFoundError:
+        return
+    if not keep:
+        p.unlink()
+        return
+    tmp = p.with_name(f".{p.name}.{uuid.uuid4().hex[:8]}.tmp")
+    shutil.copy2(p, tmp)
+    os.replace(tmp, p)
+
+def _rebase(val, old: str, new: str):
+    # absolute paths of the parent project in pipeline entries (file stats keys, books_dir) -> the clone's
+    if isinstance(val, str):
+        return new + val[len(old):] if val == old or val.startswith(old + os.sep) else val
+    if isinstance(val, list):
+        return [_rebase(v, old, new) for v in val]
+    if isinstance(val, dict):
+        return {_rebase(k, old, new): _rebase(v, old, new) for k, v in val.items()}
+    return val
+
+def clone_project(project_id: str, project_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    New project sharing the files of an existing one: input workbook, books, results, graphs
+    and the pipeline's cached stages (outputs/pipeline), so runs of the clone reuse the parent's
+    books and results until its inputs change. Files are shared with share_file; writers call
+    unshare before changing a file in place, so a file only takes space in both projects once
+    it differs. Pipeline entries are rewritten for the clone's paths; runs, status and
+    checkpoints are not carried over.
+    :return: {"project_id", "parent_id", "files", "shared_bytes", "copied_bytes", "methods": {method: count}}.
+    """
+    from variables import load_variables, save_variables
+    src = project_path(project_id)
+    if not src.is_dir():
+        raise FileNotFoundError(project_id)
+    parent = next((p for p in load_projects_index().get("projects", []) if p.get("project_id") == project_id), {})
+    vars_ = load_variables(project_id) or {}
+    name = project_name or f"{vars_.get('project_name') or parent.get('project_name') or project_id} (copy)"
+    pid = create_project_folder(project_name=name)
+    dst = project_path(pid)
+    old_root, new_root = str(src.resolve()), str(dst.resolve())
+
+    methods: Dict[str, int] = {}
+    shared = copied = 0
+    for f in sorted(src.rglob("*")):
+        rel = f.relative_to(src).as_posix()
+        if not f.is_file() or rel == "variables.json" or f.name.endswith((".tmp", ".lock")) \
+                or any(rel == ex or rel.startswith(ex + "/") for ex in CLONE_EXCLUDE):
+            continue
+        target = dst / rel
+        if rel.startswith("outputs/pipeline/") and f.suffix == ".json":
+            # stage entries name the parent's files; keep their file stats (a shared file has the same mtime and size)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            data = _rebase(json.loads(f.read_text(encoding="utf-8")), old_root, new_root)
+            target.write_text(json.dumps(data), encoding="utf-8")
+            copied += target.stat().st_size
+            continue
+        method = share_file(f, target)
+        methods[method] = methods.get(method, 0) + 1
+        if method == "copy":
+            copied += f.stat().st_size
+        else:
+            shared += f.stat().st_size
+
+    vars_["project_name"] = name
+    save_variables(pid, vars_)
+    add_project_to_index({**parent, "project_id": pid, "project_name": name,
+                          "books_path": str((dst / "books").resolve()), "created_at": datetime.utcnow().isoformat() + "Z",
+                          "has_outputs": (dst / "outputs").exists(), "parent_id": project_id})
+    return {"project_id": pid, "parent_id": project_id, "project_name": name, "files": sum(methods.values()),
+            "shared_bytes": shared, "copied_bytes": copied, "methods": methods}
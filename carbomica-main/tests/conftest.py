@@ -0,0 +1,42 @@
+"""
+Shared fixtures. The engine keeps projects/ (and uploads/, runs) relative to the working directory
+and books.py reads templates/ from it, so the whole session runs in a scratch directory that links
+to the repo's templates.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+WORKDIR = Path(tempfile.mkdtemp(prefix="carbomica-tests-"))
+(WORKDIR / "templates").symlink_to(ROOT / "templates")
+os.chdir(WORKDIR)
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    import engine_api
+    return TestClient(engine_api.app)
+
+
+def create_project(client, name: str = "test") -> str:
+    with open(ROOT / "input_data_example.xlsx", "rb") as f:
+        r = client.post("/projects", files={"file": ("input_data.xlsx", f)}, data={"project_name": name, "start_year": "2024"})
+    assert r.status_code == 200, r.text
+    return r.json()["project_id"]
+
+
+@pytest.fixture(scope="session")
+def project_id(client):
+    return create_project(client)
+
+
+@pytest.fixture(scope="session")
+def ctx(project_id):
+    import run_main
+    return run_main.project_context(str((Path("projects") / project_id).resolve()))
@@ -0,0 +1,61 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import broker as brokers
+import engine_api
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture
+def sqlite_broker(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'broker.db'}"
+    b = brokers.open_broker(url)
+    monkeypatch.setattr(engine_api, "_broker", b)
+    return url, b
+
+
+@pytest.fixture
+def broker_worker(sqlite_broker, tmp_path):
+    url, _ = sqlite_broker
+    proc = subprocess.Popen([sys.executable, str(ROOT / "worker.py"), "--broker", url, "--work-dir", str(tmp_path / "work"), "--poll", "0.05"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+def _run(project_id, run_id):
+    return engine_api._call_engine_broker(project_id, engine_api._resolve_input(project_id), "baseline", {}, run_id)
+
+
+def test_cached_run_uploads_its_artifacts(project_id, sqlite_broker, broker_worker):
+    _, b = sqlite_broker
+    ok, info = _run(project_id, "broker-1")
+    assert ok, info
+    artifacts = [a["path"] for a in info["artifacts"]]
+    assert artifacts
+    proj = Path("projects") / project_id
+    for rel in artifacts:
+        (proj / rel).unlink()
+
+    # the worker's pipeline serves the scenario from its cache and rewrites nothing, but the
+    # artifacts listed in the manifest still come back
+    ok, info = _run(project_id, "broker-2")
+    assert ok, info
+    assert {s["stage"]: s["status"] for s in info["pipeline"]}["scenario"] == "cached"
+    assert set(b.job("broker-2")["result"]["files"]) >= set(artifacts)
+    assert all((proj / rel).is_file() for rel in artifacts)
+
+
+def test_wait_times_out_and_cancels_the_job(project_id, sqlite_broker, monkeypatch):
+    _, b = sqlite_broker
+    monkeypatch.setattr(brokers, "WAIT_SECONDS", 0.2)
+    ok, info = _run(project_id, "broker-timeout")
+    assert not ok and "timed out" in info["error"]
+    assert b.job("broker-timeout")["status"] == "failed"
+    # a worker claiming the job late finds nothing to run
+    assert b.claim("late-worker") is None
@@ -0,0 +1,49 @@
+import io
+import json
+import os
+import zipfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _archive(*names):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name in names:
+            zf.write(ROOT / "input_data_example.xlsx", name)
+        zf.writestr("broken.xlsx", b"not a workbook")
+    return buf.getvalue()
+
+
+def _import(client, data, **form):
+    r = client.post("/projects/import", files={"file": ("hospitals.zip", data, "application/zip")}, data=form)
+    assert r.status_code == 200, r.text
+    return [json.loads(line) for line in r.text.splitlines() if line]
+
+
+def test_import_creates_projects_and_books(client):
+    events = _import(client, _archive("a/north.xlsx", "south.xlsx"), start_year="2025")
+    created = {e["file"]: e["project_id"] for e in events if e["event"] == "file" and e["status"] == "created"}
+    assert set(created) == {"a/north.xlsx", "south.xlsx"}
+    assert [e["file"] for e in events if e.get("status") == "invalid"] == ["broken.xlsx"]
+    books = [e for e in events if e["event"] == "books"]
+    assert sorted(e["project_id"] for e in books) == sorted(created.values())
+    assert all(e["status"] == "ok" for e in books), books
+    assert events[-1] == {**events[-1], "event": "done", "created": 2, "invalid": 1, "books_failed": 0}
+    listed = {p["project_id"] for p in client.get("/projects").json()["projects"]}
+    assert set(created.values()) <= listed
+
+
+def test_import_leaves_the_server_process_alone(client, monkeypatch):
+    # one worker used to generate books in the server process, changing its working directory
+    # and PROJECT_DIR while other requests ran
+    calls = []
+    real_chdir = os.chdir
+    monkeypatch.setattr(os, "chdir", lambda path: (calls.append(path), real_chdir(path)))
+    monkeypatch.setenv("PROJECT_DIR", "/elsewhere")
+    cwd = os.getcwd()
+    events = _import(client, _archive("single.xlsx"), workers="1")
+    assert [e["status"] for e in events if e["event"] == "books"] == ["ok"]
+    assert calls == []
+    assert os.getcwd() == cwd and os.environ["PROJECT_DIR"] == "/elsewhere"
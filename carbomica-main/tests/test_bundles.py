@@ -0,0 +1,78 @@
+import io
+import zipfile
+from pathlib import Path
+
+import pytest
+
+import bundles
+from storage import load_projects_index
+from variables import load_variables
+
+FORMATS = ["zip", pytest.param("tar.zst", marks=pytest.mark.skipif(bundles.zstandard is None, reason="needs zstandard"))]
+
+
+def _export(client, project_id, fmt="zip"):
+    r = client.get(f"/projects/{project_id}/export", params={"format": fmt})
+    assert r.status_code == 200, r.text
+    return r.content
+
+
+def _import(client, data):
+    return client.post("/projects/import-bundle", files={"file": ("bundle", data)}, data={"project_name": "imported"})
+
+
+def _project_ids():
+    return {p["project_id"] for p in load_projects_index().get("projects", [])}
+
+
+def _files(proj: Path):
+    return {f.relative_to(proj).as_posix(): f.read_bytes() for f in proj.rglob("*")
+            if f.is_file() and f.relative_to(proj).parts[0] not in ("outputs", "runs", "variables.json")}
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_export_import_round_trip(client, project_id, fmt):
+    r = _import(client, _export(client, project_id, fmt))
+    assert r.status_code == 200, r.text
+    info = r.json()
+    assert info["source_id"] == project_id and info["format"] == fmt
+    src, dst = Path("projects") / project_id, Path("projects") / info["project_id"]
+    assert _files(dst) == _files(src)
+    assert info["project_id"] in _project_ids()
+    assert load_variables(info["project_id"])["project_name"] == "imported"
+
+
+def test_altered_bundle_is_rejected(client, project_id):
+    src = zipfile.ZipFile(io.BytesIO(_export(client, project_id)))
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w") as zf:
+        for m in src.infolist():
+            data = src.read(m)
+            if m.filename == "input_data.xlsx":
+                data = data[:-1] + bytes([data[-1] ^ 1])  # same size, different content
+            zf.writestr(m.filename, data)
+    before, folders = _project_ids(), set(Path("projects").iterdir())
+    r = _import(client, out.getvalue())
+    assert r.status_code == 400 and "content hash mismatch" in r.json()["detail"]
+    assert _project_ids() == before and set(Path("projects").iterdir()) == folders
+
+
+def test_bundle_member_paths_stay_inside_the_project(client):
+    assert bundles._member_path("books/a.xlsx") == "books/a.xlsx"
+    for name in ("", "/etc/passwd", "../x", "books/../../x", "books\\..\\x", "books//a", "./a"):
+        with pytest.raises(ValueError):
+            bundles._member_path(name)
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w") as zf:
+        zf.writestr("../escaped.txt", b"x")
+        zf.writestr(bundles.BUNDLE_MANIFEST, b"{}")
+    r = _import(client, out.getvalue())
+    assert r.status_code == 400 and "unsafe path" in r.json()["detail"]
+    assert not Path("projects/escaped.txt").exists()
+
+
+@pytest.mark.parametrize("project_id", ["%2E%2E", ".", "%2E%2E%2Fprojects"])
+def test_export_rejects_ids_outside_projects(client, project_id):
+    assert client.get(f"/projects/{project_id}/export").status_code == 404
+    with pytest.raises(FileNotFoundError):
+        bundles.bundle_files("..")
@@ -0,0 +1,36 @@
+from pathlib import Path
+
+import checkpoints
+import engine_api
+from runs import save_run, load_run
+
+
+def _inputs(project_id):
+    proj = Path("projects") / project_id
+    return proj, proj / "input_data.xlsx"
+
+
+def test_force_does_not_change_the_key(project_id):
+    proj, inp = _inputs(project_id)
+    key = checkpoints.checkpoint_key(inp, proj, "optimization", {"budgets": [20000]})
+    assert checkpoints.checkpoint_key(inp, proj, "optimization", {"budgets": [20000], "force": True, "profile": "cprofile"}) == key
+    assert checkpoints.checkpoint_key(inp, proj, "optimization", {"budgets": [50000]}) != key
+
+
+def test_requeued_forced_run_resumes(project_id, monkeypatch):
+    proj, inp = _inputs(project_id)
+    opts = {"budgets": [20000], "force": True}
+    ckpt = checkpoints.Checkpoint.for_run(proj, inp, "optimization", opts)
+    ckpt.save_budget(20000, {"a": 1.0}, {"total": 1.0})
+    try:
+        save_run(project_id, {"run_id": "forced-run", "project_id": project_id, "scenario": "optimization",
+                              "options": {"budgets": [20000]}, "force": True, "status": "running"})
+        submitted = []
+        monkeypatch.setattr(engine_api._scheduler, "submit", lambda run_id, pid, est, fn, *args: submitted.append(args))
+        engine_api._resume_runs()
+        (_, scenario, options, run_id), = [a for a in submitted if a[3] == "forced-run"]
+        assert options["force"] is True
+        assert load_run(project_id, "forced-run")["status"] == "queued"
+        assert checkpoints.Checkpoint.for_run(proj, inp, scenario, options).resumed
+    finally:
+        ckpt.remove()
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+import atomica as at
+import evaluator
+
+
+def test_validates_to_tolerance(ctx):
+    model = evaluator.compile_model(ctx["P"], ctx["progset"], ctx["start_year"], ctx["facility_code"])
+    report = model.validate(ctx["P"], n_samples=5)
+    assert report["passed"], report
+    assert report["max_rel_error"] <= evaluator.DEFAULT_RTOL
+
+
+def _covout(progs, imp_interaction=None):
+    return at.Covout("x_mult", "pop", progs, cov_interaction="random", imp_interaction=imp_interaction, baseline=0.0)
+
+
+def test_mixed_sign_pairs_match_covout():
+    covout = _covout({"a": 0.3, "b": -0.5, "c": 0.1})
+    pairs = sorted(covout.progs.items(), key=lambda x: -abs(x[1]))
+    evaluator._check_pairs(covout, pairs, "x_mult")
+    # the closed form against Atomica's combination outcomes for one coverage point
+    cov = {"a": 0.4, "b": 0.7, "c": 0.2}
+    d = np.array([v for _, v in pairs])
+    c = np.array([cov[p] for p, _ in pairs])
+    closed = float((d * c * np.concatenate([[1.0], np.cumprod(1 - c)[:-1]])).sum())
+    assert np.isclose(closed, covout.get_outcome({p: np.array([v]) for p, v in cov.items()}))
+
+
+def test_explicit_interaction_is_rejected():
+    covout = _covout({"a": 0.3, "b": 0.5}, imp_interaction="a+b=0.7")
+    pairs = sorted(covout.progs.items(), key=lambda x: -abs(x[1]))
+    with pytest.raises(ValueError):
+        evaluator._check_pairs(covout, pairs, "x_mult")
@@ -0,0 +1,37 @@
+from pathlib import Path
+
+import optima
+
+
+def _snapshot(value):
+    return {"variables": "v", "sheets": {"interventions": [["name"], ["a"]], "costs": [["cost", value], ["x", 1.0]]}}
+
+
+def test_unchanged_inputs_are_not_a_small_change():
+    change = optima.compare(_snapshot(10.0), _snapshot(10.0))
+    assert change["unchanged"] and not change["small"]
+    assert optima.compare(_snapshot(10.0), _snapshot(12.0))["small"]
+
+
+def _stored(project_dir, snapshot):
+    path = Path(project_dir) / "outputs" / optima.OPTIMA_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    plan = {"snapshot": snapshot, "change": None, "previous": {}}
+    optima.record(project_dir, plan, {20000.0: {"allocation": {"a": 20000.0}, "total": 5.0}})
+
+
+def test_warm_start_only_after_a_small_change(tmp_path, monkeypatch):
+    snapshots = iter([_snapshot(10.0), _snapshot(12.0), _snapshot(12.0)])
+    monkeypatch.setattr(optima, "sheet_snapshot", lambda *args: next(snapshots))
+    _stored(tmp_path, _snapshot(10.0))
+    assert optima.plan(tmp_path, "input.xlsx", [20000.0])["warm_start"] == {}
+    assert optima.plan(tmp_path, "input.xlsx", [20000.0])["warm_start"] == {20000.0: {"a": 20000.0}}
+    assert optima.plan(tmp_path, "input.xlsx", [20000.0], warm=False)["warm_start"] == {}
+
+
+def test_unchanged_rerun_keeps_stored_budgets(tmp_path):
+    _stored(tmp_path, _snapshot(10.0))
+    plan = {"snapshot": _snapshot(10.0), "change": optima.compare(_snapshot(10.0), _snapshot(10.0)),
+            "previous": optima.load(tmp_path)["budgets"], "warm_start": {}}
+    optima.record(tmp_path, plan, {50000.0: {"allocation": {"a": 50000.0}, "total": 4.0}})
+    assert set(optima.load(tmp_path)["budgets"]) == {repr(20000.0), repr(50000.0)}
@@ -0,0 +1,75 @@
+from pathlib import Path
+
+import pandas as pd
+
+import run_main
+import scenarios
+from conftest import ROOT, create_project
+
+FAST_PSO = {"pso_maxiter": 1, "pso_swarmsize": 4, "asd_maxiters": 5, "seed": 1}
+
+
+def _optimise(project_id, **opts):
+    proj = (Path("projects") / project_id).resolve()
+    return run_main.run_project(str(proj / "input_data.xlsx"), str(proj / "outputs"), "optimization",
+                                {"budgets": [20000], "force": True, "incremental": False, **opts})
+
+
+def test_atomica_does_not_compile_the_model(project_id, monkeypatch):
+    def refuse(*args, **kwargs):
+        raise ValueError("unsupported coverage interaction")
+    monkeypatch.setattr(scenarios, "compiled_model", refuse)
+    r = _optimise(project_id, method="atomica", optimiser=FAST_PSO)
+    assert r["status"] == "ok", r.get("error")
+    info = r["results"]["optimisation"]["$20,000"]
+    assert "greedy_total" not in info
+
+
+def test_fast_still_needs_the_model(project_id, monkeypatch):
+    def refuse(*args, **kwargs):
+        raise ValueError("unsupported coverage interaction")
+    monkeypatch.setattr(scenarios, "compiled_model", refuse)
+    r = _optimise(project_id, method="fast")
+    assert r["status"] != "ok"
+
+
+def test_greedy_reports_gap(project_id):
+    r = _optimise(project_id, method="greedy")
+    assert r["status"] == "ok", r.get("error")
+    assert "greedy_gap" in r["results"]["optimisation"]["$20,000"]
+
+
+def test_pso_starts_in_worker_processes(project_id):
+    r = _optimise(project_id, method="atomica", optimiser={**FAST_PSO, "pso_starts": 2, "pso_workers": 2})
+    assert r["status"] == "ok", r.get("error")
+    assert [run["seed"] for run in r["results"]["optimisation"]["$20,000"]["pso_starts"]] in ([1, 2], [2, 1])
+
+
+def test_explicit_pso_settings_skip_the_warm_start(project_id, monkeypatch):
+    import optima
+    calls = []
+    plan = optima.plan
+    monkeypatch.setattr(optima, "plan", lambda *args, **kwargs: calls.append(kwargs.get("warm", True)) or plan(*args, **kwargs))
+    assert _optimise(project_id, method="atomica", optimiser=FAST_PSO, incremental=True)["status"] == "ok"
+    assert _optimise(project_id, method="atomica", optimiser={"asd_maxiters": 5}, greedy_start=True, incremental=True)["status"] == "ok"
+    assert _optimise(project_id, method="atomica", optimiser={"asd_maxiters": 5}, incremental=True)["status"] == "ok"
+    assert calls == [False, False, True]
+
+
+def test_sheet_edit_warm_starts_the_next_optimisation(client):
+    pid = create_project(client, "warm start")
+    opts = {"method": "atomica", "optimiser": {"asd_maxiters": 5}, "incremental": True, "force": False}
+    first = _optimise(pid, **opts)
+    assert first["status"] == "ok", first.get("error")
+
+    df = pd.read_excel(ROOT / "input_data_example.xlsx", sheet_name="effect sizes")
+    df.iloc[0, 1] = float(df.iloc[0, 1]) * 0.9
+    r = client.put(f"/projects/{pid}/sheet", json={"sheet": "effect sizes", "rows": df.to_dict(orient="records"),
+                                                   "columns": list(df.columns)})
+    assert r.status_code == 200 and r.json()["wrote_to_input"], r.text
+
+    second = _optimise(pid, **opts)
+    assert second["status"] == "ok", second.get("error")
+    incremental = second["results"]["incremental"]
+    assert incremental["change"]["small"], incremental["change"]
+    assert incremental["warm_started"] == [20000.0]
@@ -0,0 +1,41 @@
+import pytest
+
+from pipeline import Pipeline, Stage
+
+
+def _pipeline(tmp_path, calls, fail=False):
+    def run_b(a):
+        calls.append("b")
+        if fail:
+            raise RuntimeError("boom")
+        return a + 1
+
+    def run_a():
+        calls.append("a")
+        return 1
+
+    stages = [Stage("a", {"x": 1}, run_a, store="disk"), Stage("b", {"fail": fail}, run_b, deps=["a"], store="disk"),
+              Stage("c", {}, lambda b: b * 2, deps=["b"])]
+    return Pipeline(stages, disk_dir=tmp_path)
+
+
+def test_cached_stage_skips_upstream(tmp_path):
+    calls = []
+    assert _pipeline(tmp_path, calls).output("c") == 4
+    pipe = _pipeline(tmp_path, calls)
+    assert pipe.output("c") == 4
+    assert calls == ["a", "b"]
+    assert [(s["stage"], s["status"]) for s in pipe.plan()] == [("a", "skipped"), ("b", "cached"), ("c", "executed")]
+
+
+def test_failed_stage_is_reported(tmp_path):
+    calls = []
+    pipe = _pipeline(tmp_path, calls, fail=True)
+    with pytest.raises(RuntimeError):
+        pipe.output("c")
+    plan = {s["stage"]: s for s in pipe.plan()}
+    assert plan["a"]["status"] == "executed"
+    assert plan["b"]["status"] == "failed" and plan["b"]["error"] == "boom"
+    assert plan["c"]["status"] == "skipped"
+    # nothing was stored for the failed stage
+    assert not list(tmp_path.glob("b-*.json"))
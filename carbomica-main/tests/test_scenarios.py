@@ -0,0 +1,40 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import resultblocks as rb
+import scenarios
+
+
+def _segments():
+    return set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+
+
+@pytest.fixture
+def project_env(ctx, monkeypatch):
+    monkeypatch.setenv("PROJECT_DIR", str(Path(ctx["books_dir"]).parent))
+    monkeypatch.setattr(rb, "TRANSPORT", "shm")
+    return ctx
+
+
+def _coverage_runs(ctx):
+    programs = list(ctx["progset"].programs)
+    return [(p, {"coverage": {q: (1.0 if q == p else 0.0) for q in programs}}) for p in programs]
+
+
+def test_parallel_block_matches_serial(project_env):
+    ctx = project_env
+    args = (ctx["P"], ctx["progset"], ctx["start_year"], ctx["facility_code"], _coverage_runs(ctx))
+    with scenarios.simulate_block(*args, workers=1) as serial, scenarios.simulate_block(*args, workers=2) as parallel:
+        assert np.allclose(serial.values, parallel.values, equal_nan=True)
+
+
+def test_failed_simulation_releases_the_block(project_env):
+    ctx = project_env
+    before = _segments()
+    runs = _coverage_runs(ctx)[:1] + [("broken", {"no_such_instruction": 1.0})]
+    with pytest.raises(TypeError):
+        scenarios.simulate_block(ctx["P"], ctx["progset"], ctx["start_year"], ctx["facility_code"], runs, workers=2)
+    assert _segments() <= before
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import pandas as pd
+
+import run_main
+from conftest import ROOT, create_project
+
+
+def _run(project_id):
+    proj = (Path("projects") / project_id).resolve()
+    r = run_main.run_project(str(proj / "input_data.xlsx"), str(proj / "outputs"), "baseline", {})
+    assert r["status"] == "ok", r.get("error")
+    return {s["stage"]: s["status"] for s in r["pipeline"]}
+
+
+def _unit_cost(project_id, program):
+    ctx = run_main.project_context(str((Path("projects") / project_id).resolve()))
+    return ctx["progset"].programs[program].unit_cost.assumption
+
+
+def test_sheet_edit_reaches_the_next_run(client):
+    pid = create_project(client, "sheet edit")
+    _run(pid)
+    assert _unit_cost(pid, "SolarSystem_Installation") == 50000 / 5 + 5000
+
+    df = pd.read_excel(ROOT / "input_data_example.xlsx", sheet_name="implementation costs")
+    df.loc[0, "SolarSystem_Installation_cost"] = 25000
+    r = client.put(f"/projects/{pid}/sheet", json={"sheet": "implementation costs", "rows": df.to_dict(orient="records"),
+                                                   "columns": list(df.columns)})
+    assert r.status_code == 200 and r.json()["wrote_to_input"], r.text
+
+    # the books are regenerated from the edited workbook and the project rebuilt from them
+    assert _run(pid)["books"] == "executed"
+    assert _unit_cost(pid, "SolarSystem_Installation") == 25000 / 5 + 5000
+
+
+def test_generated_book_sheets_are_not_editable(client, project_id):
+    books = Path("projects") / project_id / "books"
+    before = {f.name: f.read_bytes() for f in books.glob("*.xlsx")}
+    r = client.put(f"/projects/{project_id}/sheet", json={"sheet": "Spending data", "rows": [{"a": 1}]})
+    assert r.status_code == 400 and "input workbook" in r.json()["detail"]
+    assert {f.name: f.read_bytes() for f in books.glob("*.xlsx")} == before
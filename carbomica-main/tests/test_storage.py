@@ -0,0 +1,50 @@
+import hashlib
+import io
+from pathlib import Path
+
+import storage
+
+
+def _digest(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def test_clone_edits_leave_the_parent_unchanged(client):
+    from conftest import create_project
+    parent_id = create_project(client, "parent")
+    r = client.post(f"/projects/{parent_id}/validate", json={"export": True})
+    assert r.status_code == 200, r.text
+    parent = Path("projects") / parent_id
+    exports = sorted((parent / "outputs" / "validation").glob("*.xlsx"))
+    assert exports
+    inp = parent / "input_data.xlsx"
+    before = {p: _digest(p) for p in exports + [inp]}
+
+    clone_id = client.post(f"/projects/{parent_id}/clone", json={}).json()["project_id"]
+    clone = Path("projects") / clone_id
+    assert not (clone / "outputs" / "validation").exists()
+    # even with the exports shared into the clone, its validation and a new upload rewrite its own copies
+    for p in exports:
+        storage.share_file(p, clone / "outputs" / "validation" / p.name)
+    r = client.post(f"/projects/{clone_id}/validate", json={"export": True})
+    assert r.status_code == 200, r.text
+    assert sorted(p.name for p in (clone / "outputs" / "validation").iterdir()) == [p.name for p in exports]
+
+    class Upload:
+        filename = "input_data.xlsx"
+        file = io.BytesIO(b"not the parent's workbook")
+    storage.save_input_file(clone_id, Upload())
+
+    assert {p: _digest(p) for p in before} == before
+    assert (clone / "input_data.xlsx").read_bytes() == b"not the parent's workbook"
+
+
+def test_concurrent_index_updates_keep_every_entry(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    monkeypatch.setattr(storage, "PROJECTS_DIR", tmp_path)
+    entries = [{"project_id": f"p{i}"} for i in range(40)]
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: storage.add_project_to_index(entries[i]) if i % 2 else storage.add_projects_to_index([entries[i]]),
+                      range(len(entries))))
+    assert sorted(p["project_id"] for p in storage.load_projects_index()["projects"]) == sorted(e["project_id"] for e in entries)
+    assert [f.name for f in tmp_path.iterdir()] == ["projects.json"]
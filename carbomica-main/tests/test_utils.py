@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import utils
+
+
+def test_file_lock_waits_for_holder(tmp_path):
+    lock = tmp_path / "x.lock"
+    order = []
+
+    def wait():
+        with utils._file_lock(lock):
+            order.append("waiter")
+
+    with utils._file_lock(lock):
+        t = threading.Thread(target=wait)
+        t.start()
+        time.sleep(0.1)
+        order.append("holder")
+    t.join(5)
+    assert order == ["holder", "waiter"]
+    assert not lock.exists()
+
+
+def test_file_lock_raises_for_live_holder(tmp_path):
+    lock = tmp_path / "x.lock"
+    with utils._file_lock(lock):
+        with pytest.raises(TimeoutError):
+            with utils._file_lock(lock, timeout=0.1):
+                pass
+        assert lock.exists()  # the failed call must not remove the holder's lock
+    assert not lock.exists()
+
+
+def test_file_lock_takes_over_from_dead_holder(tmp_path):
+    lock = tmp_path / "x.lock"
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True).stdout.strip()
+    lock.write_text(f"{dead} token")
+    with utils._file_lock(lock, timeout=0.1):
+        assert lock.read_text().startswith(f"{os.getpid()} ")
+    assert not lock.exists()
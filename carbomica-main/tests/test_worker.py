@@ -0,0 +1,40 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+ORPHAN = """
+import os, signal, sys, time
+sys.path.insert(0, {root!r})
+from worker import EngineWorker
+if __name__ == "__main__":
+    w = EngineWorker()
+    print(w.proc.pid, flush=True)
+    w.conn.send({{"op": "run", "input_path": {input!r}, "out_dir": {out!r}, "scenario": "optimization",
+                 "options": {{"budgets": [20000], "force": True, "optimiser": {{"pso_maxiter": 100000}}}}}})
+    w.conn.poll(10)  # the worker is busy optimising
+    os.kill(os.getpid(), signal.SIGKILL)  # no atexit, no shutdown_pool
+"""
+
+
+def _alive(pid: int) -> bool:
+    try:
+        return Path(f"/proc/{pid}/status").read_text().split("State:")[1].split()[0] not in ("Z", "X")
+    except (FileNotFoundError, IndexError):
+        return False
+
+
+def test_busy_worker_exits_with_killed_parent(project_id, tmp_path):
+    proj = (Path("projects") / project_id).resolve()
+    script = tmp_path / "orphan.py"
+    script.write_text(ORPHAN.format(root=str(ROOT), input=str(proj / "input_data.xlsx"), out=str(proj / "outputs")))
+    # the worker inherits stdout, so read the pid line rather than waiting for the pipe to close
+    parent = subprocess.Popen([sys.executable, str(script)], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    pid = int(parent.stdout.readline())
+    parent.wait(timeout=60)
+    deadline = time.monotonic() + 60
+    while _alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.5)
+    assert not _alive(pid)
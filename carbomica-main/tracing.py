@@ -0,0 +1,421 @@
+"""
+Lightweight tracing and metrics for engine runs.
+
+Engine code marks stages with context-manager spans:
+
+    with span("sims", result="Status-quo"):
+        P.run_sim(...)
+
+Spans are recorded on the active Trace (set up per run by trace_run) and are a no-op when no
+trace is active, so scripts can call scenario functions directly. A run's stage timings are the
+summed durations of the outermost span of each name; the standard stage names are
+books, project_load, validation, sims, optimisation, plotting and io.
+
+trace_run(profile=...) can also capture a per-run profile with cProfile (stdlib) or pyinstrument
+(if installed).
+
+Runs also measure the peak resident memory of the process while they execute (MemoryMeter),
+reported in the run manifest under `memory`.
+
+ConvergenceTrace records the best objective value of an optimiser as it improves and can end
+the optimisation early (StopOptimisation) on a deadline or when the objective stalls.
+
+The Metrics registry aggregates finished runs into Prometheus text exposition format for the
+API's /metrics endpoint.
+"""
+import io
+import os
+import threading
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
+
+STAGES = ("books", "project_load", "validation", "sims", "optimisation", "plotting", "io")
+
+_current = contextvars.ContextVar("carbomica_trace", default=None)
+
+
+class Trace:
+    """
+    Spans recorded during one run. Span start offsets are seconds from the start of the trace.
+    """
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self._stack: List[Dict[str, Any]] = []
+        self.profile_text: Optional[str] = None
+        self.memory: Dict[str, Any] = {}
+
+    def stage_timings(self) -> Dict[str, float]:
+        # outermost span of each name only, so nested spans of the same name are not double counted
+        out: Dict[str, float] = {}
+        for s in self.spans:
+            if not s.get("nested"):
+                out[s["name"]] = out.get(s["name"], 0.0) + s["duration"]
+        return out
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return [{k: v for k, v in s.items() if k != "nested"} for s in self.spans]
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Record the wall time of the block as a span on the active trace (no-op without one).
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    rec = {"name": name, "start": time.perf_counter() - trace.t0, "duration": 0.0}
+    if attrs:
+        rec["attrs"] = attrs
+    if trace._stack:
+        rec["parent"] = trace._stack[-1]["name"]
+    if any(s["name"] == name for s in trace._stack):
+        rec["nested"] = True
+    trace.spans.append(rec)
+    trace._stack.append(rec)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        rec["duration"] = time.perf_counter() - t0
+        trace._stack.pop()
+
+
+@contextmanager
+def _profiler(kind: Optional[str], trace: Trace):
+    if not kind:
+        yield
+        return
+    if kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            kind = "cprofile"  # optional dependency; fall back to the stdlib profiler
+        else:
+            prof = Profiler()
+            prof.start()
+            try:
+                yield
+            finally:
+                prof.stop()
+                trace.profile_text = prof.output_text(unicode=True, color=False)
+            return
+    import cProfile
+    import pstats
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        buf = io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(60)
+        trace.profile_text = buf.getvalue()
+
+
+@contextmanager
+def trace_run(profile: Optional[str] = None):
+    """
+    Activate a new Trace for the duration of the block and yield it.
+    :param profile: None, 'cprofile' or 'pyinstrument' to capture a profile into trace.profile_text.
+    """
+    trace = Trace()
+    token = _current.set(trace)
+    meter = MemoryMeter()
+    try:
+        with _profiler(profile, trace):
+            yield trace
+    finally:
+        trace.memory = meter.stop()
+        _current.reset(token)
+
+
+# ---------- Memory ----------
+
+RSS_SAMPLE_SECONDS = float(os.environ.get("CARBOMICA_RSS_SAMPLE_SECONDS", "0.05"))
+
+_meters_lock = threading.Lock()
+_hwm_meter = None  # the meter that reset the kernel's high-water mark, while it runs
+
+
+def _status_mb(field: str) -> Optional[float]:
+    # VmRSS / VmHWM of /proc/self/status (Linux only)
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def rss_mb() -> Optional[float]:
+    """
+    Current resident memory of this process in MiB (None when it cannot be read).
+    """
+    val = _status_mb("VmRSS")
+    if val is None:
+        try:
+            import psutil
+            val = psutil.Process().memory_info().rss / 2**20
+        except Exception:
+            return None
+    return val
+
+
+def _children_peak_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # largest peak of the child processes waited for so far (worker pools of the run), KiB on Linux
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def _reset_hwm() -> bool:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return _status_mb("VmHWM") is not None
+
+
+class MemoryMeter:
+    """
+    Peak resident memory of the process from construction until stop().
+
+    On Linux the first meter resets the kernel's high-water mark (VmHWM) and reads it back at
+    the end, which catches every peak. A meter started while another one runs (concurrent runs in
+    one process), or where the mark cannot be reset, samples the RSS every RSS_SAMPLE_SECONDS
+    instead. Memory is per process, so concurrent runs see each other's allocations.
+    """
+
+    def __init__(self):
+        global _hwm_meter
+        self.start_mb = rss_mb()
+        self._children_mb = _children_peak_mb()
+        self._peak = self.start_mb
+        self._thread = None
+        with _meters_lock:
+            if _hwm_meter is None and _reset_hwm():
+                _hwm_meter = self
+                self.method = "hwm"
+                return
+        self.method = "sampled"
+        if self.start_mb is not None:
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._sample, name="carbomica-rss", daemon=True)
+            self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self._peak = max(self._peak, rss_mb() or 0.0)
+
+    def stop(self) -> Dict[str, Any]:
+        """
+        {"peak_rss_mb", "rss_start_mb", "rss_end_mb", "method": "hwm"|"sampled", "children_peak_rss_mb"?}
+        (MiB; empty when memory cannot be read). children_peak_rss_mb is the peak of the largest
+        worker process the run started, when it exceeds those of earlier runs.
+        """
+        global _hwm_meter
+        end = rss_mb()
+        if self.method == "hwm":
+            with _meters_lock:
+                _hwm_meter = None
+            peak = _status_mb("VmHWM")
+        else:
+            if self._thread is not None:
+                self._stop.set()
+                self._thread.join()
+            peak = max(self._peak, end) if self._peak is not None and end is not None else None
+        if peak is None:
+            return {}
+        out = {"peak_rss_mb": round(peak, 1), "rss_start_mb": round(self.start_mb, 1), "rss_end_mb": round(end, 1), "method": self.method}
+        children = _children_peak_mb()
+        if children is not None and children > (self._children_mb or 0.0):
+            out["children_peak_rss_mb"] = round(children, 1)
+        return out
+
+
+# ---------- Optimiser convergence ----------
+
+class StopOptimisation(Exception):
+    """
+    Raised from an objective function to end an optimisation early (time limit or stalled objective).
+    """
+
+
+class ConvergenceTrace:
+    """
+    Best-so-far objective of one optimisation, recorded each time it improves.
+    :param deadline: time.perf_counter() value after which the optimisation is stopped.
+    :param reltol: An improvement smaller than this fraction of the best value counts as a stall.
+    :param stall_evals: Stop after this many evaluations without a (reltol) improvement.
+    :param on_best: Called as on_best(best, payload) after an improvement, at most every `every` seconds.
+    """
+
+    MAX_POINTS = 200
+
+    def __init__(self, deadline: Optional[float] = None, reltol: Optional[float] = None, stall_evals: Optional[int] = None,
+                 on_best=None, every: float = 0.0):
+        self.t0 = time.perf_counter()
+        self.on_best = on_best
+        self.every = every
+        self._last_saved = self.t0
+        self.deadline = deadline
+        self.reltol = reltol
+        self.stall_evals = stall_evals
+        self.evaluations = 0
+        self.best = float("inf")
+        self.best_payload = None
+        self.points: List[List[float]] = []  # [evaluations, seconds, best]
+        self.stopped: Optional[str] = None
+        self._stalled = 0
+
+    def record(self, value: float, payload=None):
+        """
+        Record one objective evaluation. `payload` (or a callable returning it) is kept for the best value.
+        Raises StopOptimisation when the deadline has passed or the objective has stalled.
+        """
+        self.evaluations += 1
+        if value < self.best:
+            significant = self.reltol is None or not self.points or (self.best - value) > self.reltol * abs(self.best)
+            self.best = float(value)
+            self.best_payload = payload() if callable(payload) else payload
+            self.points.append([self.evaluations, round(time.perf_counter() - self.t0, 4), self.best])
+            self._stalled = 0 if significant else self._stalled + 1
+            if self.on_best is not None and time.perf_counter() - self._last_saved >= self.every:
+                self._last_saved = time.perf_counter()
+                self.on_best(self.best, self.best_payload)
+        else:
+            self._stalled += 1
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            self.stopped = "time"
+            raise StopOptimisation(self.stopped)
+        if self.stall_evals and self._stalled >= self.stall_evals:
+            self.stopped = "stall"
+            raise StopOptimisation(self.stopped)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "evaluations": self.evaluations,
+            "seconds": time.perf_counter() - self.t0,
+            "best": self.best,
+            "stopped": self.stopped,
+            "points": self._thinned_points(),
+        }
+
+    def _thinned_points(self) -> List[List[float]]:
+        # long ASD runs improve thousands of times; keep an evenly spaced subset plus the final point
+        if len(self.points) <= self.MAX_POINTS:
+            return self.points
+        step = len(self.points) / (self.MAX_POINTS - 1)
+        return [self.points[int(i * step)] for i in range(self.MAX_POINTS - 1)] + [self.points[-1]]
+
+
+# ---------- Metrics ----------
+
+_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+_MB_BUCKETS = (128.0, 256.0, 512.0, 1024.0, 2048.0, 4096.0, 8192.0, 16384.0)
+
+
+def _labels(d: Dict[str, str]) -> str:
+    if not d:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in sorted(d.items()))
+    return "{" + body + "}"
+
+
+class Metrics:
+    """
+    Thread-safe in-process registry of counters and histograms, rendered in Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[tuple, float] = {}
+        self._hists: Dict[tuple, Dict[str, Any]] = {}
+        self._help: Dict[str, tuple] = {}
+
+    def _key(self, name, labels):
+        return (name, tuple(sorted((labels or {}).items())))
+
+    def inc(self, name: str, labels: Optional[Dict[str, str]] = None, value: float = 1.0, help: str = ""):
+        with self._lock:
+            self._help.setdefault(name, ("counter", help))
+            k = self._key(name, labels)
+            self._counters[k] = self._counters.get(k, 0.0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None, help: str = "", buckets: tuple = _BUCKETS):
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help))
+            k = self._key(name, labels)
+            h = self._hists.get(k)
+            if h is None:
+                h = self._hists[k] = {"le": buckets, "buckets": [0] * len(buckets), "count": 0, "sum": 0.0}
+            for i, b in enumerate(h["le"]):
+                if value <= b:
+                    h["buckets"][i] += 1
+            h["count"] += 1
+            h["sum"] += value
+
+    def observe_run(self, record: Dict[str, Any]):
+        """
+        Fold a finished run record (status, scenario, timings, memory) into the registry.
+        """
+        scenario = str(record.get("scenario") or "unknown")
+        self.inc("carbomica_runs_total", {"scenario": scenario, "status": str(record.get("status"))}, help="Engine runs by scenario and final status")
+        timings = record.get("timings") or {}
+        if "total" in timings:
+            self.observe("carbomica_run_seconds", float(timings["total"]), {"scenario": scenario}, help="Wall time of engine runs")
+        for stage, secs in timings.items():
+            if stage != "total":
+                self.observe("carbomica_stage_seconds", float(secs), {"stage": stage, "scenario": scenario}, help="Wall time per engine stage within a run")
+        memory = record.get("memory") or {}
+        if "peak_rss_mb" in memory:
+            self.observe("carbomica_run_peak_rss_mb", float(memory["peak_rss_mb"]), {"scenario": scenario},
+                         help="Peak resident memory (MiB) of the engine process during runs", buckets=_MB_BUCKETS)
+
+    def render(self, gauges: Optional[Dict[str, Dict[tuple, float]]] = None) -> str:
+        """
+        Prometheus text exposition. `gauges` maps metric name -> {label tuple: value} for point-in-time values.
+        """
+        lines = []
+        with self._lock:
+            names = sorted({k[0] for k in self._counters} | {k[0] for k in self._hists})
+            for name in names:
+                kind, help_ = self._help.get(name, ("untyped", ""))
+                if help_:
+                    lines.append(f"# HELP {name} {help_}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (n, labels), v in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{_labels(dict(labels))} {v}")
+                for (n, labels), h in sorted(self._hists.items()):
+                    if n != name:
+                        continue
+                    base = dict(labels)
+                    for b, c in zip(h["le"], h["buckets"]):
+                        lines.append(f"{name}_bucket{_labels({**base, 'le': repr(b)})} {c}")
+                    lines.append(f"{name}_bucket{_labels({**base, 'le': '+Inf'})} {h['count']}")
+                    lines.append(f"{name}_sum{_labels(base)} {h['sum']}")
+                    lines.append(f"{name}_count{_labels(base)} {h['count']}")
+        for name, values in (gauges or {}).items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, v in sorted(values.items()):
+                lines.append(f"{name}{_labels(dict(labels))} {v}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
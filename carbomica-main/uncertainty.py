@@ -0,0 +1,351 @@
+"""
+Monte Carlo uncertainty analysis over effect sizes and costs.
+
+The `effect sizes`, `implementation costs` and `maintenance costs` sheets are point estimates.
+run_uncertainty draws N samples of them from user-supplied ranges and evaluates, for every sample,
+the coverage scenarios (status quo, all interventions, each intervention at full coverage) and the
+point-estimate optimal allocation of each budget on the compiled evaluator.py model; with
+reoptimise it also re-optimises every budget for each sample.
+
+Ranges are given per input as a relative spread (0.2: +/-20% around the workbook value) or as
+{program: [low, high]} in workbook units, with an optional "default" spread for the other programs:
+
+    {"samples": 2000, "effects": 0.2, "implementation_costs": {"INT1": [4000, 9000], "default": 0.1}}
+
+Samples run in batches (in parallel for large runs) and only fixed-bin histograms are kept, so
+memory does not grow with N; percentiles are read from the histograms, to within
+(range / HIST_BINS) of the exact sample percentiles.
+"""
+import os
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+from typing import Optional, Dict, Any, List
+
+import numpy as np
+
+import evaluator as ev
+from utils import process_pool, worker_state
+
+INPUTS = ("effects", "implementation_costs", "maintenance_costs")
+DISTRIBUTIONS = ("uniform", "triangular")
+PERCENTILES = (5, 25, 50, 75, 95)
+HIST_BINS = 2048
+DEFAULT_UNCERTAINTY = {
+    'samples': 1000,          # Monte Carlo samples
+    'effects': 0.0,           # spread or {program: [low, high]} for each input
+    'implementation_costs': 0.0,
+    'maintenance_costs': 0.0,
+    'distribution': 'uniform',  # or 'triangular' (mode at the workbook value)
+    'reoptimise': False,      # re-optimise every budget for each sample
+    'method': 'fast',         # optimiser for the allocations: 'fast' or 'greedy'
+    'seed': 0,
+    'batch_size': 250,        # samples per batch (one histogram update each)
+    'workers': None,          # processes (default: automatic)
+}
+# spawning workers costs a numpy import each, so evaluation-only runs stay serial below this
+PARALLEL_MIN_SAMPLES = 20000
+
+
+def uncertainty_settings(settings=None) -> Dict[str, Any]:
+    '''
+    Merge user settings over DEFAULT_UNCERTAINTY.
+    Raises ValueError for unknown keys or invalid values.
+    '''
+    out = dict(DEFAULT_UNCERTAINTY)
+    for key, val in (settings or {}).items():
+        if key not in out:
+            raise ValueError(f"unknown uncertainty setting: {key!r}")
+        if val is not None:
+            out[key] = val
+    try:
+        out['samples'] = int(out['samples'])
+        out['batch_size'] = int(out['batch_size'])
+        out['seed'] = int(out['seed'])
+        out['workers'] = None if out['workers'] is None else int(out['workers'])
+    except (TypeError, ValueError):
+        raise ValueError("uncertainty settings samples, batch_size, seed and workers must be integers")
+    if out['samples'] < 1 or out['batch_size'] < 1:
+        raise ValueError("uncertainty samples and batch_size must be positive")
+    if out['distribution'] not in DISTRIBUTIONS:
+        raise ValueError(f"uncertainty distribution must be one of {DISTRIBUTIONS}")
+    if out['method'] not in ('fast', 'greedy'):
+        raise ValueError("uncertainty method must be 'fast' or 'greedy'")
+    out['reoptimise'] = bool(out['reoptimise'])
+    return out
+
+
+def input_ranges(spec, programs: List[str], point: Dict[str, float]) -> np.ndarray:
+    '''
+    Sampling range of one input as factors on the workbook values, shape (2, n_programs).
+    :param spec: Relative spread (number) or {program: [low, high], "default": spread}.
+    :param point: Workbook value per program (the units of [low, high]).
+    '''
+    if not isinstance(spec, dict):
+        spec = {"default": spec}
+    unknown = set(spec) - set(programs) - {"default"}
+    if unknown:
+        raise ValueError(f"unknown interventions in uncertainty ranges: {sorted(unknown)}")
+    try:
+        spread = float(spec.get("default") or 0.0)
+    except (TypeError, ValueError):
+        raise ValueError("uncertainty spread must be a number")
+    if spread < 0:
+        raise ValueError("uncertainty spread must not be negative")
+    lo, hi = np.full(len(programs), 1.0 - spread), np.full(len(programs), 1.0 + spread)
+    for i, prog in enumerate(programs):
+        if prog not in spec:
+            continue
+        try:
+            low, high = (float(v) for v in spec[prog])
+        except (TypeError, ValueError):
+            raise ValueError(f"uncertainty range for {prog!r} must be [low, high]")
+        if low > high:
+            raise ValueError(f"uncertainty range for {prog!r} has low > high")
+        if point[prog]:
+            lo[i], hi[i] = sorted((low / point[prog], high / point[prog]))
+        else:
+            lo[i] = hi[i] = 1.0  # no workbook value to scale
+    return np.stack([lo, hi])
+
+
+def sample_factors(rng, ranges: np.ndarray, n: int, distribution: str = 'uniform') -> np.ndarray:
+    '''
+    Draw (n, n_programs) factors within ranges (see input_ranges); triangular has its mode at 1.
+    '''
+    lo, hi = ranges
+    width = hi - lo
+    u = rng.random((n, len(lo)))
+    if distribution == 'uniform':
+        return lo + u * width
+    mode = np.clip(1.0, lo, hi)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        left = np.where(width > 0, (mode - lo) / width, 0.0)
+        below = lo + np.sqrt(u * width * (mode - lo))
+        above = hi - np.sqrt((1.0 - u) * width * (hi - mode))
+    return np.where(u < left, below, above)
+
+
+class StreamingPercentiles:
+    '''
+    Fixed-bin histograms of an array-valued quantity, updated one batch of samples at a time.
+    :param lo: Lower end of the histogram range (scalar or per element).
+    :param hi: Upper end of the histogram range (scalar or per element).
+    :param shape: Shape of one sample.
+    Values outside [lo, hi] are counted in the edge bins; min and max are kept exactly.
+    '''
+
+    def __init__(self, lo, hi, shape=(), bins: int = HIST_BINS):
+        self.shape = tuple(shape)
+        size = int(np.prod(self.shape, dtype=int))
+        self.lo = np.broadcast_to(np.asarray(lo, dtype=float), self.shape).reshape(size).copy()
+        self.hi = np.broadcast_to(np.asarray(hi, dtype=float), self.shape).reshape(size).copy()
+        self.hi = np.where(self.hi > self.lo, self.hi, self.lo + 1.0)
+        self.bins = bins
+        self.counts = np.zeros((size, bins), dtype=np.int64)
+        self.n = 0
+        self.sum = np.zeros(size)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values.reshape(len(values), len(self.lo))
+        idx = np.floor((values - self.lo) / (self.hi - self.lo) * self.bins)
+        idx = np.clip(np.nan_to_num(idx, nan=0.0), 0, self.bins - 1).astype(np.int64)
+        flat = (np.arange(len(self.lo)) * self.bins + idx).ravel()
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+        self.n += len(values)
+        self.sum += values.sum(axis=0)
+        self.min = np.minimum(self.min, values.min(axis=0, initial=np.inf))
+        self.max = np.maximum(self.max, values.max(axis=0, initial=-np.inf))
+
+    def merge(self, other: "StreamingPercentiles"):
+        self.counts += other.counts
+        self.n += other.n
+        self.sum += other.sum
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+
+    def percentiles(self, qs=PERCENTILES) -> np.ndarray:
+        '''
+        Percentiles interpolated within the histogram bins, shape (len(qs), *shape).
+        '''
+        cum = np.cumsum(self.counts, axis=1)
+        width = (self.hi - self.lo) / self.bins
+        out = []
+        for q in qs:
+            target = q / 100.0 * self.n
+            b = np.minimum((cum < target).sum(axis=1), self.bins - 1)
+            rows = np.arange(len(self.lo))
+            before = np.where(b > 0, cum[rows, np.maximum(b - 1, 0)], 0)
+            inside = self.counts[rows, b]
+            frac = np.where(inside > 0, (target - before) / np.maximum(inside, 1), 0.0)
+            out.append(np.clip(self.lo + (b + frac) * width, self.min, self.max))
+        return np.array(out).reshape((len(qs),) + self.shape)
+
+    def summary(self, qs=PERCENTILES) -> Dict[str, np.ndarray]:
+        stats = {f"p{q:g}": v for q, v in zip(qs, self.percentiles(qs))}
+        stats.update(mean=(self.sum / max(self.n, 1)).reshape(self.shape), min=self.min.reshape(self.shape), max=self.max.reshape(self.shape))
+        return stats
+
+
+# ---------- batches (in-process or in pool workers) ----------
+
+def _empty_stats(state) -> Dict[str, StreamingPercentiles]:
+    lo, hi = state["total_range"]
+    budgets = np.asarray(state["budgets"], dtype=float)
+    stats = {
+        "scenarios": StreamingPercentiles(lo, hi, (len(state["coverages"]),)),
+        "budgets": StreamingPercentiles(lo, hi, (len(budgets),)),
+    }
+    if state["reoptimise"]:
+        stats["reoptimised"] = StreamingPercentiles(lo, hi, (len(budgets),))
+        stats["allocations"] = StreamingPercentiles(0.0, budgets[:, None], (len(budgets), state["model"].n_programs))
+    return stats
+
+
+def _run_batch(batch_no: int, n: int, state=None) -> Dict[str, StreamingPercentiles]:
+    '''
+    Sample n input sets (the seed depends only on the batch number) and return their histograms.
+    '''
+    state = state or worker_state()
+    model = state["model"]
+    rng = np.random.default_rng([state["seed"], batch_no])
+    f_eff, f_impl, f_maint = (sample_factors(rng, state["ranges"][key], n, state["distribution"]) for key in INPUTS)
+    impl, maint = state["implementation"], state["maintenance"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cost_factor = np.where(impl + maint > 0, (impl * f_impl + maint * f_maint) / (impl + maint), 1.0)
+    unit_costs = model.unit_costs * cost_factor
+
+    stats = _empty_stats(state)
+    caps = unit_costs * model.eligible  # spending that gives each coverage level under the sampled costs
+    stats["scenarios"].update(np.stack([model.total(cov * caps, f_eff, unit_costs) for cov in state["coverages"]], axis=1))
+    stats["budgets"].update(np.stack([model.total(x, f_eff, unit_costs) for x in state["allocations"]], axis=1) if len(state["allocations"]) else np.zeros((n, 0)))
+    if state["reoptimise"]:
+        totals = np.zeros((n, len(state["budgets"])))
+        allocs = np.zeros((n, len(state["budgets"]), model.n_programs))
+        for i in range(n):
+            sample = model.with_inputs(f_eff[i], unit_costs[i])
+            for j, budget in enumerate(state["budgets"]):
+                res = _allocate(sample, budget, state["method"])
+                totals[i, j], allocs[i, j] = res["total"], res["x"]
+        stats["reoptimised"].update(totals)
+        stats["allocations"].update(allocs)
+    return stats
+
+
+def _allocate(model, budget, method):
+    greedy = ev.greedy_allocation(model, budget)
+    if method == 'greedy':
+        return greedy
+    # fewer random starts than the optimisation scenario; the greedy allocation is a close start
+    return ev.optimize_allocation(model, budget, n_starts=200, n_refine=1, x0=greedy["x"])
+
+
+def _total_range(model):
+    # emissions of each source lie between baseline*(1-max mult) and baseline*(1-min mult)
+    mmin = np.where(np.isfinite(model.mult_min), model.mult_min, 0.0)
+    mmax = np.where(np.isfinite(model.mult_max), model.mult_max, 1.0)
+    a, b = model.baselines * (1 - mmax), model.baselines * (1 - mmin)
+    return float(np.minimum(a, b).sum()), float(np.maximum(a, b).sum())
+
+
+def _default_workers(cfg, n_batches):
+    if cfg['samples'] < PARALLEL_MIN_SAMPLES and not cfg['reoptimise']:
+        return 1
+    return max(1, min(os.cpu_count() or 1, n_batches))
+
+
+def run_uncertainty(model: ev.EmissionsModel, inputs: Dict[str, Any], budgets: List[float], settings=None,
+                    n_years: int = 1, labels: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''
+    Monte Carlo analysis on a compiled emissions model.
+    :param model: evaluator.compile_model result for the project.
+    :param inputs: validation.expected_inputs for the project (workbook point estimates).
+    :param budgets: Budgets whose point-estimate optimal allocations are evaluated (may be empty).
+    :param settings: Settings overriding DEFAULT_UNCERTAINTY (samples, ranges, distribution, ...).
+    :param n_years: Years the implementation cost is spread over (to read ranges in workbook units).
+    :param labels: Program labels used for the scenario names (default: code names).
+    :return: {"samples", "percentiles", "scenarios", "budgets", "budget_values", "reoptimised"?, "allocations"?, "inputs",
+              "point", "batches", "workers", "seconds"}; statistics are dicts of p5..p95, mean, min, max.
+    '''
+    t0 = time.perf_counter()
+    cfg = uncertainty_settings(settings)
+    programs = model.programs
+    labels = labels or {prog: prog for prog in programs}
+    points = {
+        "effects": {prog: next(iter(inputs["effects"].get(prog, {}).values()), 0.0) for prog in programs},
+        "implementation_costs": {prog: inputs["implementation_costs"][prog] * n_years for prog in programs},
+        "maintenance_costs": {prog: inputs["maintenance_costs"][prog] for prog in programs},
+    }
+    ranges = {key: input_ranges(cfg[key], programs, points[key]) for key in INPUTS}
+
+    point_allocs = [_allocate(model, budget, cfg['method']) for budget in budgets]
+    scenario_names = ["Status-quo", "All interventions"] + [labels[prog] for prog in programs]
+    coverages = [np.zeros(model.n_programs), np.ones(model.n_programs)] + list(np.eye(model.n_programs))
+    state = {
+        "model": model,
+        "ranges": ranges,
+        "distribution": cfg['distribution'],
+        "implementation": np.array([inputs["implementation_costs"][prog] for prog in programs]),
+        "maintenance": np.array([inputs["maintenance_costs"][prog] for prog in programs]),
+        "coverages": coverages,
+        "budgets": [float(b) for b in budgets],
+        "allocations": [res["x"] for res in point_allocs],
+        "reoptimise": cfg['reoptimise'],
+        "method": cfg['method'],
+        "seed": cfg['seed'],
+        "total_range": _total_range(model),
+    }
+
+    sizes = [cfg['batch_size']] * (cfg['samples'] // cfg['batch_size'])
+    if cfg['samples'] % cfg['batch_size']:
+        sizes.append(cfg['samples'] % cfg['batch_size'])
+    workers = _default_workers(cfg, len(sizes)) if cfg['workers'] is None else max(1, cfg['workers'])
+    stats = _empty_stats(state)
+    pool = process_pool(workers, state=state)
+    if pool is not None:
+        # keep a bounded number of batches in flight so pending results do not pile up
+        with pool:
+            batches = iter(enumerate(sizes))
+            pending = {pool.submit(_run_batch, i, n) for i, n in (next(batches) for _ in range(min(2 * workers, len(sizes))))}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    for key, part in fut.result().items():
+                        stats[key].merge(part)
+                    nxt = next(batches, None)
+                    if nxt is not None:
+                        pending.add(pool.submit(_run_batch, *nxt))
+    else:
+        workers = 1
+        for i, n in enumerate(sizes):
+            for key, part in _run_batch(i, n, state).items():
+                stats[key].merge(part)
+
+    def by_name(summary, names):
+        return {name: {stat: float(vals[i]) for stat, vals in summary.items()} for i, name in enumerate(names)}
+
+    budget_names = ['${:0,.0f}'.format(b) for b in budgets]
+    out = {
+        "samples": cfg['samples'],
+        "distribution": cfg['distribution'],
+        "percentiles": list(PERCENTILES),
+        "scenarios": by_name(stats["scenarios"].summary(), scenario_names),
+        "budgets": by_name(stats["budgets"].summary(), budget_names),
+        "budget_values": [float(b) for b in budgets],
+        "point": {
+            "scenarios": dict(zip(scenario_names, (float(model.total(cov * model.unit_costs * model.eligible)[0]) for cov in coverages))),
+            "budgets": dict(zip(budget_names, (res["total"] for res in point_allocs))),
+            "allocations": {name: model.allocation_dict(res["x"]) for name, res in zip(budget_names, point_allocs)},
+        },
+        "inputs": {key: {labels[prog]: {"low": points[key][prog] * ranges[key][0, i], "point": points[key][prog], "high": points[key][prog] * ranges[key][1, i]}
+                         for i, prog in enumerate(programs)} for key in INPUTS},
+    }
+    if cfg['reoptimise']:
+        out["reoptimised"] = by_name(stats["reoptimised"].summary(), budget_names)
+        alloc = stats["allocations"].summary()
+        out["allocations"] = {name: {labels[prog]: {stat: float(vals[j, k]) for stat, vals in alloc.items()} for k, prog in enumerate(programs)}
+                              for j, name in enumerate(budget_names)}
+    out.update(batches=len(sizes), workers=workers, seconds=time.perf_counter() - t0)
+    return out
@@ -1,12 +1,19 @@
 import os
 import json
+import time
 import tempfile
+import uuid
+import contextvars
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
-import matplotlib.pyplot as plt
-import matplotlib as mpl
 import pandas as pd
-import atomica as at
+import charts
+from resultblocks import ResultBlock
+from tracing import span
 
 def _project_dirs():
     """
@@ -34,161 +41,376 @@ def _project_dirs():
     graphs_dir.mkdir(parents=True, exist_ok=True)
     return results_dir, graphs_dir
 
+def result_path(file_name: str, ext: str = '.xlsx') -> Path:
+    """
+    Path of a results file for the current project (see _project_dirs).
+    """
+    results_dir, _ = _project_dirs()
+    return results_dir / f'{file_name}{ext}'
+
+def _writable(path: Path) -> Path:
+    # a project cloned from another shares its files until they change (storage.clone_project)
+    from storage import unshare
+    unshare(path, keep=False)
+    return path
+
+def _relpath(path: Path, project_dir=None) -> str:
+    # artifact paths are reported relative to the project folder (default: PROJECT_DIR) when one is set
+    proj_env = project_dir or os.environ.get("PROJECT_DIR")
+    if proj_env:
+        try:
+            return Path(path).resolve().relative_to(Path(proj_env).resolve()).as_posix()
+        except ValueError:
+            pass
+    return str(path)
+
+# in a process_pool worker: the state it was started with, or the project context it built
+_worker_state = None
+
+def exit_with_parent():
+    """
+    In a spawned process, exit as soon as the parent process dies and take this process's own
+    children with it, so a killed API process or engine worker leaves no orphans running simulations.
+    """
+    parent = mp.parent_process()
+    if parent is None:
+        return
+    def watch():
+        parent.join()  # returns when the parent's sentinel closes
+        for child in mp.active_children():
+            child.kill()
+        os._exit(1)
+    threading.Thread(target=watch, name="exit-with-parent", daemon=True).start()
+
+def _init_pool_worker(state, project_dir, books_dir):
+    global _worker_state
+    exit_with_parent()
+    _worker_state = state
+    if project_dir is not None:
+        os.chdir(str(Path(__file__).resolve().parent))  # books.py reads templates/ relative to the working directory
+        os.environ["PROJECT_DIR"] = project_dir
+        from project import load_project
+        _worker_state = load_project(project_dir, books_dir=books_dir, regenerate=False)
+
+def worker_state():
+    """
+    State of a process_pool worker: the `state` it was started with, or the project context it built.
+    """
+    return _worker_state
+
+def process_pool(workers: int, state=None, project_dir=None):
+    """
+    Spawned pool of `workers` processes for engine work, or None when one process is enough or this
+    process cannot start children (daemonic). Workers receive `state` (picklable) or, given a
+    project_dir, build that project once from its generated books; tasks read it with worker_state().
+    """
+    if workers <= 1 or mp.current_process().daemon:
+        return None
+    if project_dir is not None:
+        project_dir = str(Path(project_dir).resolve())
+        books_dir = str(Path(project_dir) / "books")
+    else:
+        books_dir = None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"), initializer=_init_pool_worker,
+                               initargs=(state, project_dir, books_dir))
+
+# optional suffix for output file names; batch runs set it per scenario so that scenarios of the
+# same kind do not overwrite each other's tables and graphs
+output_tag = contextvars.ContextVar("output_tag", default=None)
+
+def _tagged(file_name: str) -> str:
+    tag = output_tag.get()
+    return f'{file_name}_{tag}' if tag else file_name
+
+@contextmanager
+def _file_lock(path: Path, timeout: float = 10.0):
+    # lock file shared by processes writing the same project (parallel batch runs), holding the owner's
+    # pid and a token. A lock held by the same owner for longer than timeout is taken over if that
+    # process has died and raises TimeoutError otherwise; only the call that created it removes it.
+    token = f"{os.getpid()} {uuid.uuid4().hex}"
+    owner, deadline = None, time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(str(path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            with os.fdopen(fd, "w") as f:
+                f.write(token)
+            break
+        except FileExistsError:
+            current = _lock_owner(path)
+            if current != owner:
+                owner, deadline = current, time.monotonic() + timeout
+            elif time.monotonic() > deadline:
+                if _pid_alive(owner):
+                    raise TimeoutError(f"could not lock {path} within {timeout}s (held by pid {owner.split()[0]})")
+                try:
+                    os.remove(str(path))
+                except OSError:
+                    pass
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        if _lock_owner(path) == token:
+            try:
+                os.remove(str(path))
+            except OSError:
+                pass
+
+def _lock_owner(path: Path) -> str:
+    try:
+        return Path(path).read_text()
+    except OSError:
+        return ""
+
+def _pid_alive(owner: str) -> bool:
+    try:
+        os.kill(int(owner.split()[0]), 0)
+    except (ValueError, IndexError, ProcessLookupError):
+        return False  # no pid: the owner died between creating the file and writing its token
+    except PermissionError:
+        pass
+    return True
+
 def _record_graph(graphs_dir: Path, filename: str, meta: dict):
     manifest = graphs_dir / "manifest.json"
-    data = {}
-    if manifest.exists():
-        try:
-            data = json.loads(manifest.read_text(encoding="utf-8"))
-        except Exception:
-            data = {}
-    # use timestamped name key
-    data[filename] = meta
-    manifest.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    with _file_lock(graphs_dir / "manifest.json.lock"):
+        data = {}
+        if manifest.exists():
+            try:
+                data = json.loads(manifest.read_text(encoding="utf-8"))
+            except Exception:
+                data = {}
+        # use timestamped name key
+        data[filename] = meta
+        _writable(manifest).write_text(json.dumps(data, indent=2), encoding="utf-8")
+
+# chart specs of the running scenario, rendered afterwards by the pipeline's charts stage
+# (see pipeline.py); None renders each chart as soon as it is produced
+deferred_charts = contextvars.ContextVar("deferred_charts", default=None)
+
+def _frame_data(df: pd.DataFrame) -> dict:
+    return {"index": [str(i) for i in df.index], "columns": [str(c) for c in df.columns],
+            "data": [[float(v) for v in row] for row in df.itertuples(index=False)]}
+
+def _chart(kind: str, file_name: str, title: str, caption: str, data: dict, facility=None) -> Path:
+    """
+    Render a chart into the project graphs dir (charts.py), or queue its spec when charts are deferred.
+    Returns the image path.
+    """
+    spec = {"type": kind, "file": f'{file_name}.png', "title": title, "caption": caption, "data": data}
+    if facility is not None:
+        spec["facility"] = facility
+    pending = deferred_charts.get()
+    if pending is not None:
+        pending.append(spec)
+    else:
+        render_chart(spec)
+    return _project_dirs()[1] / spec["file"]
+
+def render_chart(spec: dict, titles: dict = None) -> Path:
+    """
+    Render one chart spec and record it in the graphs manifest.
+    :param titles: Optional {chart type: title} overriding the spec's title.
+    """
+    _, graphs_dir = _project_dirs()
+    title = (titles or {}).get(spec["type"])
+    img_path = _writable(graphs_dir / spec["file"])
+    with span('plotting', file=spec["file"]):
+        charts.RENDERERS[spec["type"]](spec["data"], title or spec["title"], img_path)
+    meta = {"file": spec["file"], "type": spec["type"], "title": title or spec["caption"], "created_at": datetime.utcnow().isoformat() + "Z"}
+    if "facility" in spec:
+        meta["facility"] = spec["facility"]
+    _record_graph(graphs_dir, spec["file"], meta)
+    return img_path
+
+def _block(results, facility_code=None, year=None, progset=None) -> ResultBlock:
+    # the writers take Atomica results or a ResultBlock (e.g. filled by worker processes)
+    if isinstance(results, ResultBlock):
+        return results
+    return ResultBlock.from_results(results, facility_code, year, progset)
 
 def calc_emissions(results, start_year, facility_code, file_name, title=None):
     """
     Save emissions excel & a bar plot into project-specific results/ and graphs/ directories.
+    Returns the artifact paths plus per-result emissions by source and totals.
+    :param results: Atomica results or a ResultBlock.
     """
-    # Extract relevant parameter names for plotting
-    pop = results[0].pop_names[0]
-    pars = results[0].par_names(pop)
-    parameters = [par for par in pars if '_mult' not in par and '_emissions' not in par and '_baseline' not in par]
-    par_labels = [par.replace('_', ' ').title() for par in parameters]
-    
-    # Set up DataFrame for emissions
-    rows = [res.name for res in results]
-    df_emissions = pd.DataFrame(index=rows, columns=par_labels)
-    start_i = list(results[0].t).index(start_year)
-    
-    # Populate the DataFrame with emissions data
-    for par, par_label in zip(parameters, par_labels):
-        for res in results:
-            df_emissions.loc[res.name, par_label] = res.get_variable(par, facility_code)[0].vals[start_i]
+    file_name = _tagged(file_name)
+    # emissions by source at the start year (rows: results)
+    df_emissions = _block(results, facility_code, start_year).emissions_frame(start_year)
     
     # write to project results and graphs
-    results_dir, graphs_dir = _project_dirs()
-    excel_path = results_dir / f'{file_name}.xlsx'
-    writer_emissions = pd.ExcelWriter(excel_path, engine='xlsxwriter')
-    df_emissions.to_excel(writer_emissions, sheet_name=facility_code)
-    writer_emissions.close()
+    results_dir, _ = _project_dirs()
+    excel_path = _writable(results_dir / f'{file_name}.xlsx')
+    with span('io', file=file_name):
+        writer_emissions = pd.ExcelWriter(excel_path, engine='xlsxwriter')
+        df_emissions.to_excel(writer_emissions, sheet_name=facility_code)
+        writer_emissions.close()
     
     # Generate the bar plot
-    fig_width = max(15, len(par_labels) * 1.5)
-    fig_height = 10
-    font_size = 22
-    fig, ax = plt.subplots(figsize=(fig_width, fig_height))
-    df_emissions.plot(kind='bar', stacked=True, ax=ax, fontsize=font_size)
-    
-    plt.title(title or 'Total CO2e Emissions', fontsize=font_size + 2)
-    ax.legend(title='Emission Sources', bbox_to_anchor=(1.0, 1.0), loc='upper left', fontsize=font_size-2, title_fontsize=font_size)
-    ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
-    plt.xticks(rotation=90, ha='center')
-    plt.ylabel('Emissions (CO2e)', fontsize=font_size)
-    plt.tight_layout()
-    img_name = f'{file_name}.png'
-    img_path = graphs_dir / img_name
-    fig.savefig(img_path, bbox_inches='tight')
-    plt.close(fig)
-    
-    # record in manifest
-    _record_graph(graphs_dir, img_name, {
-        "file": img_name,
-        "type": "emissions",
-        "title": title or 'Emissions',
-        "created_at": datetime.utcnow().isoformat() + "Z",
-        "facility": facility_code
-    })
-    
-    print(f'Emissions results saved: {excel_path}')
-    print(f'Emissions bar plot saved: {img_path}')
+    img_path = _chart("emissions", file_name, title or 'Total CO2e Emissions', title or 'Emissions', _frame_data(df_emissions), facility_code)
+
+    emissions = {res: {label: float(v) for label, v in row.items()} for res, row in df_emissions.iterrows()}
+    return {
+        "artifacts": [
+            {"kind": "table", "type": "emissions", "path": _relpath(excel_path)},
+            {"kind": "graph", "type": "emissions", "path": _relpath(img_path)},
+        ],
+        "emissions": emissions,
+        "totals": {res: sum(vals.values()) for res, vals in emissions.items()},
+    }
 
 def plot_allocation(results, file_name):
     """
     Save allocation bar plot into project graphs directory and excel into results dir.
+    Returns the artifact paths plus the allocation per result.
+    :param results: Atomica results or a ResultBlock.
     """
-    prog_codes = results[0].model.progset.programs
-    prog_labels = [results[0].model.progset.programs[prog].label for prog in prog_codes]
-    res_names = [res.name for res in results]
-    df_spending_optimized = pd.DataFrame(index=res_names, columns=prog_labels)
-    
-    for res in results:
-        for prog_code, prog_name in zip(prog_codes,prog_labels):
-            df_spending_optimized.loc[res.name,prog_name] = res.get_alloc()[prog_code][0]
-    
-    # colors
-    colormap = plt.cm.tab20
-    colors = [colormap(i) for i in range(len(df_spending_optimized.columns))]
-    
-    results_dir, graphs_dir = _project_dirs()
-    fig, ax = plt.subplots(figsize=(15,10))
-    df_spending_optimized.plot.bar(stacked=True, color=colors, ax=ax, fontsize=22)
-    ax.legend(loc='upper left', bbox_to_anchor=(1.05,1), title='Interventions', fontsize=20, title_fontsize=22)
-    ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('${x:,.0f}'))
-    plt.title('Budget allocation', fontsize=25)
-    plt.xticks(rotation=0)
-    plt.tight_layout()
-    img_name = f'{file_name}.png'
-    img_path = graphs_dir / img_name
-    fig.savefig(img_path, bbox_inches='tight')
-    plt.close(fig)
-    
-    excel_path = results_dir / f'{file_name}.xlsx'
-    writer = pd.ExcelWriter(excel_path, engine='xlsxwriter')
-    df_spending_optimized.to_excel(writer, sheet_name="Allocation")
-    writer.close()
+    file_name = _tagged(file_name)
+    # spending at the first simulated year (rows: results)
+    df_spending_optimized = _block(results).alloc_frame().T
     
-    _record_graph(graphs_dir, img_name, {
-        "file": img_name,
-        "type": "allocation",
-        "title": "Budget allocation",
-        "created_at": datetime.utcnow().isoformat() + "Z"
-    })
+    results_dir, _ = _project_dirs()
+    img_path = _chart("allocation", file_name, 'Budget allocation', 'Budget allocation', _frame_data(df_spending_optimized))
     
-    print(f'Allocation bar plot saved: {img_path}')
-    print(f'Allocation excel saved: {excel_path}')
+    excel_path = _writable(results_dir / f'{file_name}.xlsx')
+    with span('io', file=file_name):
+        writer = pd.ExcelWriter(excel_path, engine='xlsxwriter')
+        df_spending_optimized.to_excel(writer, sheet_name="Allocation")
+        writer.close()
+
+    return {
+        "artifacts": [
+            {"kind": "table", "type": "allocation", "path": _relpath(excel_path)},
+            {"kind": "graph", "type": "allocation", "path": _relpath(img_path)},
+        ],
+        "allocations": {res: {label: float(v) for label, v in row.items()} for res, row in df_spending_optimized.iterrows()},
+    }
 
 def write_alloc_excel(progset, results, year, print_results=True, file_name=None):
     """
     Write optimized budget allocations onto an excel file (saved into project results dir).
+    :param results: Atomica results or a ResultBlock reported at `year`.
+    :return: Spending and coverage fractions (program labels x results).
     """
-    progname = []
-    prog_labels = []
-    for prog in progset.programs:
-        progname += [prog]
-        prog_labels += [progset.programs[prog].label]
-        
-    bars = []
-    for i in range(0, len(results)):
-         bar_name = results[i].name
-         bars.append(bar_name)
-         
-    d1 = at.PlotData.programs(results, quantity='spending')
-    d1.interpolate(year)
-    spending_raw_data = {(x.result, x.output): x.vals[0] for x in d1.series}
-    spending_data = {res: {prog:0 for prog in progname} for res in bars}
+    block = _block(results, year=year, progset=progset)
+    df1 = block.alloc_frame()
+    df2 = block.coverage_frame()
     
-    d2 = at.PlotData.programs(results, quantity='coverage_fraction')
-    d2.interpolate(year)
-    cov_raw_data = {(x.result, x.output): x.vals[0] for x in d2.series}
-    cov_data = {res: {prog:0 for prog in progname} for res in bars}
-    for br in bars:
-        for prog in progname:
-            spending_data[br][prog] = spending_raw_data[(br, prog)]
-            cov_data[br][prog] = cov_raw_data[(br, prog)]
-    df1 = pd.DataFrame(spending_data)
-    df2 = pd.DataFrame(cov_data)
-    df1.index = prog_labels
-    df2.index = prog_labels
-    
-    results_dir, graphs_dir = _project_dirs()
     if print_results:
-        fn = file_name or 'allocations'
-        excel_file = results_dir / (fn + '.xlsx')
-        writer = pd.ExcelWriter(excel_file, engine='xlsxwriter')
-        df1.to_excel(writer, sheet_name="Budgets")
-        df2.to_excel(writer, sheet_name="Coverages")
-        writer.close()
-        print(f'Excel file saved: {excel_file}')
+        excel_file = _writable(result_path(_tagged(file_name or 'allocations')))
+        with span('io', file=file_name):
+            writer = pd.ExcelWriter(excel_file, engine='xlsxwriter')
+            df1.to_excel(writer, sheet_name="Budgets")
+            df2.to_excel(writer, sheet_name="Coverages")
+            writer.close()
     
-    return df1, df2
\ No newline at end of file
+    return df1, df2
+
+
+def write_uncertainty(summary, facility_code, file_name):
+    """
+    Save the percentile tables of an uncertainty analysis (uncertainty.run_uncertainty) into the
+    project results dir, with a band chart of the coverage scenarios and a fan chart over budgets.
+    Returns the artifact paths.
+    """
+    file_name = _tagged(file_name)
+    stats = [f"p{q:g}" for q in summary["percentiles"]] + ["mean", "min", "max"]
+    sheets = {"Scenarios": pd.DataFrame(summary["scenarios"]).T[stats]}
+    sheets["Scenarios"].insert(0, "point", pd.Series(summary["point"]["scenarios"]))
+    if summary["budgets"]:
+        sheets["Budgets"] = pd.DataFrame(summary["budgets"]).T[stats]
+        sheets["Budgets"].insert(0, "point", pd.Series(summary["point"]["budgets"]))
+    if summary.get("reoptimised"):
+        sheets["Reoptimised"] = pd.DataFrame(summary["reoptimised"]).T[stats]
+        sheets["Allocations"] = pd.DataFrame({(budget, prog): vals for budget, progs in summary["allocations"].items() for prog, vals in progs.items()}).T[stats]
+    sheets["Inputs"] = pd.DataFrame({(key, prog): vals for key, progs in summary["inputs"].items() for prog, vals in progs.items()}).T
+
+    results_dir, _ = _project_dirs()
+    excel_path = _writable(results_dir / f'{file_name}.xlsx')
+    with span('io', file=file_name):
+        writer = pd.ExcelWriter(excel_path, engine='xlsxwriter')
+        for sheet, df in sheets.items():
+            df.to_excel(writer, sheet_name=sheet)
+        writer.close()
+    artifacts = [{"kind": "table", "type": "uncertainty", "path": _relpath(excel_path)}]
+
+    lo, hi = f"p{min(summary['percentiles']):g}", f"p{max(summary['percentiles']):g}"
+    stat_cols = list(dict.fromkeys(["p50", "p25", "p75", lo, hi]))
+    title = "CO2e emissions - uncertainty (full coverage)"
+    data = {**_frame_data(sheets["Scenarios"][stat_cols]), "lo": lo, "hi": hi}
+    img_path = _chart("uncertainty_scenarios", f'{file_name}_scenarios', title, title, data, facility_code)
+    artifacts.append({"kind": "graph", "type": "uncertainty_scenarios", "path": _relpath(img_path)})
+    if len(summary["budgets"]):
+        title = "CO2e emissions - uncertainty over budgets"
+        data = {**_frame_data(sheets["Budgets"][stat_cols]), "lo": lo, "hi": hi, "budgets": [float(b) for b in summary["budget_values"]],
+                "reoptimised": [float(v) for v in sheets["Reoptimised"]["p50"]] if "Reoptimised" in sheets else None}
+        img_path = _chart("uncertainty_budgets", f'{file_name}_budgets', title, title, data, facility_code)
+        artifacts.append({"kind": "graph", "type": "uncertainty_budgets", "path": _relpath(img_path)})
+
+    return {"artifacts": artifacts}
+
+def plot_frontier(frontier, facility_code, file_name):
+    """
+    Save the emissions-vs-budget frontier (frontier.compute_frontier) as an excel table of budgets,
+    emissions and allocations plus a curve into the project results and graphs directories.
+    Returns the artifact paths.
+    """
+    file_name = _tagged(file_name)
+    points = frontier["points"]
+    df = pd.DataFrame([{"Budget": p["budget"], "Emissions": p["emissions"], "Marginal reduction per $": p["marginal"], **p["allocation"]} for p in points]).set_index("Budget")
+
+    results_dir, _ = _project_dirs()
+    excel_path = _writable(results_dir / f'{file_name}.xlsx')
+    with span('io', file=file_name):
+        writer = pd.ExcelWriter(excel_path, engine='xlsxwriter')
+        df.to_excel(writer, sheet_name="Frontier")
+        writer.close()
+
+    data = {"budgets": [float(b) for b in df.index], "emissions": [float(e) for e in df["Emissions"]]}
+    img_path = _chart("frontier", file_name, 'CO2e emissions - cost-effectiveness frontier', "Cost-effectiveness frontier", data, facility_code)
+
+    return {
+        "artifacts": [
+            {"kind": "table", "type": "frontier", "path": _relpath(excel_path)},
+            {"kind": "graph", "type": "frontier", "path": _relpath(img_path)},
+        ],
+    }
+
+def plot_dose_response(data, facility_code, file_name):
+    """
+    Save dose-response (cost-to-abatement) curves and the marginal abatement cost ranking from
+    scenarios.dose_response_scenario into the project results dir, with a curve plot and a MAC chart.
+    Returns the artifact paths.
+    """
+    file_name = _tagged(file_name)
+    rows = []
+    for label, curve in data["curves"].items():
+        prev = None
+        for spend, cov, emis, abated in zip(curve["spend"], curve["coverage"], curve["emissions"], curve["abatement"]):
+            marginal = None
+            if prev is not None and abated > prev[1]:
+                marginal = (spend - prev[0]) / (abated - prev[1])
+            rows.append({"Intervention": label, "Spending": spend, "Coverage": cov, "Emissions": emis, "Abatement": abated, "Marginal cost per tCO2e": marginal})
+            prev = (spend, abated)
+    df_curves = pd.DataFrame(rows)
+    df_mac = pd.DataFrame([{"Rank": r["rank"], "Intervention": r["intervention"], "Annual cost (full coverage)": r["spend"],
+                            "Abatement": r["abatement"], "Cost per tCO2e": r["cost_per_tonne"]} for r in data["mac"]]).set_index("Rank")
+
+    results_dir, _ = _project_dirs()
+    excel_path = _writable(results_dir / f'{file_name}.xlsx')
+    with span('io', file=file_name):
+        writer = pd.ExcelWriter(excel_path, engine='xlsxwriter')
+        df_curves.to_excel(writer, sheet_name="Curves", index=False)
+        df_mac.to_excel(writer, sheet_name="MAC")
+        writer.close()
+    artifacts = [{"kind": "table", "type": "dose_response", "path": _relpath(excel_path)}]
+
+    curves = {label: {"spend": [float(v) for v in curve["spend"]], "abatement": [float(v) for v in curve["abatement"]]} for label, curve in data["curves"].items()}
+    img_path = _chart("dose_response", f'{file_name}_curves', 'Cost-to-abatement curves', "Cost-to-abatement curves", {"curves": curves}, facility_code)
+    artifacts.append({"kind": "graph", "type": "dose_response", "path": _relpath(img_path)})
+    ranked = df_mac[df_mac["Cost per tCO2e"].notna()]
+    rows = [{"intervention": row["Intervention"], "cost_per_tonne": float(row["Cost per tCO2e"]), "abatement": float(row["Abatement"])} for _, row in ranked.iterrows()]
+    img_path = _chart("mac", f'{file_name}_mac', 'Marginal abatement cost', "Marginal abatement cost", {"rows": rows}, facility_code)
+    artifacts.append({"kind": "graph", "type": "mac", "path": _relpath(img_path)})
+    return {"artifacts": artifacts}
@@ -0,0 +1,202 @@
+"""
+Numerical validation of a built project against its input workbook.
+
+Runs the program checks from program_checks.py (status quo with zero coverage, every program at
+full coverage, each program alone at full coverage, each program alone with a fixed investment)
+and compares the emissions of every source at start_year with the values implied by the
+`emission data`, `emission targets`, `effect sizes` and cost sheets:
+
+    emission = baseline * (1 - mult)
+    mult     = sum_i d_i c_i prod_{j<i} (1 - c_j)     (programs ordered by |d_i|, largest first)
+    c_i      = min(1, spend_i / unit_cost_i)           (one facility is eligible)
+
+which is the 'random' coverage interaction used for the Covouts written by books.py.
+
+validate_context(ctx) returns a pass/fail report; results are compared in memory and raw
+exports are only written when export_dir is given. Large projects can spread the simulations
+over worker processes (each worker builds the project once from the generated books).
+"""
+import os
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+import numpy as np
+import pandas as pd
+
+from utils import process_pool, worker_state
+
+DEFAULT_INVESTMENT = 1e5
+DEFAULT_RTOL = 1e-6
+DEFAULT_ATOL = 1e-6
+# spawning a worker costs an atomica import plus a project load (a few seconds), so only
+# go parallel when each worker gets at least this many simulations
+MIN_CHECKS_PER_WORKER = 25
+
+
+def _read_sheet(input_data_sheet, sheet_name, index_col):
+    df = pd.read_excel(input_data_sheet, sheet_name=sheet_name, index_col=index_col)
+    return df.drop(columns=[c for c in df.columns if 'Unnamed' in str(c)])
+
+
+def expected_inputs(input_data_sheet, facility_code, start_year, end_year) -> Dict[str, Any]:
+    '''
+    Read what the checks are compared against from the input workbook.
+    :return: {"baselines": {source: value}, "effects": {program: {source: effect}}, "unit_costs": {program: value},
+              "implementation_costs": {program: value per year}, "maintenance_costs": {program: value}}
+    '''
+    emissions = _read_sheet(input_data_sheet, 'emission data', 'facilities')
+    targets = _read_sheet(input_data_sheet, 'emission targets', 'interventions')
+    effects = _read_sheet(input_data_sheet, 'effect sizes', 'facilities')
+    implement = _read_sheet(input_data_sheet, 'implementation costs', 'facilities')
+    maintain = _read_sheet(input_data_sheet, 'maintenance costs', 'facilities')
+    programs = _read_sheet(input_data_sheet, 'interventions', 'Code Name').index
+
+    n_years = len(np.arange(start_year, end_year))  # same spreading of implementation cost as books.py
+    baselines = {src: float(emissions.loc[facility_code, src]) for src in emissions.columns}
+    prog_effects = {}
+    unit_costs, implementation, maintenance = {}, {}, {}
+    for prog in programs:
+        d = float(effects.loc[facility_code, prog + '_effect'])
+        srcs = [src for src in targets.columns if prog in targets.index and targets.loc[prog, src] == 'y']
+        prog_effects[prog] = {src: d for src in srcs}
+        implementation[prog] = float(implement.loc[facility_code, prog + '_cost']) / n_years
+        maintenance[prog] = float(maintain.loc[facility_code, prog + '_cost'])
+        unit_costs[prog] = implementation[prog] + maintenance[prog]
+    return {"baselines": baselines, "effects": prog_effects, "unit_costs": unit_costs,
+            "implementation_costs": implementation, "maintenance_costs": maintenance}
+
+
+def expected_emissions(inputs: Dict[str, Any], coverage: Dict[str, float]) -> Dict[str, float]:
+    '''
+    Emissions by source for the given program coverage (fractions), using the random interaction.
+    '''
+    out = {}
+    for src, baseline in inputs["baselines"].items():
+        terms = sorted(((eff[src], coverage.get(prog, 0.0)) for prog, eff in inputs["effects"].items() if src in eff), key=lambda x: -abs(x[0]))
+        mult, uncovered = 0.0, 1.0
+        for d, c in terms:
+            mult += d * c * uncovered
+            uncovered *= (1 - c)
+        mult = min(max(mult, 0.0), 1.0)  # the _mult parameters are bounded to [0, 1] in the framework
+        out[src] = baseline * (1 - mult)
+    return out
+
+
+def build_checks(inputs: Dict[str, Any], investment: float = DEFAULT_INVESTMENT) -> List[Dict[str, Any]]:
+    '''
+    The checks from program_checks.py as data: each has a name, program, the instructions to
+    simulate (coverage or alloc) and the expected emissions by source.
+    '''
+    programs = list(inputs["unit_costs"])
+    zeros = {prog: 0.0 for prog in programs}
+    checks = [
+        {"check": "zero_coverage", "program": None, "coverage": dict(zeros), "export": "no_coverage_raw"},
+        {"check": "full_coverage", "program": None, "coverage": {prog: 1.0 for prog in programs}, "export": "full_coverage_raw"},
+    ]
+    for prog in programs:
+        checks.append({"check": "program_coverage", "program": prog, "coverage": {**zeros, prog: 1.0}, "export": f"full_coverage_raw_{prog}"})
+    for prog in programs:
+        cov = min(1.0, investment / inputs["unit_costs"][prog]) if inputs["unit_costs"][prog] > 0 else 1.0
+        checks.append({"check": "budget", "program": prog, "alloc": {**zeros, prog: investment}, "budget_coverage": {**zeros, prog: cov}, "export": f"budget_raw_{prog}"})
+    for chk in checks:
+        chk["expected"] = expected_emissions(inputs, chk.get("budget_coverage", chk.get("coverage")))
+    return checks
+
+
+# ---------- simulation (in-process or in pool workers) ----------
+
+def _simulate(chk: Dict[str, Any], ctx: Optional[Dict[str, Any]] = None, export_dir: Optional[str] = None) -> Dict[str, float]:
+    import atomica as at
+    ctx = ctx or worker_state()
+    P, start_year, facility_code = ctx["P"], ctx["start_year"], ctx["facility_code"]
+    if "alloc" in chk:
+        instructions = at.ProgramInstructions(start_year=start_year, alloc=chk["alloc"])
+    else:
+        instructions = at.ProgramInstructions(start_year=start_year, coverage=chk["coverage"])
+    res = P.run_sim(P.parsets[0], progset=P.progsets[0], progset_instructions=instructions, result_name=chk["program"] or chk["check"])
+    if export_dir:
+        from storage import unshare
+        target = Path(export_dir) / f'{chk["export"]}.xlsx'
+        unshare(target, keep=False)  # export_raw rewrites the file in place
+        res.export_raw(str(target))
+    start_i = list(res.t).index(start_year)
+    return {src: float(res.get_variable(src, facility_code)[0].vals[start_i]) for src in chk["expected"]}
+
+
+def _simulate_in_worker(args):
+    chk, export_dir = args
+    return _simulate(chk, export_dir=export_dir)
+
+
+def _default_workers(n_checks: int) -> int:
+    return max(1, min(os.cpu_count() or 1, n_checks // MIN_CHECKS_PER_WORKER))
+
+
+def validate_context(ctx: Dict[str, Any], workers: Optional[int] = None, investment: float = DEFAULT_INVESTMENT,
+                     export_dir: Optional[str] = None, rtol: float = DEFAULT_RTOL, atol: float = DEFAULT_ATOL) -> Dict[str, Any]:
+    '''
+    Validate a project built by project.load_project.
+    :param ctx: Project context (P, progset, start_year, end_year, facility_code, input_data_sheet, books_dir).
+    :param workers: Worker processes for the simulations (None: based on CPU count and number of checks).
+    :param investment: Spending used for the per-program budget checks.
+    :param export_dir: Write raw Atomica exports of every check here (off by default).
+    :param rtol: Relative tolerance of the comparison.
+    :param atol: Absolute tolerance of the comparison.
+    :return: Report dict: status ('pass'|'fail'), summary counts, and one entry per check with any mismatching sources.
+    '''
+    t0 = time.perf_counter()
+    inputs = expected_inputs(ctx["input_data_sheet"], ctx["facility_code"], ctx["start_year"], ctx["end_year"])
+    checks = build_checks(inputs, investment)
+    if export_dir:
+        Path(export_dir).mkdir(parents=True, exist_ok=True)
+        export_dir = str(Path(export_dir).resolve())
+
+    workers = _default_workers(len(checks)) if workers is None else max(1, int(workers))
+    pool = process_pool(workers, project_dir=Path(ctx["books_dir"]).parent)
+    if pool is not None:
+        with pool:
+            actuals = list(pool.map(_simulate_in_worker, [(chk, export_dir) for chk in checks], chunksize=max(1, len(checks) // (workers * 4))))
+    else:
+        workers = 1
+        actuals = [_simulate(chk, ctx, export_dir) for chk in checks]
+
+    report_checks = []
+    for chk, actual in zip(checks, actuals):
+        mismatches = []
+        max_err = 0.0
+        for src, expected in chk["expected"].items():
+            got = actual[src]
+            max_err = max(max_err, abs(got - expected))
+            if not np.isclose(got, expected, rtol=rtol, atol=atol):
+                mismatches.append({"source": src, "baseline": inputs["baselines"][src], "expected": expected, "actual": got})
+        report_checks.append({
+            "check": chk["check"],
+            "program": chk["program"],
+            "passed": not mismatches,
+            "max_abs_error": max_err,
+            "mismatches": mismatches,
+        })
+
+    failed = sum(1 for c in report_checks if not c["passed"])
+    report = {
+        "status": "fail" if failed else "pass",
+        "facility": ctx["facility_code"],
+        "start_year": ctx["start_year"],
+        "investment": investment,
+        "summary": {"total": len(report_checks), "passed": len(report_checks) - failed, "failed": failed},
+        "checks": report_checks,
+        "workers": workers,
+        "seconds": time.perf_counter() - t0,
+    }
+    if export_dir:
+        report["export_dir"] = export_dir
+    return report
+
+
+def validate_project(project_dir, cache: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, Any]:
+    '''
+    Build (or reuse from cache) the project in project_dir and validate it; see validate_context for kwargs.
+    '''
+    from run_main import project_context
+    return validate_context(project_context(project_dir, cache), **kwargs)
@@ -1,7 +1,7 @@
 from pathlib import Path
 from typing import Any
 import json
-from storage import project_path
+from storage import project_path, unshare
 
 VARS_FILENAME = "variables.json"
 
@@ -21,6 +21,7 @@ def load_variables(project_id: str) -> dict:
 
 def save_variables(project_id: str, data: dict) -> None:
     f = _vars_file(project_id)
+    unshare(f, keep=False)
     f.write_text(json.dumps(data or {}, indent=2), encoding="utf-8")
 
 def update_variable(project_id: str, key: str, value: Any) -> None:
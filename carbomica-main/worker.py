@@ -0,0 +1,270 @@
+"""
+Long-lived engine workers.
+
+Each worker is a separate process that keeps atomica imported and built projects warm between
+runs (see run_main.load_project_context). The API talks to workers over a multiprocessing pipe
+with dict messages:
+
+  request:  {"op": "run", "input_path": str, "out_dir": str, "scenario": str|None, "options": dict|None, "run_id": str|None}
+            {"op": "ping"}
+  response: {"ok": True, "result": <run manifest from run_project>, "rss_mb": float}
+            {"ok": False, "error": str, "trace": str, "rss_mb": float}
+
+Workers are restarted automatically when they crash or when their resident memory grows past
+CARBOMICA_WORKER_MAX_RSS_MB.
+
+`python worker.py --broker sqlite:////shared/broker.db` runs a standalone worker that pulls runs
+from a broker (see broker.py) instead: it unpacks each job's input bundle under --work-dir, runs
+it and uploads the changed result files. Start more of them, on any host, for more throughput.
+"""
+import os
+import time
+import uuid
+import atexit
+import tempfile
+import queue
+import threading
+import traceback
+import multiprocessing as mp
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+REPO_ROOT = Path(__file__).resolve().parent
+
+DEFAULT_WORKERS = int(os.environ.get("CARBOMICA_WORKERS", "1"))
+DEFAULT_MAX_RSS_MB = float(os.environ.get("CARBOMICA_WORKER_MAX_RSS_MB", "2048"))
+
+
+def _rss_mb() -> float:
+    # current (not peak) resident memory, so a worker is recycled once rather than after every job;
+    # 0 where it cannot be read, which disables recycling
+    from tracing import rss_mb
+    return rss_mb() or 0.0
+
+
+def _handle(msg: dict, cache: dict) -> dict:
+    op = msg.get("op")
+    if op == "ping":
+        return {"ok": True, "result": "pong"}
+    if op == "run":
+        import run_main
+        res = run_main.run_project(msg["input_path"], msg["out_dir"], msg.get("scenario"), msg.get("options"), cache=cache, run_id=msg.get("run_id"))
+        if isinstance(res, dict) and res.get("status") == "error":
+            return {"ok": False, "error": res.get("error"), "trace": res.get("trace"), "result": res}
+        return {"ok": True, "result": res}
+    return {"ok": False, "error": f"unknown op: {op}"}
+
+
+def _worker_main(conn, repo_root: str):
+    """
+    Worker process loop: receive a request, run it, send the response. Exits when the pipe closes.
+    """
+    os.chdir(repo_root)
+    import sys
+    if repo_root not in sys.path:
+        sys.path.insert(0, repo_root)
+    import matplotlib
+    matplotlib.use("Agg")
+    import atomica  # noqa: F401  (import once, up front)
+    from utils import exit_with_parent
+    exit_with_parent()  # the pipe only closes between requests; a dead parent must also stop a running job
+
+    cache: Dict[str, Any] = {}
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg is None or msg.get("op") == "stop":
+            break
+        try:
+            resp = _handle(msg, cache)
+        except Exception as e:
+            resp = {"ok": False, "error": str(e), "trace": traceback.format_exc()}
+        resp["rss_mb"] = _rss_mb()
+        try:
+            conn.send(resp)
+        except (EOFError, OSError):
+            break
+
+
+class EngineWorker:
+    """
+    Handle to one worker process. Not thread-safe: the pool hands each worker to one caller at a time.
+    """
+
+    def __init__(self, max_rss_mb: float = DEFAULT_MAX_RSS_MB):
+        self.max_rss_mb = max_rss_mb
+        self.proc = None
+        self.conn = None
+        self.restarts = 0
+        self.start()
+
+    def start(self):
+        ctx = mp.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        # not daemonic, so engine code in the worker can use process pools (multi-start PSO, validation);
+        # workers exit when the pipe closes, shutdown_pool runs at interpreter exit and, if the parent
+        # is killed, utils.exit_with_parent ends the worker and its pool processes
+        self.proc = ctx.Process(target=_worker_main, args=(child_conn, str(REPO_ROOT)), daemon=False)
+        self.proc.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def stop(self):
+        try:
+            if self.conn is not None:
+                self.conn.send({"op": "stop"})
+        except Exception:
+            pass
+        if self.proc is not None:
+            self.proc.join(timeout=5)
+            if self.proc.is_alive():
+                self.proc.kill()
+                self.proc.join()
+        if self.conn is not None:
+            self.conn.close()
+        self.proc = None
+        self.conn = None
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def request(self, msg: dict, timeout: Optional[float] = None) -> dict:
+        if self.proc is None or not self.proc.is_alive():
+            self.restart()
+        try:
+            self.conn.send(msg)
+            if timeout is not None and not self.conn.poll(timeout):
+                self.restart()
+                return {"ok": False, "error": f"worker timed out after {timeout}s", "worker_error": True}
+            resp = self.conn.recv()
+        except (EOFError, OSError, BrokenPipeError) as e:
+            exitcode = self.proc.exitcode if self.proc is not None else None
+            self.restart()
+            return {"ok": False, "error": f"worker exited (exitcode={exitcode}): {e}", "worker_error": True}
+        if resp.get("rss_mb", 0) > self.max_rss_mb:
+            # recycle before the next job rather than letting the worker keep growing
+            self.restart()
+        return resp
+
+
+class WorkerPool:
+    """
+    Fixed-size pool of EngineWorker processes; run() blocks until a worker is free.
+    """
+
+    def __init__(self, size: int = DEFAULT_WORKERS, max_rss_mb: float = DEFAULT_MAX_RSS_MB):
+        self.size = max(1, int(size))
+        self._idle: "queue.Queue[EngineWorker]" = queue.Queue()
+        self._workers = []
+        for _ in range(self.size):
+            w = EngineWorker(max_rss_mb=max_rss_mb)
+            self._workers.append(w)
+            self._idle.put(w)
+
+    def request(self, msg: dict, timeout: Optional[float] = None) -> dict:
+        w = self._idle.get()
+        try:
+            return w.request(msg, timeout=timeout)
+        finally:
+            self._idle.put(w)
+
+    def run(self, input_path: str, out_dir: str, scenario: Optional[str] = None, options: Optional[dict] = None, run_id: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+        return self.request({"op": "run", "input_path": str(input_path), "out_dir": str(out_dir), "scenario": scenario, "options": options, "run_id": run_id}, timeout=timeout)
+
+    def shutdown(self):
+        for w in self._workers:
+            w.stop()
+        self._workers = []
+
+
+_pool: Optional[WorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> WorkerPool:
+    """
+    Return the process-wide worker pool, starting it on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(DEFAULT_WORKERS, DEFAULT_MAX_RSS_MB)
+            # registered after the workers started, so it runs before multiprocessing's own exit
+            # handler, which would otherwise wait forever on the (non-daemonic) idle workers
+            atexit.register(shutdown_pool)
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def serve_broker(url: str, work_dir: str, poll: float = 1.0, worker_id: Optional[str] = None, max_jobs: Optional[int] = None):
+    """
+    Pull runs from the broker at url and execute them until interrupted (or after max_jobs jobs).
+    Job payload: {project_id, bundle, input, scenario, options}; the result uploaded with the job is
+    {"manifest": run manifest, "files": {relative path: digest}} for the artifacts the manifest lists.
+    """
+    import broker as brokers
+    import run_main
+
+    os.chdir(str(REPO_ROOT))
+    broker = brokers.open_broker(url)
+    worker_id = worker_id or f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    cache: Dict[str, Any] = {}
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        job = broker.claim(worker_id)
+        if job is None:
+            time.sleep(poll)
+            continue
+        stop = threading.Event()
+
+        def beat(job_id=job["id"]):
+            while not stop.wait(broker.lease_seconds / 3):
+                broker.heartbeat(worker_id, job_id)
+
+        threading.Thread(target=beat, daemon=True).start()
+        try:
+            payload = job["payload"]
+            proj = Path(work_dir).resolve() / payload["project_id"]
+            brokers.unpack(broker, payload["bundle"], proj)
+            res = run_main.run_project(str(proj / payload["input"]), str(proj / "outputs"), payload.get("scenario"),
+                                       payload.get("options"), cache=cache, run_id=job["id"])
+            files = brokers.pack_files(broker, proj, brokers.manifest_outputs(proj, res))
+            broker.complete(job["id"], worker_id, {"manifest": res, "files": files})
+        except Exception as e:
+            broker.fail(job["id"], worker_id, f"{e}\n{traceback.format_exc()}")
+        finally:
+            stop.set()
+            os.chdir(str(REPO_ROOT))
+        done += 1
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Standalone engine worker pulling runs from a broker")
+    parser.add_argument("--broker", required=True, help="Broker URL, e.g. sqlite:////shared/carbomica/broker.db")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "carbomica-worker"), help="Where job projects are unpacked")
+    parser.add_argument("--poll", type=float, default=1.0, help="Seconds between polls when the queue is empty")
+    parser.add_argument("--id", default=None, help="Worker id (default: host-pid-random)")
+    args = parser.parse_args()
+    import matplotlib
+    matplotlib.use("Agg")
+    try:
+        serve_broker(args.broker, args.work_dir, poll=args.poll, worker_id=args.id)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
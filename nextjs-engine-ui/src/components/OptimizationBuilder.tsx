@@ -1,11 +1,68 @@
 'use client'
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
+import { evaluateProject, getLastProjectId } from '@/lib/apiClient';
+import type { WhatIfResult } from '@/types';
 
 type Optimization = {
   name: string;
   parameters: Record<string, string>;
 };
 
+// spending sliders with live emissions from POST /projects/{id}/evaluate
+const WhatIfPanel: React.FC = () => {
+  const [projectId] = useState<string | null>(() => getLastProjectId());
+  const [allocation, setAllocation] = useState<Record<string, number>>({});
+  const [result, setResult] = useState<WhatIfResult | null>(null);
+  const [error, setError] = useState<string | null>(null);
+  const timer = useRef<ReturnType<typeof setTimeout> | null>(null);
+
+  useEffect(() => {
+    if (!projectId) return;
+    // debounce slider drags so only the settled allocation is sent
+    if (timer.current) clearTimeout(timer.current);
+    timer.current = setTimeout(() => {
+      evaluateProject(projectId, { allocation })
+        .then((res) => { setResult(res); setError(null); })
+        .catch((err) => setError(err?.response?.data?.detail ?? err.message));
+    }, 150);
+    return () => { if (timer.current) clearTimeout(timer.current); };
+  }, [projectId, allocation]);
+
+  if (!projectId) return null;
+  const fmt = (v: number) => v.toLocaleString(undefined, { maximumFractionDigits: 0 });
+
+  return (
+    <div className="border border-black/5 p-3 rounded-sm mb-4">
+      <div className="flex items-center justify-between mb-2">
+        <h3 className="text-sm font-medium">What-if allocation</h3>
+        {result && (
+          <span className="text-sm text-black/70">
+            {fmt(result.total)} CO2e ({fmt(result.reduction)} below status quo)
+          </span>
+        )}
+      </div>
+      {error && <p className="text-sm text-red-600 mb-2">{error}</p>}
+      <div className="space-y-2">
+        {result?.programs.map((prog) => (
+          <label key={prog.code} className="flex items-center gap-3 text-sm">
+            <span className="w-48 truncate" title={prog.label}>{prog.label}</span>
+            <input
+              type="range"
+              min={0}
+              max={prog.max_spend ?? 100000}
+              step={(prog.max_spend ?? 100000) / 100}
+              value={allocation[prog.code] ?? 0}
+              onChange={(e) => setAllocation({ ...allocation, [prog.code]: Number(e.target.value) })}
+              className="flex-1"
+            />
+            <span className="w-24 text-right">${fmt(allocation[prog.code] ?? 0)}</span>
+          </label>
+        ))}
+      </div>
+    </div>
+  );
+};
+
 const OptimizationBuilder: React.FC = () => {
   const [optimizations, setOptimizations] = useState<Optimization[]>([{ name: '', parameters: {} }]);
 
@@ -50,6 +107,8 @@ const OptimizationBuilder: React.FC = () => {
         </button>
       </div>
 
+      <WhatIfPanel />
+
       <form onSubmit={handleSubmit} className="space-y-4">
         {optimizations.map((optimization, index) => (
           <div key={index} className="border border-black/5 p-3 rounded-sm">
@@ -1,4 +1,5 @@
 import axios from "axios";
+import type { BatchScenario, RunManifest, WhatIfRequest, WhatIfResult } from "@/types";
 const ENGINE_URL = (process.env.NEXT_PUBLIC_ENGINE_URL || 'http://localhost:8000').replace(/\/$/, '');
 
 /* Project / upload */
@@ -60,6 +61,23 @@ export async function getEngineStatus(projectId?: string) {
   return res.data ?? {};
 }
 
+/* Run manifests */
+export async function listRuns(projectId: string) {
+  const res = await axios.get(`${ENGINE_URL}/projects/${encodeURIComponent(projectId)}/runs`);
+  return res.data?.runs ?? [];
+}
+
+export async function getRun(projectId: string, runId: string): Promise<RunManifest> {
+  const res = await axios.get(`${ENGINE_URL}/projects/${encodeURIComponent(projectId)}/runs/${encodeURIComponent(runId)}`);
+  return res.data;
+}
+
+/* Synchronous what-if evaluation (no run is queued; milliseconds once the project is warm) */
+export async function evaluateProject(projectId: string, body: WhatIfRequest = {}): Promise<WhatIfResult> {
+  const res = await axios.post(`${ENGINE_URL}/projects/${encodeURIComponent(projectId)}/evaluate`, body);
+  return res.data;
+}
+
 /* Sheets / inputs */
 export async function getSheet(projectId: string, sheet = 'databook', sheet_name?: string) {
   const res = await axios.get(`${ENGINE_URL}/projects/${projectId}/sheet`, { params: { sheet, sheet_name }});
@@ -118,6 +136,12 @@ export async function runScenario(projectId: string, scenario: string) {
   return res.data ?? {};
 }
 
+/* Run several scenarios as one job on a single project build (default: every saved scenario) */
+export async function runScenarioBatch(projectId: string, scenarios?: (string | BatchScenario)[], workers?: number, options?: Record<string, any>) {
+  const res = await axios.post(`${ENGINE_URL}/projects/${encodeURIComponent(projectId)}/scenarios/run-batch`, { scenarios, workers, options });
+  return res.data ?? {};
+}
+
 export async function listBookSheets(projectId: string, filename: string) {
   const res = await axios.get(`${ENGINE_URL}/projects/${encodeURIComponent(projectId)}/books/${encodeURIComponent(filename)}/sheets`);
   return res.data?.sheets ?? [];
@@ -165,6 +189,9 @@ export default {
   listProjects,
   runEngine,
   getEngineStatus,
+  listRuns,
+  getRun,
+  evaluateProject,
   getSheet,
   saveSheet,
   simulateProject,
@@ -174,6 +201,7 @@ export default {
   listBooks,
   listScenarios,
   runScenario,
+  runScenarioBatch,
   getScenarioTable,
   listBookSheets,
   listGraphs,
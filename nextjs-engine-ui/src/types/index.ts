@@ -32,4 +32,233 @@ export interface PDFReport {
     title: string;
     content: string;
     generatedAt: Date;
-}
\ No newline at end of file
+}
+export interface ProjectClone {
+    project_id: string;
+    parent_id: string;
+    project_name: string;
+    files: number; // files shared with the parent
+    shared_bytes: number; // bytes shared with the parent (no extra disk use until they change)
+    copied_bytes: number;
+    methods: Partial<Record<'reflink' | 'hardlink' | 'copy', number>>;
+}
+
+export type BundleFormat = 'zip' | 'tar.zst';
+
+// POST /projects/import-bundle
+export interface BundleImport {
+    project_id: string;
+    source_id: string; // project id on the exporting instance
+    project_name: string;
+    format: BundleFormat;
+    files: number; // all verified against the bundle's sha256 list
+    bytes: number;
+}
+
+// NDJSON lines of POST /projects/import
+export type ImportEvent =
+    | { event: 'start'; files: number; workers: number }
+    | { event: 'file'; file: string; status: 'invalid'; error: string }
+    | { event: 'file'; file: string; status: 'created'; project_id: string; facility_code: string }
+    | { event: 'books'; file: string; project_id: string; status: 'ok' | 'failed'; seconds?: number; error?: string; done: number; total: number }
+    | { event: 'done'; created: number; invalid: number; books_failed: number; seconds: number }
+    | { event: 'error'; error: string };
+
+export interface RunArtifact {
+    kind: 'table' | 'graph';
+    type: string; // 'emissions' | 'allocation' | ...
+    path: string; // relative to the project folder, e.g. 'graphs/optimization_Emissions_X.png'
+}
+
+export interface ConvergenceTrace {
+    evaluations: number;
+    seconds: number;
+    best: number;
+    stopped: 'time' | 'stall' | null;
+    points: [number, number, number][]; // [evaluations, seconds, best objective]
+}
+
+export interface OptimisationDiagnostics {
+    method: 'atomica' | 'fast' | 'greedy';
+    total: number;
+    greedy_total: number;
+    reference_total?: number;
+    greedy_gap?: number; // fraction by which the greedy allocation's emissions exceed the optimiser's
+    start?: 'greedy' | 'previous'; // 'previous': ASD from the last optimum, PSO skipped
+    pso_seed?: number; // seed of the PSO start that was kept
+    pso_starts?: { seed: number; best: number; stopped: string | null }[];
+    evaluations?: number;
+    unspent?: number;
+    convergence?: Record<string, ConvergenceTrace>; // per stage: pso, asd or fast
+}
+
+export interface InputChange {
+    changed_sheets: string[];
+    changed_cells: number;
+    structural: boolean;
+    small: boolean; // warm start allowed
+    reason?: string; // why the change is not small
+}
+
+export interface OptimumMove {
+    previous_total: number;
+    total: number;
+    total_change: number;
+    relative_change: number | null;
+    allocation_shift: number; // spending moved between interventions
+    shift_fraction: number; // allocation_shift / budget
+}
+
+export interface IncrementalSummary {
+    change: InputChange | null; // null on the first optimisation of a project
+    warm_started: number[];
+    moved: Record<string, OptimumMove>; // per budget
+}
+
+export interface PercentileStats {
+    p5: number;
+    p25: number;
+    p50: number;
+    p75: number;
+    p95: number;
+    mean: number;
+    min: number;
+    max: number;
+}
+
+export interface UncertaintySummary {
+    samples: number;
+    distribution: 'uniform' | 'triangular';
+    percentiles: number[];
+    scenarios: Record<string, PercentileStats>; // status quo, all interventions, each intervention at full coverage
+    budgets: Record<string, PercentileStats>; // point-estimate optimal allocation under sampled inputs
+    budget_values: number[];
+    reoptimised?: Record<string, PercentileStats>;
+    allocations?: Record<string, Record<string, PercentileStats>>;
+    point: { scenarios: Record<string, number>; budgets: Record<string, number>; allocations: Record<string, Record<string, number>> };
+    inputs: Record<string, Record<string, { low: number; point: number; high: number }>>;
+    batches: number;
+    workers: number;
+    seconds: number;
+}
+
+export interface FrontierPoint {
+    budget: number;
+    emissions: number;
+    allocation: Record<string, number>; // spending per intervention label
+    marginal: number | null; // emission reduction per extra dollar since the previous point
+}
+
+export interface FrontierSummary {
+    points: FrontierPoint[]; // sorted by budget
+    min_budget: number;
+    max_budget: number;
+    method: 'fast' | 'greedy';
+    optimiser_calls: number;
+    rounds: number;
+    uniform_points: number; // uniform grid size with the finest spacing used
+    workers: number;
+    seconds: number;
+}
+
+export interface WhatIfRequest {
+    allocation?: Record<string, number>; // spending per intervention code
+    coverage?: Record<string, number>; // fraction covered per intervention code
+}
+
+export interface WhatIfResult {
+    engine: 'evaluator' | 'atomica';
+    total: number;
+    status_quo_total: number;
+    reduction: number;
+    emissions: Record<string, number>; // per emission source
+    programs: { code: string; label: string; spend: number | null; coverage: number | null; max_spend: number | null }[];
+    seconds: number;
+}
+
+export interface DoseResponseSummary {
+    mode: 'coverage' | 'spend';
+    levels: number[];
+    status_quo: number;
+    curves: Record<string, { spend: number[]; coverage: number[]; emissions: number[]; abatement: number[] }>; // per intervention label
+    mac: { program: string; intervention: string; spend: number; abatement: number; cost_per_tonne: number | null; rank: number }[];
+}
+
+export interface BatchScenario {
+    name: string;
+    scenario?: string; // scenario kind; default from spending/budgets, else the name
+    spending?: number;
+    budgets?: number[];
+    options?: Record<string, any>;
+}
+
+export interface BatchEntryResult {
+    name: string;
+    status: 'ok' | 'error';
+    scenario: string | null;
+    spending?: number;
+    budgets?: number[];
+    method?: string;
+    results?: RunManifest['results'];
+    error?: string;
+    seconds: number;
+}
+
+export interface BatchSummary {
+    entries: Record<string, BatchEntryResult>;
+    failed: number;
+    workers: number;
+}
+
+export interface PipelineStage {
+    stage: 'books' | 'project' | 'scenario' | 'charts';
+    status: 'executed' | 'cached' | 'skipped';
+    key: string; // short hash of the stage inputs
+    seconds?: number; // executed stages
+    reason?: string; // why an executed stage was not reused
+}
+
+export interface RunMemory {
+    peak_rss_mb: number; // MiB, peak resident memory of the engine process during the run
+    rss_start_mb: number;
+    rss_end_mb: number;
+    method: 'hwm' | 'sampled'; // kernel high-water mark or periodic sampling
+    children_peak_rss_mb?: number; // largest worker process the run started
+}
+
+export interface RunManifest {
+    run_id: string;
+    project_id?: string;
+    scenario: string | null;
+    options?: Record<string, any> | null;
+    run_key?: string | null; // identical requests are coalesced onto the same run
+    status: 'queued' | 'running' | 'finished' | 'failed';
+    lane?: 'fast' | 'slow'; // scheduler lane, from the estimated cost
+    estimated_seconds?: number;
+    estimated_wait_seconds?: number; // queued / running runs only
+    estimated_start?: string; // ISO time, queued / running runs only
+    position?: number; // place in the dispatch order while queued
+    queued_at?: string;
+    started_at?: string;
+    finished_at?: string;
+    spending?: number;
+    budgets?: number[];
+    method?: string;
+    resumed?: boolean; // continued from an interrupted run's checkpoints
+    pipeline?: PipelineStage[];
+    artifacts?: RunArtifact[];
+    results?: {
+        emissions?: Record<string, Record<string, number>>;
+        totals?: Record<string, number>;
+        allocations?: Record<string, Record<string, number>>;
+        optimisation?: Record<string, OptimisationDiagnostics>;
+        uncertainty?: UncertaintySummary;
+        frontier?: FrontierSummary;
+        dose_response?: DoseResponseSummary;
+        batch?: BatchSummary;
+        incremental?: IncrementalSummary;
+    };
+    timings?: Record<string, number>; // seconds per stage
+    memory?: RunMemory;
+    error?: string;
+}